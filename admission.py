@@ -0,0 +1,287 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from instrumentation import QUANTILES, Histogram, instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Turns running at once across all sessions; matches the chat service's worker pool
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", os.getenv("CHAT_SERVICE_WORKERS", "16")))
+# Turns running at once for one session
+ADMISSION_MAX_PER_SESSION = int(os.getenv("ADMISSION_MAX_PER_SESSION", "1"))
+# Turns waiting for a slot; more are shed straight away
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Seconds a turn may wait for a slot before it is shed
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+
+REJECTION_REASONS = ("overloaded", "timeout", "superseded", "abandoned")
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a turn is not admitted.
+    """
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None):
+        """
+        Args:
+            reason: 'overloaded' if the queue was full, 'timeout' if the turn
+                waited past its deadline, 'superseded' if a newer message for
+                the same session replaced it, 'abandoned' if the caller
+                stopped waiting.
+            retry_after: Suggested seconds to wait before retrying, if any.
+        """
+        messages = {
+            "overloaded": "Too many conversations are in progress",
+            "timeout": "Timed out waiting for a free slot",
+            "superseded": "Replaced by a newer message",
+            "abandoned": "Stopped waiting for a free slot",
+        }
+        super().__init__(messages.get(reason, reason))
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    One turn's place in the admission queue, and then its running slot.
+    """
+
+    def __init__(self, session_id: str, deadline: float):
+        self.session_id = session_id
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.admitted_at: Optional[float] = None
+        # Set when a newer message for the session supersedes this turn
+        self.cancelled = threading.Event()
+        self.rejection: Optional[AdmissionRejected] = None
+        self._notify: Callable[[], None] = lambda: None
+
+    @property
+    def wait(self) -> float:
+        """
+        Seconds spent queued, so far or until admitted.
+        """
+        return (self.admitted_at or time.monotonic()) - self.enqueued_at
+
+
+class AdmissionController:
+    """
+    Admits chat turns under a global and a per-session concurrency limit.
+    Turns that can't run yet wait in a bounded FIFO queue until their
+    deadline; a session's newer message supersedes its queued turn and flags
+    its running one as cancelled, so a user hammering Send holds at most one
+    slot and one queue entry. Usable from threads and from asyncio.
+    """
+
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+                 max_per_session: int = ADMISSION_MAX_PER_SESSION, max_queue: int = ADMISSION_MAX_QUEUE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, max_samples: int = 2048):
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrent: Turns running at once across all sessions.
+            max_per_session: Turns running at once for one session.
+            max_queue: Turns waiting for a slot; more are rejected as overloaded.
+            queue_timeout: Seconds a turn may wait before it is rejected.
+            max_samples: Wait time samples kept for percentiles.
+        """
+        self.max_concurrent = max_concurrent
+        self.max_per_session = max_per_session
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._queue: deque = deque()
+        self._running: Dict[str, List[Ticket]] = {}
+        self._running_count = 0
+        self._lock = threading.Lock()
+        self.wait_times = Histogram(max_samples)
+        self.stats = {"admitted": 0, **{reason: 0 for reason in REJECTION_REASONS}}
+
+    # Callers of the underscored methods hold the lock
+
+    def _can_run(self, session_id: str) -> bool:
+        return (self._running_count < self.max_concurrent
+                and len(self._running.get(session_id, ())) < self.max_per_session)
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.admitted_at = time.monotonic()
+        self._running.setdefault(ticket.session_id, []).append(ticket)
+        self._running_count += 1
+        self.stats["admitted"] += 1
+        self.wait_times.observe(ticket.wait)
+
+    def _reject(self, ticket: Ticket, reason: str) -> None:
+        ticket.rejection = AdmissionRejected(reason, self._retry_after())
+        self.stats[reason] += 1
+        ticket._notify()
+
+    def _retry_after(self) -> float:
+        # Roughly how long the queue takes to drain one slot's worth
+        mean_wait = self.wait_times.total / self.wait_times.count if self.wait_times.count else 1.0
+        return round(max(1.0, mean_wait), 1)
+
+    def _promote(self) -> None:
+        # Admit queued turns in arrival order, skipping sessions at their limit
+        # so one busy session doesn't hold up everyone queued behind it
+        now = time.monotonic()
+        for ticket in list(self._queue):
+            if ticket.deadline <= now:
+                self._queue.remove(ticket)
+                self._reject(ticket, "timeout")
+            elif self._can_run(ticket.session_id):
+                self._queue.remove(ticket)
+                self._start(ticket)
+                ticket._notify()
+            if self._running_count >= self.max_concurrent:
+                break
+
+    def _enqueue(self, session_id: str, timeout: Optional[float], notify: Callable[[], None]) -> Ticket:
+        ticket = Ticket(session_id, time.monotonic() + (self.queue_timeout if timeout is None else timeout))
+        ticket._notify = notify
+        with self._lock:
+            for queued in [queued for queued in self._queue if queued.session_id == session_id]:
+                self._queue.remove(queued)
+                self._reject(queued, "superseded")
+            for running in self._running.get(session_id, ()):
+                running.cancelled.set()
+
+            # Anyone queued is waiting on a limit this turn would hit too,
+            # unless it's their own session's
+            if self._can_run(session_id):
+                self._start(ticket)
+            elif len(self._queue) >= self.max_queue:
+                self.stats["overloaded"] += 1
+                raise AdmissionRejected("overloaded", self._retry_after())
+            else:
+                self._queue.append(ticket)
+        return ticket
+
+    def _withdraw(self, ticket: Ticket, reason: str) -> None:
+        # Does nothing if the ticket was admitted or rejected meanwhile
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                self._reject(ticket, reason)
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Free a finished turn's slot and admit whoever can run next.
+        """
+        with self._lock:
+            running = self._running.get(ticket.session_id, [])
+            if ticket not in running:
+                return
+            running.remove(ticket)
+            if not running:
+                del self._running[ticket.session_id]
+            self._running_count -= 1
+            self._promote()
+
+    def acquire(self, session_id: str, timeout: Optional[float] = None) -> Ticket:
+        """
+        Wait, blocking the thread, for a turn to be admitted. The caller must
+        release the ticket once the turn is over.
+
+        Args:
+            session_id: The session the turn belongs to.
+            timeout: Seconds to wait in the queue. queue_timeout if None.
+
+        Returns:
+            The admitted turn's ticket; its cancelled event is set if a newer
+            message supersedes it while it runs.
+
+        Raises:
+            AdmissionRejected: If the turn was shed, timed out or superseded.
+        """
+        signal = threading.Event()
+        ticket = self._enqueue(session_id, timeout, signal.set)
+        if ticket.admitted_at is None and not signal.wait(max(0.0, ticket.deadline - time.monotonic())):
+            self._withdraw(ticket, "timeout")
+        if ticket.rejection is not None:
+            raise ticket.rejection
+        return ticket
+
+    async def acquire_async(self, session_id: str, timeout: Optional[float] = None) -> Ticket:
+        """
+        Wait without blocking the event loop for a turn to be admitted. See acquire.
+        """
+        loop = asyncio.get_running_loop()
+        signal = asyncio.Event()
+        ticket = self._enqueue(session_id, timeout, lambda: loop.call_soon_threadsafe(signal.set))
+        if ticket.admitted_at is None:
+            try:
+                await asyncio.wait_for(signal.wait(), max(0.0, ticket.deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self._withdraw(ticket, "timeout")
+            except asyncio.CancelledError:
+                # The caller went away while queued
+                self._withdraw(ticket, "abandoned")
+                self.release(ticket)
+                raise
+        if ticket.rejection is not None:
+            raise ticket.rejection
+        return ticket
+
+    @contextmanager
+    def admit(self, session_id: str, timeout: Optional[float] = None):
+        """
+        Acquire a slot for a turn, blocking the thread, and release it on exit. See acquire.
+        """
+        ticket = self.acquire(session_id, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def summary(self) -> Dict:
+        """
+        Summarize running and queued turns, outcomes and queue wait times.
+        """
+        with self._lock:
+            summary = {
+                "running": self._running_count,
+                "queued": len(self._queue),
+                **self.stats,
+                "mean_wait_ms": round(self.wait_times.total / self.wait_times.count * 1000, 2)
+                if self.wait_times.count else 0.0,
+            }
+            for q in QUANTILES:
+                summary[f"p{int(q * 100)}_wait_ms"] = round(self.wait_times.percentile(q) * 1000, 2)
+        return summary
+
+    def render_prometheus(self) -> str:
+        """
+        Render queue depth, running turns, outcomes and queue wait time in the
+        Prometheus text exposition format.
+        """
+        with self._lock:
+            queued, running = len(self._queue), self._running_count
+            stats = dict(self.stats)
+            count, total = self.wait_times.count, self.wait_times.total
+            percentiles = {q: self.wait_times.percentile(q) for q in QUANTILES}
+        lines = [
+            "# TYPE chatbot_admission_queue_depth gauge",
+            f"chatbot_admission_queue_depth {queued}",
+            "# TYPE chatbot_admission_running gauge",
+            f"chatbot_admission_running {running}",
+            "# TYPE chatbot_admission_turns_total counter",
+        ]
+        lines += [f'chatbot_admission_turns_total{{outcome="{outcome}"}} {value}' for outcome, value in stats.items()]
+        lines.append("# TYPE chatbot_admission_wait_seconds summary")
+        lines += [f'chatbot_admission_wait_seconds{{quantile="{q}"}} {value:.6f}' for q, value in percentiles.items()]
+        lines.append(f"chatbot_admission_wait_seconds_count {count}")
+        lines.append(f"chatbot_admission_wait_seconds_sum {total:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide controller shared by the chat service and the Streamlit app,
+# exported on the instrumentation metrics page
+admission = AdmissionController()
+instrumentation.add_collector(admission.render_prometheus)
@@ -1,29 +1,40 @@
 import streamlit as st
-import json
 import logging
-from typing import List, Dict
-import os
 from dotenv import load_dotenv
 
 # Import functionality from chatbot.py
-from chatbot import (
-    tools, client, model, CloudprinterAPIClient,
-    update_conversation_context, call_function
-)
-
-# Load environment variables
-load_dotenv()
+from chatbot import SYSTEM_PROMPT, model, run_turn
+from admission import AdmissionRejected, admission
+from session_log import SessionLog
+from sessions import Session, new_conversation_context, new_token_usage, use_session
+from instrumentation import instrumentation
+from logging_utils import setup_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    filename="streamlit_app.log",  # Log to file instead of console
-    filemode="a"
-)
 logger = logging.getLogger(__name__)
 
+@st.cache_resource
+def configure_process() -> None:
+    """
+    Process-wide setup, run once rather than on every Streamlit rerun: load
+    environment variables, configure logging and expose timing metrics if
+    configured. Clients are created lazily by chatbot on first use.
+    """
+    load_dotenv()
+    # Records are written by a background thread so request threads never
+    # block on the log file
+    setup_logging(filename="streamlit_app.log")
+    instrumentation.start_from_env()
+
+configure_process()
+
+@st.cache_resource
+def get_session_log() -> SessionLog:
+    """
+    The process-wide session log, so conversations survive restarts and can be
+    resumed through the session id in the URL.
+    """
+    return SessionLog()
+
 # Page configuration
 st.set_page_config(
     page_title="Cloudprinter.com Chat Assistant",
@@ -71,46 +82,27 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Resume the conversation named in the URL, e.g. after a restart or reload
+if "session_id" not in st.session_state:
+    resumed = get_session_log().load(st.query_params.get("session", ""))
+    if resumed is None:
+        resumed = Session()
+    else:
+        logger.info(f"Resumed session {resumed.session_id} with {len(resumed.messages)} messages")
+        st.session_state.messages = resumed.messages
+        st.session_state.conversation_context = resumed.context
+        st.session_state.token_usage = resumed.token_usage
+    st.session_state.session_id = resumed.session_id
+    st.query_params["session"] = resumed.session_id
+
 # Initialize session state variables
 if "messages" not in st.session_state:
     st.session_state.messages = [
-        {"role": "system", "content": """
-        You are a helpful and friendly chatbot for Cloudprinter.com. Your role is to assist users in getting accurate price information 
-        for print products. Engage in natural conversation to gather the necessary details like product type, paper specifications, 
-        quantity, and delivery location.
-
-        Always maintain a conversational, helpful, and friendly tone. Ask for one piece of information at a time, and guide the user 
-        through the process step by step.
-
-        When helping users select a product:
-        1. First determine what type of product they want (business cards, books, etc.)
-        2. Use list_all_products to find matching products
-        3. When a product is selected, use get_product_info to fetch details and available options
-        4. For each option type (paper, finish, etc.):
-           - Present the exact available options to the user
-           - When they make a selection, use update_option_selection to record their choice
-        5. Ask for quantity and delivery location
-        6. Use get_quote to get pricing with all selected options
-
-        Make sure to use the exact option references from the API when selecting options. Never make up option references.
-        """}
+        {"role": "system", "content": SYSTEM_PROMPT}
     ]
 
 if "conversation_context" not in st.session_state:
-    st.session_state.conversation_context = {
-        "product_type": None,
-        "product_reference": None,
-        "quantity": None,
-        "paper_type": None,
-        "paper_weight": None,
-        "laminate": None,
-        "country": None,
-        "state": None, 
-        "city": None,
-        "delivery_speed": None,
-        "quote_result": None,
-        "selected_options": []
-    }
+    st.session_state.conversation_context = new_conversation_context()
 
 # Add a flag to track if we've processed the latest message
 if "message_processed" not in st.session_state:
@@ -118,11 +110,7 @@ if "message_processed" not in st.session_state:
 
 # Add token usage tracking
 if "token_usage" not in st.session_state:
-    st.session_state.token_usage = {
-        "prompt_tokens": 0,
-        "completion_tokens": 0,
-        "total_tokens": 0
-    }
+    st.session_state.token_usage = new_token_usage()
 
 # Function to handle sending a message
 def send_message():
@@ -188,87 +176,36 @@ if (st.session_state.messages and
     st.session_state.messages[-1]["role"] == "user" and 
     not st.session_state.message_processed):
     
-    with st.spinner("Thinking..."):
+    with st.spinner("Thinking..."), instrumentation.turn(interface="streamlit"):
+        # Run the agent turn against this browser session's state; the reply
+        # and tool results are appended to the history
+        session = Session(
+            session_id=st.session_state.session_id,
+            messages=st.session_state.messages,
+            context=st.session_state.conversation_context,
+            token_usage=st.session_state.token_usage,
+        )
         try:
             # Mark message as being processed to prevent reprocessing
             st.session_state.message_processed = True
             
-            # Log the current conversation state
-            logger.info(f"Current context: {json.dumps(st.session_state.conversation_context, indent=2)}")
-            logger.info(f"Sending {len(st.session_state.messages)} messages to OpenAI")
-            
-            # Get response from OpenAI with tool calls if needed
-            completion = client.chat.completions.create(
-                model=model,
-                messages=st.session_state.messages,
-                tools=tools,
-                tool_choice="auto",
-            )
-            
-            # Track token usage
-            if hasattr(completion, 'usage') and completion.usage:
-                st.session_state.token_usage['prompt_tokens'] += completion.usage.prompt_tokens
-                st.session_state.token_usage['completion_tokens'] += completion.usage.completion_tokens
-                st.session_state.token_usage['total_tokens'] += completion.usage.total_tokens
-                logger.info(f"Token usage: +{completion.usage.prompt_tokens} prompt, +{completion.usage.completion_tokens} completion")
-            
-            # Extract the assistant's message
-            assistant_message = completion.choices[0].message
-            
-            # Log the assistant's response
-            if assistant_message.tool_calls:
-                logger.info(f"Assistant requested {len(assistant_message.tool_calls)} tool calls")
-            else:
-                logger.info(f"Assistant response: {assistant_message.content}")
-            
-            # Add to the conversation history
-            st.session_state.messages.append(assistant_message.model_dump())
-            
-            # Check if the AI wants to call tools
-            if assistant_message.tool_calls:
-                # Show a spinner while processing
-                with st.spinner("Processing..."):
-                    # Execute each tool call
-                    for tool_call in assistant_message.tool_calls:
-                        function_name = tool_call.function.name
-                        function_args = json.loads(tool_call.function.arguments)
-                        
-                        # Call the function
-                        function_response = call_function(function_name, function_args)
-                        
-                        # Add the function response to messages
-                        st.session_state.messages.append({
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "content": json.dumps(function_response)
-                        })
-                    
-                    # Get a new response that takes into account the function results
-                    logger.info(f"Getting final response after tool calls")
-                    second_completion = client.chat.completions.create(
-                        model=model,
-                        messages=st.session_state.messages,
-                    )
-                    
-                    # Track token usage for the second completion
-                    if hasattr(second_completion, 'usage') and second_completion.usage:
-                        st.session_state.token_usage['prompt_tokens'] += second_completion.usage.prompt_tokens
-                        st.session_state.token_usage['completion_tokens'] += second_completion.usage.completion_tokens
-                        st.session_state.token_usage['total_tokens'] += second_completion.usage.total_tokens
-                        logger.info(f"Token usage: +{second_completion.usage.prompt_tokens} prompt, +{second_completion.usage.completion_tokens} completion")
-                    
-                    final_response = second_completion.choices[0].message.content
-                    logger.info(f"Final response: {final_response}")
-                    
-                    st.session_state.messages.append({"role": "assistant", "content": final_response})
-            
-            # No need to rerun - Streamlit will handle it
+            # Shares the process-wide concurrency limits with every other browser session
+            with admission.admit(session.session_id), use_session(session):
+                run_turn(session.messages)
                 
+        except AdmissionRejected as e:
+            # Shed under load rather than queueing behind everyone else
+            retry = f" Please try again in {e.retry_after:.0f} seconds." if e.retry_after else ""
+            st.session_state.messages.append(
+                {"role": "assistant", "content": f"I'm sorry, we're very busy right now.{retry}"})
+            logger.warning(f"Turn not admitted: {e.reason}")
         except Exception as e:
             # Handle errors
             error_message = f"I'm sorry, I encountered an error: {str(e)}"
             st.session_state.messages.append({"role": "assistant", "content": error_message})
             logger.error(f"Error: {str(e)}")
+        finally:
+            get_session_log().append_turn(session)
             
         # Force a rerun to display the new messages
         st.rerun()
@@ -300,17 +237,19 @@ with st.sidebar:
         - Input tokens: {st.session_state.token_usage['prompt_tokens']}
         - Output tokens: {st.session_state.token_usage['completion_tokens']}
         - Total tokens: {st.session_state.token_usage['total_tokens']}
+        - Cost: ${st.session_state.token_usage.get('cost_usd', 0.0):.4f}
         """)
     
     # Add a reset button
     if st.button("Reset Conversation"):
         st.session_state.messages = [st.session_state.messages[0]]  # Keep only the system message
-        st.session_state.conversation_context = {key: None for key in st.session_state.conversation_context}
-        st.session_state.conversation_context["selected_options"] = []
-        st.session_state.token_usage = {
-            "prompt_tokens": 0,
-            "completion_tokens": 0,
-            "total_tokens": 0
-        }
+        st.session_state.conversation_context = new_conversation_context()
+        st.session_state.token_usage = new_token_usage()
         st.session_state.message_processed = True  # Reset the processing flag
+        get_session_log().reset(Session(
+            session_id=st.session_state.session_id,
+            messages=st.session_state.messages,
+            context=st.session_state.conversation_context,
+            token_usage=st.session_state.token_usage,
+        ))
         logger.info("Conversation reset by user") 
\ No newline at end of file
@@ -0,0 +1,69 @@
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def write_result(result: Dict, output: str = None) -> str:
+    """
+    Write a benchmark result as JSON.
+
+    Args:
+        result: The result, with "benchmark" and "revision" keys.
+        output: The file to write. Defaults to benchmarks/results/<benchmark>-<revision>-<time>.json.
+
+    Returns:
+        The path written.
+    """
+    output = output or os.path.join(
+        RESULTS_DIR, f"{result['benchmark']}-{result['revision']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return output
+
+
+def compare(baseline_path: str, candidate_path: str) -> None:
+    """
+    Print the relative change of every numeric result between two runs.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(candidate_path, "r", encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    print(f"{'metric':48} {baseline['revision']:>12} {candidate['revision']:>12} {'change':>9}")
+    for key, old in baseline["results"].items():
+        new = candidate["results"].get(key)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        print(f"{key:48} {old:>12} {new:>12} {change:>9}")
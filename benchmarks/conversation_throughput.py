@@ -0,0 +1,200 @@
+"""
+End-to-end conversation throughput benchmark.
+
+Drives the real agent loop (chatbot.run_turn and every tool) with N concurrent
+simulated users replaying the scripted conversations in fixtures/conversations,
+against an in-process mock_cloudprinter.py server and the scripted LLM backend.
+
+    python -m benchmarks.conversation_throughput --users 16 --conversations 200
+    python -m benchmarks.conversation_throughput --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from benchmarks.common import REPO_ROOT, compare, git_revision, peak_rss_mb, percentile, write_result
+
+CONVERSATIONS_DIR = os.path.join(REPO_ROOT, "fixtures", "conversations")
+
+
+def run_benchmark(args) -> Dict:
+    workdir = tempfile.mkdtemp(prefix="cloudprinter-bench-")
+
+    # Configure the process before the chatbot builds its clients
+    os.environ["CLOUDPRINTER_API_KEY"] = "benchmark"
+    os.environ["LLM_BACKEND"] = "scripted"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["CATALOG_SNAPSHOT_PATH"] = os.path.join(workdir, "catalog_snapshot.json")
+    os.environ["OPTION_GRAPH_PATH"] = os.path.join(workdir, "option_graphs.json")
+    os.environ["CATALOG_CHANGE_LOG_PATH"] = os.path.join(workdir, "catalog_changes.jsonl")
+    os.environ["SEARCH_INDEX_PATH"] = os.path.join(workdir, "search_index.npz")
+    os.environ["QUOTE_HISTORY_PATH"] = os.path.join(workdir, "quote_history.sqlite3")
+    os.environ["SESSION_LOG_PATH"] = os.path.join(workdir, "sessions.sqlite3")
+    os.environ["TOOL_SUBSETTING_MODE"] = args.tool_subsetting
+
+    from mock_cloudprinter import MockCloudprinterState, generate_catalog, load_fixtures, start_mock_server
+
+    state = MockCloudprinterState(load_fixtures(), latency_ms=args.api_latency_ms,
+                                  jitter_ms=args.api_jitter_ms, seed=0)
+    if args.synthetic_products:
+        state.add_products(*generate_catalog(args.synthetic_products))
+    server, base_url = start_mock_server(state)
+    os.environ["CLOUDPRINTER_BASE_URL"] = base_url
+
+    if args.warm_catalog:
+        # Crawl up front like the warm-up job would; its requests aren't counted
+        from catalog_warmup import CatalogWarmer
+        CatalogWarmer().crawl()
+        state.request_counts.clear()
+
+    scripts = []
+    for path in args.scripts or sorted(glob.glob(os.path.join(CONVERSATIONS_DIR, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            scripts.append(json.load(f))
+    os.environ.setdefault("LLM_SCRIPT_PATH", args.scripts[0] if args.scripts else
+                          os.path.join(CONVERSATIONS_DIR, "business_cards.json"))
+
+    import chatbot
+    from conversation_phase import phase_stats
+    from prompt_assembly import cached_token_ratio
+    from cost_accounting import cost_ledger
+    from model_router import model_router
+    from llm_backend import ScriptedLLMBackend
+    from session_log import SessionLog
+    from sessions import Session, new_token_usage, use_session
+
+    lock = threading.Lock()
+    turn_latencies: List[float] = []
+    usage_totals = new_token_usage()
+    llm_calls = [0]
+    errors = [0]
+    next_conversation = [0]
+    # Turns are persisted as the chat service does, so its cost is measured too
+    session_log = SessionLog()
+
+    def simulated_user(user_index: int) -> None:
+        while True:
+            with lock:
+                number = next_conversation[0]
+                if number >= args.conversations:
+                    return
+                next_conversation[0] += 1
+
+            script = scripts[number % len(scripts)]
+            backend = ScriptedLLMBackend(script["responses"], latency_ms=args.llm_latency_ms)
+            session = Session(f"bench-{user_index}-{number}", llm=backend)
+            session.messages.append({"role": "system", "content": chatbot.SYSTEM_PROMPT})
+
+            latencies = []
+            with use_session(session):
+                for user_input in script["user_turns"]:
+                    session.messages.append({"role": "user", "content": user_input})
+                    started = time.perf_counter()
+                    try:
+                        chatbot.run_turn(session.messages)
+                    except Exception:
+                        with lock:
+                            errors[0] += 1
+                    session_log.append_turn(session)
+                    latencies.append(time.perf_counter() - started)
+
+            with lock:
+                turn_latencies.extend(latencies)
+                llm_calls[0] += backend.calls
+                for key in usage_totals:
+                    usage_totals[key] += session.token_usage.get(key, 0)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        for _ in executor.map(simulated_user, range(args.users)):
+            pass
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    conversations = args.conversations
+    upstream_calls = sum(state.request_counts.values())
+    phases = phase_stats.summary()
+    return {
+        "benchmark": "conversation_throughput",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "users": args.users,
+            "conversations": conversations,
+            "scripts": [script.get("name") for script in scripts],
+            "llm_latency_ms": args.llm_latency_ms,
+            "api_latency_ms": args.api_latency_ms,
+            "api_jitter_ms": args.api_jitter_ms,
+            "synthetic_products": args.synthetic_products,
+            "tool_subsetting": args.tool_subsetting,
+            "warm_catalog": args.warm_catalog,
+        },
+        "results": {
+            "elapsed_s": round(elapsed, 3),
+            "turns": len(turn_latencies),
+            "turn_errors": errors[0],
+            "turns_per_s": round(len(turn_latencies) / elapsed, 2) if elapsed else 0.0,
+            "turn_latency_p50_ms": round(percentile(turn_latencies, 0.5) * 1000, 2),
+            "turn_latency_p95_ms": round(percentile(turn_latencies, 0.95) * 1000, 2),
+            "turn_latency_p99_ms": round(percentile(turn_latencies, 0.99) * 1000, 2),
+            "upstream_calls_per_conversation": round(upstream_calls / conversations, 2),
+            "upstream_calls_by_endpoint": dict(sorted(state.request_counts.items())),
+            "llm_calls_per_conversation": round(llm_calls[0] / conversations, 2),
+            "prompt_tokens_per_conversation": round(usage_totals["prompt_tokens"] / conversations, 1),
+            "completion_tokens_per_conversation": round(usage_totals["completion_tokens"] / conversations, 1),
+            "cached_prompt_token_ratio": round(cached_token_ratio(usage_totals), 3),
+            "cost_usd_per_conversation": round(usage_totals["cost_usd"] / conversations, 6),
+            "cost_usd_by_call": {entry["call"]: entry["cost_usd"] for entry in cost_ledger.breakdown(by=("call",))},
+            "prompt_tokens_by_tool": {entry["tool"] or "-": entry["prompt_tokens"]
+                                      for entry in cost_ledger.breakdown(by=("tool",))},
+            "llm_routes": [{key: entry[key] for key in ("route", "model", "calls", "escalations", "cost_usd", "p50_ms")}
+                           for entry in model_router.summary()],
+            "tool_result_tokens": {tool: counts["result_tokens"]
+                                   for tool, counts in cost_ledger.summary()["tool_results"].items()},
+            "tool_schema_tokens_per_conversation": round(phases["schema_tokens_sent"] / conversations, 1),
+            "tool_schema_tokens_saved_per_conversation": round(phases["schema_tokens_saved"] / conversations, 1),
+            "tool_call_errors_per_conversation": round(phases["tool_errors"] / conversations, 2),
+            "unexposed_tool_calls_per_conversation": round(phases["unexposed_tool_calls"] / conversations, 2),
+            "requests_by_phase": phases["requests_by_phase"],
+            "quote_prefetch_hit_rate": round(chatbot.quote_prefetcher.hit_rate(), 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Conversation throughput benchmark.")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--conversations", type=int, default=100, help="Total conversations to run")
+    parser.add_argument("--scripts", nargs="*", help="Conversation scripts (default: all in fixtures/conversations)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Simulated latency per LLM call")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="Simulated latency per Cloudprinter call")
+    parser.add_argument("--api-jitter-ms", type=float, default=0.0, help="Random extra Cloudprinter latency")
+    parser.add_argument("--synthetic-products", type=int, default=0, help="Extra generated catalog products")
+    parser.add_argument("--tool-subsetting", choices=["schemas", "allowed_tools", "off"], default="schemas",
+                        help="How tools are limited per conversation phase (see conversation_phase.py)")
+    parser.add_argument("--warm-catalog", action="store_true",
+                        help="Crawl the catalog snapshot first, as the warm-up job does in production")
+    parser.add_argument("--output", help="Result file (default: under benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run_benchmark(args)
+    output = write_result(result, args.output)
+    print(json.dumps(result["results"], indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
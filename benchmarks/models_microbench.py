@@ -0,0 +1,202 @@
+"""
+Microbenchmarks for parsing and serializing the models.py API models.
+
+Times construction (Model(**payload), as the API client does), model_dump,
+model_dump_json and json.dumps(model_dump()) per model on synthetic payloads
+of several sizes, and measures allocations for each operation with tracemalloc.
+
+    python -m benchmarks.models_microbench
+    python -m benchmarks.models_microbench --sizes 10 1000 --quick
+    python -m benchmarks.models_microbench --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple, Type
+
+from pydantic import BaseModel
+
+from benchmarks.common import compare, git_revision, peak_rss_mb, write_result
+from mock_cloudprinter import generate_catalog
+from models import Product, ProductInfo, QuoteResponse, ShippingState
+
+DEFAULT_SIZES = [10, 1000, 50000]
+DEFAULT_SHIPMENTS = [1, 50, 500]
+
+
+def quote_payload(shipments: int, quotes_per_shipment: int = 4, items_per_shipment: int = 3) -> Dict:
+    """
+    Build a /orders/quote response with the given number of shipments.
+    """
+    return {
+        "price": "929.6536",
+        "vat": "0.00",
+        "currency": "EUR",
+        "expire_date": "2026-10-21T12:00:00+00:00",
+        "subtotals": {"items": "926.9036", "fee": "2.7500", "app_fee": "0.0000"},
+        "shipments": [
+            {
+                "total_weight": str(1000 + s),
+                "items": [{"reference": f"item-{s}-{i}"} for i in range(items_per_shipment)],
+                "quotes": [
+                    {
+                        "quote": f"{s:08x}{q:056x}",
+                        "service": f"Service {q}",
+                        "shipping_level": f"cp_level_{q}",
+                        "shipping_option": f"Carrier {q + 1} - Service {q}",
+                        "price": f"{4.2 + q * 2.5:.4f}",
+                        "vat": "0.0000",
+                        "currency": "EUR",
+                    }
+                    for q in range(quotes_per_shipment)
+                ],
+            }
+            for s in range(shipments)
+        ],
+        "invoice_currency": "EUR",
+        "invoice_exchange_rate": "1.0000",
+    }
+
+
+def state_payloads(count: int) -> List[Dict]:
+    return [{"state_reference": f"S{i:04d}", "name": f"State {i}", "note": f"State number {i}"}
+            for i in range(count)]
+
+
+def build_cases(sizes: List[int], shipments: List[int]) -> List[Tuple[str, Type[BaseModel], List[Dict]]]:
+    """
+    Build the (name, model, payloads) cases to benchmark.
+    """
+    cases = []
+    for size in sizes:
+        products, product_infos = generate_catalog(size)
+        cases.append((f"Product[{size}]", Product, products))
+        cases.append((f"ProductInfo[{size}]", ProductInfo, list(product_infos.values())))
+        cases.append((f"ShippingState[{size}]", ShippingState, state_payloads(size)))
+    for count in shipments:
+        cases.append((f"QuoteResponse[shipments={count}]", QuoteResponse, [quote_payload(count)]))
+    return cases
+
+
+def time_operation(operation: Callable[[], object], min_time: float, max_repeats: int) -> Dict:
+    """
+    Run an operation repeatedly until min_time has passed (at least once) and
+    return the best and median wall time.
+    """
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < max_repeats and (not timings or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - started)
+    return {"best": min(timings), "median": statistics.median(timings), "repeats": len(timings)}
+
+
+def measure_allocations(operation: Callable[[], object]) -> Dict:
+    """
+    Measure the peak traced memory and the number of allocated blocks kept
+    alive by the operation's result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = operation()
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    retained = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del result
+    return {"peak_kb": peak / 1024, "retained_kb": retained / 1024, "blocks": blocks}
+
+
+def run_case(name: str, model: Type[BaseModel], payloads: List[Dict], min_time: float,
+             max_repeats: int, allocations: bool) -> Dict[str, Dict]:
+    instances = [model(**payload) for payload in payloads]
+    operations = {
+        "construct": lambda: [model(**payload) for payload in payloads],
+        "model_dump": lambda: [instance.model_dump() for instance in instances],
+        "model_dump_json": lambda: [instance.model_dump_json() for instance in instances],
+        "json.dumps": lambda: json.dumps([instance.model_dump() for instance in instances]),
+    }
+
+    results = {}
+    for operation_name, operation in operations.items():
+        timing = time_operation(operation, min_time, max_repeats)
+        result = {
+            "best_ms": round(timing["best"] * 1000, 3),
+            "median_ms": round(timing["median"] * 1000, 3),
+            "per_item_us": round(timing["best"] * 1e6 / len(payloads), 3),
+            "repeats": timing["repeats"],
+        }
+        if allocations:
+            result.update({key: round(value, 1) for key, value in measure_allocations(operation).items()})
+        results[operation_name] = result
+    return results
+
+
+def run_benchmark(args) -> Dict:
+    cases = build_cases(args.sizes, args.shipments)
+    results = {}
+    table = []
+    for name, model, payloads in cases:
+        case_results = run_case(name, model, payloads, args.min_time, args.max_repeats, not args.no_allocations)
+        for operation_name, result in case_results.items():
+            for metric, value in result.items():
+                if metric != "repeats":
+                    results[f"{name}.{operation_name}.{metric}"] = value
+            table.append((name, operation_name, result))
+
+    for name, operation_name, result in table:
+        allocated = f"{result['peak_kb']:>10.1f} KB peak" if "peak_kb" in result else ""
+        print(f"{name:32} {operation_name:16} {result['best_ms']:>10.3f} ms "
+              f"{result['per_item_us']:>9.3f} us/item {allocated}")
+
+    return {
+        "benchmark": "models_microbench",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "sizes": args.sizes,
+            "shipments": args.shipments,
+            "min_time_s": args.min_time,
+            "max_repeats": args.max_repeats,
+            "allocations": not args.no_allocations,
+        },
+        "results": {**results, "peak_rss_mb": round(peak_rss_mb(), 1)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="models.py parsing and serialization microbenchmarks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Product, product info and state list sizes")
+    parser.add_argument("--shipments", type=int, nargs="+", default=DEFAULT_SHIPMENTS,
+                        help="Shipment counts for quote responses")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum seconds to time each operation")
+    parser.add_argument("--max-repeats", type=int, default=200, help="Maximum runs per operation")
+    parser.add_argument("--quick", action="store_true", help="Time each operation only a few times")
+    parser.add_argument("--no-allocations", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--output", help="Result file (default: under benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.quick:
+        args.min_time, args.max_repeats = 0.0, 3
+
+    result = run_benchmark(args)
+    print(f"Results written to {write_result(result, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Startup profile: cold-start cost of importing the chatbot and creating its
+clients, and the per-rerun overhead of the Streamlit app.
+
+Every measurement runs in a fresh interpreter so module caches don't hide the
+cold-start cost. Runs offline with the scripted LLM backend and a dummy API key.
+
+    python -m benchmarks.startup_profile
+    python -m benchmarks.startup_profile --repeats 10 --reruns 20
+    python -m benchmarks.startup_profile --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.common import REPO_ROOT, compare, git_revision, write_result
+
+CHILD_ENV = {
+    "CLOUDPRINTER_API_KEY": "startup-profile",
+    "LLM_BACKEND": "scripted",
+    "LLM_SCRIPT_PATH": os.path.join(REPO_ROOT, "fixtures", "conversations", "business_cards.json"),
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def child_import() -> Dict:
+    started = time.perf_counter()
+    import chatbot
+    imported = time.perf_counter()
+
+    timings = {"import_chatbot_ms": (imported - started) * 1000}
+    for name, create in [
+        ("first_llm_ms", chatbot.current_llm),
+        ("first_cloudprinter_client_ms", chatbot.get_cloudprinter_client),
+        ("first_option_graphs_ms", chatbot.get_option_graphs),
+    ]:
+        started = time.perf_counter()
+        create()
+        timings[name] = (time.perf_counter() - started) * 1000
+    return timings
+
+
+def child_streamlit(reruns: int) -> Dict:
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        return {"skipped": "streamlit is not installed"}
+
+    app = AppTest.from_file(os.path.join(REPO_ROOT, "app.py"), default_timeout=60)
+    started = time.perf_counter()
+    app.run()
+    first = (time.perf_counter() - started) * 1000
+
+    timings = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        app.run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {"app_first_run_ms": first, "app_rerun_median_ms": statistics.median(timings),
+            "app_rerun_best_ms": min(timings)}
+
+
+def run_child(*args: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-m", "benchmarks.startup_profile", "--child", *args]
+    return subprocess.run(command, cwd=REPO_ROOT, env={**os.environ, **CHILD_ENV},
+                          capture_output=True, text=True, check=True)
+
+
+def slowest_imports(stderr: str, count: int) -> List[Dict]:
+    """
+    Parse -X importtime output into the modules with the highest self time.
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        modules.append({"module": name, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    modules.sort(key=lambda module: module["self_ms"], reverse=True)
+    return modules[:count]
+
+
+def run_benchmark(args) -> Dict:
+    samples = [json.loads(run_child("import").stdout) for _ in range(args.repeats)]
+    results = {key: round(statistics.median(sample[key] for sample in samples), 2) for key in samples[0]}
+
+    imports = slowest_imports(run_child("import", importtime=True).stderr, args.top)
+    streamlit = json.loads(run_child("streamlit", str(args.reruns)).stdout)
+    results.update({key: round(value, 2) for key, value in streamlit.items() if key != "skipped"})
+
+    print(f"{'measurement':32} {'median ms':>10}")
+    for key, value in results.items():
+        print(f"{key:32} {value:>10.2f}")
+    if "skipped" in streamlit:
+        print(f"Streamlit reruns skipped: {streamlit['skipped']}")
+    print(f"\n{'slowest imports (self)':48} {'self ms':>8} {'cum ms':>8}")
+    for module in imports:
+        print(f"{module['module'].strip():48} {module['self_ms']:>8.2f} {module['cumulative_ms']:>8.2f}")
+
+    return {
+        "benchmark": "startup_profile",
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"repeats": args.repeats, "reruns": args.reruns, "streamlit": streamlit.get("skipped", "ok")},
+        "results": results,
+        "slowest_imports": imports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile chatbot and app startup.")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters to time the import in")
+    parser.add_argument("--reruns", type=int, default=10, help="Streamlit reruns to time")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--output", help="Result file (default: under benchmarks/results/)")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+                        help="Compare two result files instead of running")
+    parser.add_argument("--child", nargs="+", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        phase = args.child[0]
+        result = child_import() if phase == "import" else child_streamlit(int(args.child[1]))
+        print(json.dumps(result))
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    result = run_benchmark(args)
+    print(f"Results written to {write_result(result, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
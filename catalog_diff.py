@@ -0,0 +1,253 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+
+from models import Product, ProductInfo
+
+logger = logging.getLogger(__name__)
+
+# Where the warm-up job appends every change it finds, one JSON line per
+# change; empty to keep no log
+CATALOG_CHANGE_LOG_PATH = os.getenv("CATALOG_CHANGE_LOG_PATH", "catalog_changes.jsonl")
+
+# /products fields that only affect what a product costs
+PRICE_FIELDS = ("from_price", "currency")
+
+
+def product_info_hash(product_info: ProductInfo) -> str:
+    """
+    Compute a stable content hash for a /products/info result.
+
+    Args:
+        product_info: The product info to hash.
+
+    Returns:
+        A short hex digest that changes whenever any option or spec changes.
+    """
+    payload = json.dumps(product_info.model_dump(), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ChangeKind(str, Enum):
+    """What happened to a product between two catalog snapshots."""
+    ADDED = "added"
+    REMOVED = "removed"
+    MODIFIED = "modified"
+    PRICE_CHANGED = "price_changed"
+
+
+class CatalogChange:
+    """
+    One product's change between two catalog snapshots.
+    """
+
+    def __init__(self, kind: ChangeKind, reference: str, fields: Optional[List[str]] = None,
+                 previous_price: Optional[str] = None, price: Optional[str] = None):
+        """
+        Initialize the change.
+
+        Args:
+            kind: What happened to the product.
+            reference: The product reference.
+            fields: For modified products, the /products fields that changed,
+                plus "options" and/or "specs" if its product info did.
+            previous_price: The starting price before the change.
+            price: The starting price after the change.
+        """
+        self.kind = kind
+        self.reference = reference
+        self.fields = fields or []
+        self.previous_price = previous_price
+        self.price = price
+
+    @property
+    def info_changed(self) -> bool:
+        """
+        Whether the product's options or specs may differ, e.g. for option graphs.
+        """
+        return self.kind in (ChangeKind.ADDED, ChangeKind.REMOVED) or bool(
+            {"options", "specs", "info"} & set(self.fields))
+
+    @property
+    def search_relevant(self) -> bool:
+        """
+        Whether the change affects what the product is matched on in search.
+        """
+        return self.kind != ChangeKind.PRICE_CHANGED
+
+    def to_dict(self) -> Dict:
+        data = {"kind": self.kind.value, "reference": self.reference}
+        if self.fields:
+            data["fields"] = self.fields
+        if self.previous_price != self.price:
+            data["previous_price"] = self.previous_price
+            data["price"] = self.price
+        return data
+
+    def __repr__(self) -> str:
+        return f"CatalogChange({self.to_dict()})"
+
+
+def _changed_info_parts(previous: Optional[ProductInfo], current: Optional[ProductInfo]) -> List[str]:
+    if previous is None or current is None:
+        return ["info"] if previous is not current else []
+    parts = [part for part in ("options", "specs")
+             if [item.model_dump() for item in getattr(previous, part)]
+             != [item.model_dump() for item in getattr(current, part)]]
+    return parts or ["info"]
+
+
+def diff_snapshots(previous, current) -> List[CatalogChange]:
+    """
+    Compare two catalog snapshots product by product, using the content
+    hashes of their /products records and /products/info results.
+
+    Args:
+        previous: The older CatalogSnapshot, or None for a first crawl.
+        current: The newer CatalogSnapshot.
+
+    Returns:
+        The changes, ordered by reference.
+    """
+    previous_hashes = previous.product_hashes if previous else {}
+    previous_info_hashes = previous.info_hashes if previous else {}
+    previous_products: Dict[str, Product] = {p.reference: p for p in previous.products} if previous else {}
+    current_products: Dict[str, Product] = {p.reference: p for p in current.products}
+
+    changes = []
+    for reference in sorted(set(previous_hashes) | set(current.product_hashes)):
+        old, new = previous_products.get(reference), current_products.get(reference)
+        if old is None and new is not None:
+            changes.append(CatalogChange(ChangeKind.ADDED, reference, price=new.from_price))
+            continue
+        if new is None:
+            changes.append(CatalogChange(ChangeKind.REMOVED, reference, previous_price=old.from_price))
+            continue
+
+        fields = []
+        if previous_hashes.get(reference) != current.product_hashes.get(reference):
+            old_fields, new_fields = old.model_dump(), new.model_dump()
+            fields = [field for field in new_fields if old_fields.get(field) != new_fields[field]]
+        if previous_info_hashes.get(reference) != current.info_hashes.get(reference):
+            fields += _changed_info_parts(previous.get_product_info(reference), current.get_product_info(reference))
+        if not fields:
+            continue
+        kind = ChangeKind.PRICE_CHANGED if set(fields) <= set(PRICE_FIELDS) else ChangeKind.MODIFIED
+        changes.append(CatalogChange(kind, reference, fields, old.from_price, new.from_price))
+    return changes
+
+
+def summarize_changes(changes: List[CatalogChange]) -> Dict[str, int]:
+    """
+    Count changes by kind.
+    """
+    counts = {kind.value: 0 for kind in ChangeKind}
+    for change in changes:
+        counts[change.kind.value] += 1
+    return counts
+
+
+Subscriber = Callable[[List[CatalogChange], object], None]
+
+
+class CatalogChangeFeed:
+    """
+    Delivers catalog changes to the caches and indexes derived from the
+    catalog, so they drop or rebuild only what changed. Subscribers run in
+    order on the feed's own thread, never on the publisher's, so publishing
+    is safe from code that holds locks the subscribers need.
+    """
+
+    def __init__(self, max_recent: int = 1000):
+        """
+        Initialize the feed.
+
+        Args:
+            max_recent: Recent changes kept for inspection.
+        """
+        self.recent = deque(maxlen=max_recent)
+        self._subscribers: List[Subscriber] = []
+        self._lock = threading.Lock()
+        self._pending: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        """
+        Register a callback for published changes.
+
+        Args:
+            subscriber: Called with (changes, snapshot), the snapshot being the
+                one the changes lead to. It runs on the feed's thread and its
+                errors are logged, not raised.
+        """
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+    def publish(self, changes: List[CatalogChange], snapshot) -> None:
+        """
+        Queue changes for delivery to every subscriber. Nothing is delivered
+        for an empty list.
+
+        Args:
+            changes: The changes.
+            snapshot: The CatalogSnapshot the changes lead to.
+        """
+        if not changes:
+            return
+        with self._lock:
+            self.recent.extend(changes)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, name="catalog-changes", daemon=True)
+                self._thread.start()
+        logger.info(f"Catalog changes: {summarize_changes(changes)}")
+        self._pending.put((changes, snapshot))
+
+    def flush(self) -> None:
+        """
+        Wait until every change published so far has been delivered.
+        """
+        self._pending.join()
+
+    def _deliver(self) -> None:
+        while True:
+            changes, snapshot = self._pending.get()
+            with self._lock:
+                subscribers = list(self._subscribers)
+            for subscriber in subscribers:
+                try:
+                    subscriber(changes, snapshot)
+                except Exception as e:
+                    logger.error(f"Catalog change subscriber {getattr(subscriber, '__name__', subscriber)} failed: {e}")
+            self._pending.task_done()
+
+
+def append_change_log(changes: List[CatalogChange], path: str = CATALOG_CHANGE_LOG_PATH) -> None:
+    """
+    Append changes to a JSON lines log, each stamped with the time.
+
+    Args:
+        changes: The changes.
+        path: The log file. Nothing is written if empty.
+    """
+    if not changes or not path:
+        return
+    now = time.time()
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            for change in changes:
+                f.write(json.dumps({"time": now, **change.to_dict()}) + "\n")
+    except OSError as e:
+        logger.error(f"Failed to append catalog changes to {path}: {e}")
+
+
+# Process-wide feed: the warm-up job publishes what each crawl changed, and a
+# process that sees a newer snapshot on disk publishes what differs from the
+# one it had loaded
+catalog_changes = CatalogChangeFeed()
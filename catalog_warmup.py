@@ -0,0 +1,374 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables before this module and the project modules below
+# read their settings from it on import, so the warm-up job writes the files
+# the chat process reads
+load_dotenv()
+
+from models import Product, ProductInfo
+from catalog_diff import (
+    CATALOG_CHANGE_LOG_PATH, append_change_log, catalog_changes, diff_snapshots, product_info_hash,
+    summarize_changes
+)
+from cloudprinter_api import CloudprinterAPIClient
+from option_graph import OPTION_GRAPH_PATH, OptionGraphStore
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.json")
+DEFAULT_WORKERS = int(os.getenv("CATALOG_WARMUP_WORKERS", "8"))
+DEFAULT_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "3600"))
+# Product info is only refetched for products whose /products record changed,
+# except on every Nth scheduled crawl, which refetches it all to catch option
+# and spec changes
+FULL_REFRESH_EVERY = int(os.getenv("CATALOG_FULL_REFRESH_EVERY", "24"))
+
+
+def product_hash(product: Product) -> str:
+    """
+    Compute a stable content hash for a product record from /products.
+
+    Args:
+        product: The product to hash.
+
+    Returns:
+        A short hex digest that changes whenever any product field changes.
+    """
+    payload = json.dumps(product.model_dump(), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class CatalogSnapshot:
+    """
+    A persisted crawl of the product catalog: the /products list plus the
+    /products/info result for every reference.
+    """
+
+    def __init__(self, products: List[Product], product_infos: Dict[str, ProductInfo],
+                 product_hashes: Dict[str, str], created_at: Optional[float] = None,
+                 info_hashes: Optional[Dict[str, str]] = None):
+        self.products = products
+        self.product_infos = product_infos
+        self.product_hashes = product_hashes
+        self.created_at = created_at or time.time()
+        # Snapshots written before product info was hashed get their hashes computed here
+        self.info_hashes = info_hashes if info_hashes is not None else {
+            reference: product_info_hash(info) for reference, info in product_infos.items()
+        }
+
+    def get_product_info(self, reference: str) -> Optional[ProductInfo]:
+        """
+        Look up the crawled product info for a reference.
+
+        Args:
+            reference: The product reference.
+
+        Returns:
+            The ProductInfo, or None if the product was not crawled.
+        """
+        return self.product_infos.get(reference)
+
+    def to_dict(self) -> Dict:
+        return {
+            "created_at": self.created_at,
+            "products": [product.model_dump() for product in self.products],
+            "product_hashes": self.product_hashes,
+            "info_hashes": self.info_hashes,
+            "product_infos": {ref: info.model_dump() for ref, info in self.product_infos.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CatalogSnapshot":
+        return cls(
+            products=[Product(**product) for product in data.get("products", [])],
+            product_infos={ref: ProductInfo(**info) for ref, info in data.get("product_infos", {}).items()},
+            product_hashes=data.get("product_hashes", {}),
+            created_at=data.get("created_at"),
+            info_hashes=data.get("info_hashes"),
+        )
+
+    def save(self, path: str = CATALOG_PATH) -> None:
+        """
+        Write the snapshot to disk atomically so readers never see a partial file.
+
+        Args:
+            path: The file to write.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = CATALOG_PATH) -> Optional["CatalogSnapshot"]:
+        """
+        Load a snapshot from disk.
+
+        Args:
+            path: The file to read.
+
+        Returns:
+            The snapshot, or None if the file is missing or unreadable.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Failed to load catalog snapshot from {path}: {e}")
+            return None
+
+
+# Last loaded snapshot, reloaded whenever the file on disk changes
+_snapshot_cache = {"path": None, "mtime": None, "snapshot": None}
+_snapshot_lock = threading.Lock()
+
+
+def current_snapshot(path: str = CATALOG_PATH) -> Optional[CatalogSnapshot]:
+    """
+    Get the most recent catalog snapshot written by the warm-up job.
+
+    The file is only re-read when its modification time changes, so this is
+    cheap enough to call on every tool invocation. When a newer snapshot
+    replaces one already loaded, what differs is published on catalog_changes.
+
+    Args:
+        path: The snapshot file.
+
+    Returns:
+        The snapshot, or None if no crawl has been persisted yet.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    if _snapshot_cache["path"] == path and _snapshot_cache["mtime"] == mtime:
+        return _snapshot_cache["snapshot"]
+
+    previous = snapshot = None
+    with _snapshot_lock:
+        if _snapshot_cache["path"] != path or _snapshot_cache["mtime"] != mtime:
+            previous = _snapshot_cache["snapshot"] if _snapshot_cache["path"] == path else None
+            snapshot = CatalogSnapshot.load(path)
+            _snapshot_cache["snapshot"] = snapshot
+            _snapshot_cache["path"] = path
+            _snapshot_cache["mtime"] = mtime
+        current = _snapshot_cache["snapshot"]
+
+    # Diffed outside the lock; subscribers run on the feed's own thread
+    if previous is not None and snapshot is not None and snapshot.created_at != previous.created_at:
+        catalog_changes.publish(diff_snapshots(previous, snapshot), snapshot)
+    return current
+
+
+class CatalogWarmer:
+    """
+    Crawls the catalog and persists it so the chatbot never pays for a cold fetch.
+    """
+
+    def __init__(self, client: Optional[CloudprinterAPIClient] = None,
+                 path: str = CATALOG_PATH, max_workers: int = DEFAULT_WORKERS,
+                 option_graph_path: str = OPTION_GRAPH_PATH, search_index_path: Optional[str] = None,
+                 change_log_path: str = CATALOG_CHANGE_LOG_PATH):
+        """
+        Initialize the warmer.
+
+        Args:
+            client: The API client to crawl with. Created from the environment if None.
+            path: Where the snapshot is persisted.
+            max_workers: Maximum number of concurrent /products/info requests.
+            option_graph_path: Where the per-product option graphs are persisted.
+            search_index_path: Where the product and option search index is
+                persisted. Defaults to SEARCH_INDEX_PATH.
+            change_log_path: Where each crawl's changes are appended. No log if empty.
+        """
+        self.client = client or CloudprinterAPIClient()
+        self.path = path
+        self.max_workers = max_workers
+        self.option_graph_path = option_graph_path
+        self.search_index_path = search_index_path
+        self.change_log_path = change_log_path
+
+    def _fetch_product_infos(self, references: List[str]) -> Dict[str, ProductInfo]:
+        """
+        Fetch product info for many references with bounded concurrency.
+
+        Args:
+            references: The product references to fetch.
+
+        Returns:
+            A mapping of reference to ProductInfo for every successful fetch.
+        """
+        product_infos = {}
+        if not references:
+            return product_infos
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.client.get_product_info, reference): reference
+                for reference in references
+            }
+            for future in as_completed(futures):
+                reference = futures[future]
+                try:
+                    product_infos[reference] = future.result()
+                except Exception as e:
+                    logger.error(f"Failed to fetch product info for {reference}: {e}")
+
+        return product_infos
+
+    def crawl(self, full: bool = False) -> CatalogSnapshot:
+        """
+        Crawl the catalog, refetching product info only for products that are new
+        or whose /products record changed since the previous crawl, diff it
+        against the previous crawl and update the option graphs and search
+        index for what changed.
+
+        Args:
+            full: Refetch every product's info, to catch option and spec changes
+                that don't show in /products.
+
+        Returns:
+            The new snapshot, which has also been persisted.
+        """
+        started = time.time()
+        previous = CatalogSnapshot.load(self.path)
+        products = self.client.get_products()
+        product_hashes = {product.reference: product_hash(product) for product in products}
+
+        product_infos = {}
+        to_fetch = []
+        for reference, digest in product_hashes.items():
+            if (not full and previous
+                    and previous.product_hashes.get(reference) == digest
+                    and reference in previous.product_infos):
+                product_infos[reference] = previous.product_infos[reference]
+            else:
+                to_fetch.append(reference)
+        fetched = self._fetch_product_infos(to_fetch)
+        product_infos.update(fetched)
+        # A failed fetch keeps the last good info rather than dropping it, so
+        # a transient API error isn't published as a change
+        kept = [reference for reference in to_fetch
+                if reference not in fetched and previous and reference in previous.product_infos]
+        for reference in kept:
+            product_infos[reference] = previous.product_infos[reference]
+        if kept:
+            logger.warning(f"Kept previous product info for {len(kept)} products whose fetch failed")
+
+        info_hashes = {
+            reference: previous.info_hashes[reference]
+            if previous and reference not in fetched and reference in previous.info_hashes
+            else product_info_hash(info)
+            for reference, info in product_infos.items()
+        }
+        snapshot = CatalogSnapshot(products, product_infos, product_hashes, info_hashes=info_hashes)
+        changes = diff_snapshots(previous, snapshot)
+        logger.info(
+            f"Catalog crawl: {len(products)} products, {len(to_fetch)} product infos fetched"
+            f"{' (full refresh)' if full else ''}, changes: {summarize_changes(changes)}"
+        )
+        snapshot.save(self.path)
+        append_change_log(changes, self.change_log_path)
+
+        # Re-index only the changed products' options, keeping invalid
+        # combinations learned from quote errors
+        option_graphs = OptionGraphStore.load(self.option_graph_path)
+        if previous is None or not option_graphs.graphs:
+            option_graphs = OptionGraphStore.build(product_infos, previous=option_graphs,
+                                                   path=self.option_graph_path)
+        else:
+            option_graphs.apply_changes(changes, product_infos)
+        option_graphs.save()
+
+        self._update_search_index(previous, snapshot, changes)
+        catalog_changes.publish(changes, snapshot)
+        logger.info(
+            f"Persisted catalog snapshot to {self.path} "
+            f"({len(product_infos)} product infos) in {time.time() - started:.1f}s"
+        )
+        return snapshot
+
+    def _update_search_index(self, previous: Optional[CatalogSnapshot], snapshot: CatalogSnapshot,
+                             changes: List) -> None:
+        # Imported here so the chatbot, which imports this module, doesn't load NumPy at startup
+        from search_index import SEARCH_INDEX_PATH, CatalogSearchIndex
+        path = self.search_index_path or SEARCH_INDEX_PATH
+
+        # Price changes don't affect matching: keep the index, stamped for the
+        # new snapshot. Any other change rebuilds it, since document weights
+        # depend on the whole catalog
+        index = CatalogSearchIndex.load(path) if previous is not None else None
+        if (index is not None and index.snapshot_created_at == previous.created_at
+                and not any(change.search_relevant for change in changes)):
+            index.snapshot_created_at = snapshot.created_at
+            logger.info("Search index unaffected by the catalog changes; kept")
+        else:
+            index = CatalogSearchIndex.build(snapshot.products, snapshot.product_infos, snapshot.created_at)
+        index.save(path)
+
+    def run_forever(self, interval: int = DEFAULT_INTERVAL, full_every: int = FULL_REFRESH_EVERY) -> None:
+        """
+        Crawl the catalog on a fixed schedule until interrupted.
+
+        Args:
+            interval: Seconds between the start of consecutive crawls.
+            full_every: Refetch all product info on every Nth crawl, starting with the first.
+        """
+        crawls = 0
+        while True:
+            started = time.time()
+            try:
+                self.crawl(full=full_every > 0 and crawls % full_every == 0)
+                crawls += 1
+            except Exception as e:
+                logger.error(f"Catalog crawl failed: {e}")
+            time.sleep(max(0, interval - (time.time() - started)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm up and refresh the Cloudprinter catalog cache.")
+    parser.add_argument("--path", default=CATALOG_PATH, help="Where to persist the catalog snapshot")
+    parser.add_argument("--option-graph-path", default=OPTION_GRAPH_PATH,
+                        help="Where to persist the per-product option graphs")
+    parser.add_argument("--search-index-path", help="Where to persist the product and option search index")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Maximum concurrent /products/info requests")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL,
+                        help="Seconds between refreshes when running on a schedule")
+    parser.add_argument("--once", action="store_true", help="Crawl once and exit")
+    parser.add_argument("--full", action="store_true",
+                        help="With --once, refetch every product's info rather than only changed products")
+    parser.add_argument("--full-every", type=int, default=FULL_REFRESH_EVERY,
+                        help="Refetch all product info on every Nth scheduled crawl (0 never)")
+    parser.add_argument("--change-log-path", default=CATALOG_CHANGE_LOG_PATH,
+                        help="Where each crawl's changes are appended as JSON lines (empty for none)")
+    args = parser.parse_args()
+
+    from logging_utils import setup_logging
+
+    setup_logging()
+
+    warmer = CatalogWarmer(path=args.path, max_workers=args.workers,
+                           option_graph_path=args.option_graph_path, search_index_path=args.search_index_path,
+                           change_log_path=args.change_log_path)
+    if args.once:
+        warmer.crawl(full=args.full)
+    else:
+        warmer.run_forever(args.interval, args.full_every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Headless chat service: the chatbot behind an async HTTP and WebSocket API,
+independent of Streamlit.
+
+HTTP:
+    POST /sessions                      Create a session -> {"session_id": ...}
+    GET  /sessions/{id}                 Conversation context and token usage
+    POST /sessions/{id}/messages        {"message": ...} -> newline-delimited JSON events
+    POST /sessions/{id}/reset           Start the conversation over
+    GET  /health
+
+Sessions are persisted after every turn (see session_log.py), so a session id
+stays valid across restarts: unknown ids are resumed from the session log.
+
+WebSocket (GET /ws), one JSON object per frame:
+    {"type": "create"}                  -> {"type": "session", "session_id": ...}
+    {"type": "message", "session_id": ..., "message": ...} -> event frames
+    {"type": "reset", "session_id": ...} -> {"type": "reset", "session_id": ...}
+
+Events are {"type": "admitted" | "tool_call" | "tool_result" | "reply" | "cancelled" | "error" | "done", ...}.
+Turns run on a worker thread pool through the same chatbot.run_turn the CLI and
+the Streamlit app use; turns for one session run one at a time.
+
+Turns are admitted under global and per-session concurrency limits (see
+admission.py). A turn that can't run yet waits in a bounded queue; a newer
+message for the same session replaces it. Turns that are shed get HTTP 503
+with Retry-After (409 if superseded), or an error frame with a "reason".
+Admitted turns get a TURN_BUDGET_SECONDS budget (see deadlines.py) that bounds
+every LLM and Cloudprinter call; a newer message or a disconnect cancels them.
+
+    python chat_service.py --port 8080
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+
+import chatbot
+from admission import AdmissionController, AdmissionRejected, admission
+from deadlines import Deadline
+from instrumentation import instrumentation
+from logging_utils import setup_logging
+from session_log import SessionLog
+from sessions import Session, SessionStore, use_session
+
+load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
+
+CHAT_SERVICE_WORKERS = int(os.getenv("CHAT_SERVICE_WORKERS", "16"))
+CHAT_SERVICE_MAX_MESSAGE_CHARS = int(os.getenv("CHAT_SERVICE_MAX_MESSAGE_CHARS", "4000"))
+
+_EVENTS_DONE = object()
+
+
+class ChatService:
+    """
+    Runs chatbot turns for stored sessions and streams their progress.
+    """
+
+    def __init__(self, store: SessionStore = None, max_workers: int = CHAT_SERVICE_WORKERS,
+                 log: SessionLog = None, admission_controller: AdmissionController = None):
+        """
+        Initialize the service.
+
+        Args:
+            store: Where active sessions are kept. A new in-memory store if None.
+            max_workers: Maximum number of turns running at once.
+            log: Where sessions are persisted and resumed from. Configured from
+                the environment if None.
+            admission_controller: Decides when turns may run. The process-wide
+                one if None.
+        """
+        self.store = store or SessionStore()
+        self.log = log or SessionLog()
+        self.admission = admission_controller or admission
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-turn")
+        # A lock only needs to live while a turn holds or waits on it
+        self._turn_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def create_session(self) -> Session:
+        return self.store.create(messages=[{"role": "system", "content": chatbot.SYSTEM_PROMPT}])
+
+    async def get_session(self, session_id: str) -> Optional[Session]:
+        """
+        Get an active session, resuming it from the session log if it isn't in memory.
+
+        Returns:
+            The session, or None if it is unknown.
+        """
+        session = self.store.get(session_id)
+        if session is None and session_id:
+            loop = asyncio.get_running_loop()
+            resumed = await loop.run_in_executor(self.executor, self.log.load, session_id)
+            if resumed is not None:
+                # Another request may have resumed it meanwhile; keep that one
+                session = self.store.get(session_id) or self.store.add(resumed)
+                logger.info(f"Resumed session {session_id} with {len(session.messages)} messages")
+        return session
+
+    def _run_turn(self, session: Session, message: str, on_event: Callable[[str, Dict], None],
+                  deadline: Deadline) -> str:
+        with use_session(session), instrumentation.turn(interface="service"):
+            session.messages.append({"role": "user", "content": message})
+            try:
+                return chatbot.run_turn(session.messages, on_event=on_event, deadline=deadline)
+            except Exception as e:
+                logger.error(f"Turn failed for session {session.session_id}: {str(e)}")
+                error_message = f"An error occurred: {str(e)}"
+                session.messages.append({"role": "assistant", "content": error_message})
+                on_event("error", {"message": error_message})
+                return error_message
+            finally:
+                self.log.append_turn(session)
+
+    async def send_message(self, session: Session, message: str):
+        """
+        Run a turn and yield its events as they happen.
+
+        Args:
+            session: The session to run the turn for.
+            message: The user's message.
+
+        Yields:
+            Event dicts, starting with {"type": "admitted"} once the turn may
+            run and ending with {"type": "done"}.
+
+        Raises:
+            AdmissionRejected: Before anything is yielded, if the turn was shed or superseded.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def on_event(event: str, data: Dict) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, {"type": event, **data})
+
+        ticket = await self.admission.acquire_async(session.session_id)
+        # The budget starts once the turn is admitted; a newer message for the
+        # session cancels it through the ticket
+        deadline = Deadline(cancelled=ticket.cancelled)
+        future = None
+        try:
+            yield {"type": "admitted", "wait_ms": round(ticket.wait * 1000, 1)}
+            lock = self._turn_locks.setdefault(session.session_id, asyncio.Lock())
+            async with lock:
+                future = loop.run_in_executor(self.executor, self._run_turn, session, message, on_event, deadline)
+                future.add_done_callback(lambda _: loop.call_soon_threadsafe(queue.put_nowait, _EVENTS_DONE))
+                while True:
+                    event = await queue.get()
+                    if event is _EVENTS_DONE:
+                        break
+                    yield event
+                await future
+        finally:
+            # A turn keeps its slot until its worker is done, even if the
+            # caller went away; then it is cancelled, and stops at its next check
+            if future is None or future.done():
+                self.admission.release(ticket)
+            else:
+                deadline.cancel()
+                future.add_done_callback(lambda _: self.admission.release(ticket))
+        yield {"type": "done", "token_usage": dict(session.token_usage)}
+
+    async def reset(self, session: Session) -> None:
+        async with self._turn_locks.setdefault(session.session_id, asyncio.Lock()):
+            session.reset()
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.log.reset, session)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def _message_error(message) -> str:
+    if not isinstance(message, str) or not message.strip():
+        return "message must be a non-empty string"
+    if len(message) > CHAT_SERVICE_MAX_MESSAGE_CHARS:
+        return f"message is longer than {CHAT_SERVICE_MAX_MESSAGE_CHARS} characters"
+    return None
+
+
+def _rejection(error: AdmissionRejected) -> Dict:
+    return {"error": str(error), "reason": error.reason, "retry_after": error.retry_after}
+
+
+async def _get_session(request: web.Request) -> Session:
+    session = await request.app["service"].get_session(request.match_info["session_id"])
+    if session is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Unknown session"}), content_type="application/json")
+    return session
+
+
+async def create_session(request: web.Request) -> web.Response:
+    session = request.app["service"].create_session()
+    return web.json_response({"session_id": session.session_id}, status=201)
+
+
+async def get_session(request: web.Request) -> web.Response:
+    session = await _get_session(request)
+    return web.json_response({
+        "session_id": session.session_id,
+        "context": session.context,
+        "token_usage": session.token_usage,
+    })
+
+
+async def send_message(request: web.Request) -> web.StreamResponse:
+    session = await _get_session(request)
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        return web.json_response({"error": "Body must be JSON"}, status=400)
+    message = body.get("message") if isinstance(body, dict) else None
+    error = _message_error(message)
+    if error:
+        return web.json_response({"error": error}, status=400)
+
+    # Nothing is streamed until the turn is admitted, so a shed turn gets a plain error response
+    events = request.app["service"].send_message(session, message)
+    try:
+        admitted = await events.__anext__()
+    except AdmissionRejected as e:
+        status = 409 if e.reason == "superseded" else 503
+        headers = {"Retry-After": str(int(e.retry_after + 0.5))} if e.retry_after and status == 503 else None
+        return web.json_response(_rejection(e), status=status, headers=headers)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    await response.write((json.dumps(admitted) + "\n").encode("utf-8"))
+    async for event in events:
+        await response.write((json.dumps(event) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def reset_session(request: web.Request) -> web.Response:
+    session = await _get_session(request)
+    await request.app["service"].reset(session)
+    return web.json_response({"session_id": session.session_id})
+
+
+async def health(request: web.Request) -> web.Response:
+    service: ChatService = request.app["service"]
+    return web.json_response({"status": "ok", "sessions": len(service.store), "admission": service.admission.summary()})
+
+
+async def websocket(request: web.Request) -> web.WebSocketResponse:
+    service: ChatService = request.app["service"]
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+
+    async def stream_turn(session: Session, message: str) -> None:
+        try:
+            async for event in service.send_message(session, message):
+                await ws.send_json({**event, "session_id": session.session_id})
+        except AdmissionRejected as e:
+            await ws.send_json({"type": "error", "message": str(e), "reason": e.reason,
+                                "retry_after": e.retry_after, "session_id": session.session_id})
+
+    # Turns stream concurrently with reading frames, so a newer message can
+    # supersede a queued one
+    turns = set()
+
+    async for frame in ws:
+        if frame.type != WSMsgType.TEXT:
+            continue
+        try:
+            data = json.loads(frame.data)
+        except json.JSONDecodeError:
+            await ws.send_json({"type": "error", "message": "Frames must be JSON"})
+            continue
+        kind = data.get("type") if isinstance(data, dict) else None
+
+        if kind == "create":
+            session = service.create_session()
+            await ws.send_json({"type": "session", "session_id": session.session_id})
+            continue
+
+        session = await service.get_session(data.get("session_id", "")) if kind in ("message", "reset") else None
+        if kind not in ("message", "reset"):
+            await ws.send_json({"type": "error", "message": f"Unknown frame type: {kind}"})
+        elif session is None:
+            await ws.send_json({"type": "error", "message": "Unknown session"})
+        elif kind == "reset":
+            await service.reset(session)
+            await ws.send_json({"type": "reset", "session_id": session.session_id})
+        else:
+            error = _message_error(data.get("message"))
+            if error:
+                await ws.send_json({"type": "error", "message": error})
+                continue
+            turn = asyncio.create_task(stream_turn(session, data["message"]))
+            turns.add(turn)
+            turn.add_done_callback(turns.discard)
+
+    # The client went away: stop waiting for anything still queued
+    for turn in turns:
+        turn.cancel()
+    return ws
+
+
+def create_app(service: ChatService = None) -> web.Application:
+    """
+    Build the aiohttp application.
+
+    Args:
+        service: The chat service to expose. A new one if None.
+
+    Returns:
+        The application.
+    """
+    app = web.Application()
+    app["service"] = service or ChatService()
+    app.router.add_post("/sessions", create_session)
+    app.router.add_get("/sessions/{session_id}", get_session)
+    app.router.add_post("/sessions/{session_id}/messages", send_message)
+    app.router.add_post("/sessions/{session_id}/reset", reset_session)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ws", websocket)
+
+    async def close_service(app: web.Application) -> None:
+        app["service"].close()
+
+    app.on_cleanup.append(close_service)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Cloudprinter chat service.")
+    parser.add_argument("--host", default=os.getenv("CHAT_SERVICE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CHAT_SERVICE_PORT", "8080")))
+    args = parser.parse_args()
+
+    instrumentation.start_from_env()
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,283 +1,126 @@
 import os
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from functools import lru_cache
+from typing import Annotated, List, Dict, Any, Callable, Literal, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
+from pydantic import Field
 import uuid
 
+# Load environment variables before the project modules below read their
+# settings from it on import
+load_dotenv()
+
 from models import (
-    Product, ProductInfo, ProductOption, ProductSpec,
     QuoteRequest, QuoteResponse, QuoteItem, ItemOption,
-    ShippingLevel, ShippingCountry, ShippingState, UserIntent
+    OptionArgument, ConversationContextUpdate
 )
-from cloudprinter_api import CloudprinterAPIClient
-
-# Load environment variables
-load_dotenv()
+from cloudprinter_api import CloudprinterAPIClient, CloudprinterAPIError
+from catalog_diff import CatalogChange, ChangeKind, catalog_changes
+from catalog_warmup import current_snapshot
+from option_graph import OptionGraphStore
+from quote_cache import QuoteCache, QuotePrefetcher, quote_cache_key
+from price_estimator import PriceEstimator
+from product_info_cache import ProductInfoCache, compare_products
+from quote_history import QuoteHistoryStore
+from instrumentation import instrumentation, span
+from cost_accounting import attribute, cost_ledger
+from deadlines import Deadline, DeadlineExceeded, TurnCancelled, check_deadline, use_deadline
+from model_router import disambiguation_reason, extraction_problem, model_router
+from logging_utils import Lazy, LazyJSON, setup_logging
+from llm_backend import LLMBackend, create_backend
+from session_log import SessionLog
+from sessions import Session, current_session, new_conversation_context, use_session
+from tool_registry import ToolRegistry, tool_error
+from conversation_phase import (
+    TOOL_SUBSETTING_MODE, allowed_tools_choice, detect_phase, phase_stats, tools_for_phase
+)
+from prompt_assembly import SYSTEM_PROMPT, assemble_messages
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")  # Default to GPT-4o but allow override
-
-# Initialize Cloudprinter API client
-cloudprinter_client = CloudprinterAPIClient()
-
-# Create a global conversation context to track what we've learned about the user's request
-conversation_context = {
-    "product_type": None,
-    "product_reference": None,
-    "quantity": None,
-    "paper_type": None,
-    "paper_weight": None,
-    "laminate": None,
-    "country": None,
-    "state": None, 
-    "city": None,
-    "delivery_speed": None,
-    "quote_result": None,
-    "selected_options": []
-}
-
-# Add token usage tracking
-token_usage = {
-    "prompt_tokens": 0,
-    "completion_tokens": 0,
-    "total_tokens": 0
-}
+# The model most calls go to; model_router picks the model for each call
+model = model_router.model_for("extraction")
+
+# The process-wide LLM backend (OpenAI unless LLM_BACKEND selects the scripted
+# fake). Built on first use; assign a backend here to override it.
+llm: Optional[LLMBackend] = None
+_llm_lock = threading.Lock()
+
+def current_llm() -> LLMBackend:
+    """
+    Get the LLM backend for the current session, falling back to the process-wide one.
+    """
+    global llm
+    session_llm = current_session().llm
+    if session_llm is not None:
+        return session_llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                llm = create_backend()
+    return llm
+
+@lru_cache(maxsize=None)
+def get_cloudprinter_client() -> CloudprinterAPIClient:
+    """
+    Get the shared Cloudprinter API client, created on first use.
+    """
+    return CloudprinterAPIClient()
+
+@lru_cache(maxsize=None)
+def get_option_graphs() -> OptionGraphStore:
+    """
+    Get the per-product option graphs built during catalog warm-up, loaded on first use.
+    """
+    return OptionGraphStore.load()
+
+# Product info from the snapshot, a TTL cache or the API, one fetch per reference at a time
+product_info_cache = ProductInfoCache(
+    fetch=lambda reference: get_cloudprinter_client().get_product_info(reference),
+    snapshot=current_snapshot,
+)
+
+def get_search_index():
+    """
+    Get the product and option search index for the current catalog snapshot.
+    """
+    # Imported here so NumPy is only loaded once the model searches
+    from search_index import current_index
+    return current_index(current_snapshot(), get_products=lambda: get_cloudprinter_client().get_products())
+
+def reset_conversation_context() -> None:
+    """
+    Clear everything learned about the current session's request, e.g. between
+    replayed conversations.
+    """
+    context = current_session().context
+    context.clear()
+    context.update(new_conversation_context())
+
+# Add token usage tracking (the default session's counters, used by the CLI)
+token_usage = current_session().token_usage
 
 # --------------------------------------------------------------
-# Tool definitions for OpenAI API
+# Tool registry: schemas are generated from the signatures below
 # --------------------------------------------------------------
 
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "list_all_products",
-            "description": "Get a list of all available print products with basic information",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "category": {
-                        "type": "string",
-                        "description": "Filter products by category (e.g., 'Business Cards', 'Textbook BW')"
-                    }
-                },
-                "required": [],
-            },
-        }
-    },
-    {
-        "type": "function", 
-        "function": {
-            "name": "get_product_info",
-            "description": "Get detailed information about a specific product including options and specifications",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "reference": {
-                        "type": "string",
-                        "description": "The unique product reference code"
-                    }
-                },
-                "required": ["reference"],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_shipping_countries",
-            "description": "Get a list of all countries where shipping is available",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": [],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_shipping_states",
-            "description": "Get a list of all states/regions for a specific country",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "country_reference": {
-                        "type": "string",
-                        "description": "The country code (ISO 3166-1 alpha-2)"
-                    }
-                },
-                "required": ["country_reference"],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_shipping_levels",
-            "description": "Get a list of all available shipping options",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": [],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_quote",
-            "description": "Get a price quote for an order",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "product_reference": {
-                        "type": "string",
-                        "description": "The reference code of the product"
-                    },
-                    "quantity": {
-                        "type": "string",
-                        "description": "The quantity of products to order"
-                    },
-                    "country": {
-                        "type": "string",
-                        "description": "The country code (ISO 3166-1 alpha-2) for delivery"
-                    },
-                    "state": {
-                        "type": "string",
-                        "description": "The state code for delivery (required for some countries)",
-                        "default": None
-                    },
-                    "options": {
-                        "type": "array",
-                        "description": "List of product options",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "type": {
-                                    "type": "string",
-                                    "description": "The option type"
-                                },
-                                "count": {
-                                    "type": "string",
-                                    "description": "The count or quantity for this option"
-                                }
-                            }
-                        },
-                        "default": []
-                    }
-                },
-                "required": ["product_reference", "quantity", "country"],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "update_conversation_context",
-            "description": "Update the conversation context with new information gathered from the user",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "product_type": {
-                        "type": "string",
-                        "description": "The type of product (e.g., 'business cards', 'book', 'flyer')"
-                    },
-                    "product_reference": {
-                        "type": "string",
-                        "description": "The reference code for the selected product"
-                    },
-                    "quantity": {
-                        "type": "string",
-                        "description": "The quantity requested by the user"
-                    },
-                    "paper_type": {
-                        "type": "string",
-                        "description": "The type of paper (e.g., 'glossy', 'matte', 'offset')"
-                    },
-                    "paper_weight": {
-                        "type": "string",
-                        "description": "The weight of paper (e.g., '250gsm', '300gsm')"
-                    },
-                    "laminate": {
-                        "type": "string",
-                        "description": "The laminate finish (e.g., 'glossy', 'matte', 'none')"
-                    },
-                    "country": {
-                        "type": "string",
-                        "description": "The delivery country"
-                    },
-                    "state": {
-                        "type": "string",
-                        "description": "The delivery state/region (for countries requiring it)"
-                    },
-                    "city": {
-                        "type": "string",
-                        "description": "The delivery city"
-                    },
-                    "delivery_speed": {
-                        "type": "string",
-                        "description": "The preferred delivery speed (e.g., 'fast', 'standard')"
-                    },
-                    "selected_options": {
-                        "type": "array",
-                        "description": "List of selected product options",
-                        "items": {
-                            "type": "object",
-                            "properties": {
-                                "type": {
-                                    "type": "string"
-                                },
-                                "count": {
-                                    "type": "string"
-                                }
-                            }
-                        }
-                    }
-                },
-                "required": [],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "update_option_selection",
-            "description": "Select a specific option for the product",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "option_type": {
-                        "type": "string",
-                        "description": "The type of option (e.g., 'type_product_material', 'type_sheet_product_finish')"
-                    },
-                    "option_reference": {
-                        "type": "string",
-                        "description": "The reference code of the selected option (e.g., 'paper_300ecb', 'product_finish_gloss')"
-                    }
-                },
-                "required": ["option_type", "option_reference"],
-            },
-        }
-    }
-]
+registry = ToolRegistry()
 
 # --------------------------------------------------------------
 # Tool implementations
 # --------------------------------------------------------------
 
-def list_all_products(category: Optional[str] = None) -> List[Dict]:
+@registry.tool(description="Get a list of all available print products with basic information",
+               parallel_safe=True)
+def list_all_products(
+    category: Annotated[Optional[str], Field(
+        description="Filter products by category (e.g., 'Business Cards', 'Textbook BW')")] = None,
+) -> List[Dict]:
     """
     Get a list of all available products from the Cloudprinter API.
     Uses LLM to intelligently filter products based on user's request.
@@ -289,8 +132,9 @@ def list_all_products(category: Optional[str] = None) -> List[Dict]:
         A list of Product objects as dictionaries.
     """
     try:
-        # Get all products from the API
-        all_products = cloudprinter_client.get_products()
+        # Get all products, preferring the warmed-up catalog snapshot
+        snapshot = current_snapshot()
+        all_products = snapshot.products if snapshot else get_cloudprinter_client().get_products()
         logger.info(f"Retrieved {len(all_products)} total products")
         
         # Create a simplified list with just name and category for LLM processing
@@ -301,7 +145,7 @@ def list_all_products(category: Optional[str] = None) -> List[Dict]:
                 "category": p.category
             })
             
-        logger.info(f"Simplified products: {simplified_products[:20]}")
+        logger.debug("Simplified products: %s", LazyJSON(simplified_products[:20]))
         
         # Determine what user is looking for
         search_term = category 
@@ -326,36 +170,91 @@ def list_all_products(category: Optional[str] = None) -> List[Dict]:
             {"role": "user", "content": llm_prompt}
         ]
         
-        logger.info("Calling GPT-4o-mini to identify matching products")
-        llm_response = client.chat.completions.create(
-            model=model,  # Using GPT-4o as requested
-            messages=messages,
-            temperature=0.3,  # Lower temperature for more consistent results
-        )
-        
-        matching_names = llm_response.choices[0].message.content.strip()
-        logger.info(f"LLM identified these product names: {matching_names}")
-        
-        # Parse the list of names
-        name_list = [name.strip() for name in matching_names.split(',')]
-        
-        # Filter the products based on names returned by the LLM
-        filtered_products = []
-        for product in all_products:
-            if any(name.lower() in product.name.lower() for name in name_list):
-                filtered_products.append(product)
+        escalation, reason = 0, None
+        while True:
+            logger.info("Calling the LLM to identify matching products")
+            llm_response = _complete("filter", current_session().token_usage, escalation, reason,
+                                     messages=messages,
+                                     temperature=0.3,  # Lower temperature for more consistent results
+                                     )
+            
+            matching_names = (llm_response.choices[0].message.content or "").strip()
+            logger.info(f"LLM identified these product names: {matching_names}")
+            
+            # Parse the list of names
+            name_list = [name.strip() for name in matching_names.split(',') if name.strip()]
+            
+            # Filter the products based on names returned by the LLM
+            filtered_products = []
+            for product in all_products:
+                if any(name.lower() in product.name.lower() for name in name_list):
+                    filtered_products.append(product)
+            
+            # Nothing matched: let a larger model try before giving up
+            if filtered_products or not model_router.can_escalate("filter", escalation):
+                break
+            escalation, reason = escalation + 1, f"no products matched '{search_term}'"
                      
         # Log the results
         logger.info(f"Found {len(filtered_products)} products matching '{search_term}'")
-        for i, product in enumerate(filtered_products):
-            logger.info(f"Match {i+1}: {product.name} - Category: {product.category}")      # Return the filtered products
+        logger.debug("Matches: %s", Lazy(lambda: [f"{p.name} - {p.category}" for p in filtered_products]))
+        
+        # Return the filtered products
         return [product.model_dump() for product in filtered_products]
     
+    except (DeadlineExceeded, TurnCancelled):
+        raise
     except Exception as e:
         logger.error(f"Error finding products: {e}")
         return [{"error": str(e)}]
 
-def get_product_info(reference: str) -> Dict:
+@registry.tool(description="Search the catalog for the products, or the options of one product, that best match "
+                           "what the user said. Returns only the few best matches with their references.",
+               parallel_safe=True)
+def search_catalog(
+    query: Annotated[str, Field(
+        description="The user's words, e.g. 'hardcover novel A5' or 'glossy 300 gram'")],
+    product_reference: Annotated[Optional[str], Field(
+        description="Search the options of this product instead of the products")] = None,
+    kind: Annotated[Optional[Literal["product", "option"]], Field(
+        description="Only return products or only options (across all products)")] = None,
+    limit: Annotated[int, Field(description="The most matches to return", ge=1, le=20)] = 5,
+) -> List[Dict]:
+    """
+    Match a phrase to product or option references with the catalog search index.
+    
+    Args:
+        query: The text to match.
+        product_reference: Only match this product's options.
+        kind: Only match products ("product") or options ("option").
+        limit: The number of matches to return.
+        
+    Returns:
+        The best matches with their references and similarity scores, best first.
+    """
+    try:
+        index = get_search_index()
+        if product_reference and not index.has_options(product_reference):
+            # A product the index hasn't seen: index its options on the spot
+            from search_index import CatalogSearchIndex
+            product_info = product_info_cache.get(product_reference)
+            index = CatalogSearchIndex.build([], {product_reference: product_info})
+        if product_reference:
+            kind = "option"
+        matches = index.search([query], limit=limit, kind=kind, product_reference=product_reference)[0]
+        logger.info(f"Search for '{query}' matched {len(matches)} of {len(index)} entries")
+        return matches
+    except (DeadlineExceeded, TurnCancelled):
+        raise
+    except Exception as e:
+        logger.error(f"Error searching the catalog: {e}")
+        return [{"error": str(e)}]
+
+@registry.tool(description="Get detailed information about a specific product including options and specifications",
+               idempotent=True)
+def get_product_info(
+    reference: Annotated[str, Field(description="The unique product reference code")],
+) -> Dict:
     """
     Get detailed information about a specific product from the Cloudprinter API.
     
@@ -366,8 +265,12 @@ def get_product_info(reference: str) -> Dict:
         Product information with options and specifications.
     """
     try:
-        # Get product info from the API
-        product_info = cloudprinter_client.get_product_info(reference)
+        # Get product info, preferring the warmed-up catalog snapshot
+        product_info = product_info_cache.get(reference)
+        
+        # Index the product's options if warm-up hasn't already done so
+        if get_option_graphs().get(reference) is None:
+            get_option_graphs().add(product_info)
         
         # Update the conversation context with the product reference
         update_conversation_context(product_reference=reference)
@@ -390,10 +293,49 @@ def get_product_info(reference: str) -> Dict:
             logger.info(f"Stored {len(option_groups)} option groups in context")
             
         return product_info.model_dump()
+    except (DeadlineExceeded, TurnCancelled):
+        raise
     except Exception as e:
         logger.error(f"Error getting product info: {e}")
         return {"error": str(e)}
 
+@registry.tool(description="Compare several candidate products side by side: their specs and options, with what "
+                           "they have in common listed once. Use it instead of calling get_product_info on each.",
+               idempotent=True, parallel_safe=True)
+def get_product_infos(
+    references: Annotated[List[str], Field(
+        description="The product references to compare", min_length=1, max_length=10)],
+) -> Dict:
+    """
+    Fetch several products' info at once and merge it into one comparison.
+    Unlike get_product_info this doesn't select a product.
+    
+    Args:
+        references: The product references.
+        
+    Returns:
+        The comparison, with an error per reference that couldn't be fetched.
+    """
+    try:
+        fetched = product_info_cache.get_many(references)
+        product_infos = [info for info in fetched.values() if not isinstance(info, Exception)]
+        errors = {reference: str(info) for reference, info in fetched.items() if isinstance(info, Exception)}
+        if not product_infos:
+            return {"error": "; ".join(f"{reference}: {error}" for reference, error in errors.items())}
+        
+        comparison = compare_products(product_infos)
+        if errors:
+            comparison["errors"] = errors
+        logger.info(f"Compared {len(product_infos)} products ({len(errors)} failed)")
+        return comparison
+    except (DeadlineExceeded, TurnCancelled):
+        raise
+    except Exception as e:
+        logger.error(f"Error comparing products: {e}")
+        return {"error": str(e)}
+
+@registry.tool(description="Get a list of all countries where shipping is available",
+               cacheable=True, parallel_safe=True)
 def get_shipping_countries() -> List[Dict]:
     """
     Get a list of all available shipping countries.
@@ -402,13 +344,19 @@ def get_shipping_countries() -> List[Dict]:
         List of shipping countries as dictionaries.
     """
     try:
-        countries = cloudprinter_client.get_shipping_countries()
+        countries = get_cloudprinter_client().get_shipping_countries()
         return [country.model_dump() for country in countries]
+    except (DeadlineExceeded, TurnCancelled):
+        raise
     except Exception as e:
         logger.error(f"Error getting shipping countries: {e}")
         return [{"error": str(e)}]
 
-def get_shipping_states(country_reference: str) -> List[Dict]:
+@registry.tool(description="Get a list of all states/regions for a specific country",
+               cacheable=True, parallel_safe=True)
+def get_shipping_states(
+    country_reference: Annotated[str, Field(description="The country code (ISO 3166-1 alpha-2)")],
+) -> List[Dict]:
     """
     Get a list of all available shipping states for a specific country.
     
@@ -419,12 +367,16 @@ def get_shipping_states(country_reference: str) -> List[Dict]:
         List of shipping states as dictionaries.
     """
     try:
-        states = cloudprinter_client.get_shipping_states(country_reference)
+        states = get_cloudprinter_client().get_shipping_states(country_reference)
         return [state.model_dump() for state in states]
+    except (DeadlineExceeded, TurnCancelled):
+        raise
     except Exception as e:
         logger.error(f"Error getting shipping states: {e}")
         return [{"error": str(e)}]
 
+@registry.tool(description="Get a list of all available shipping options",
+               cacheable=True, parallel_safe=True)
 def get_shipping_levels() -> List[Dict]:
     """
     Get a list of all available shipping levels.
@@ -433,32 +385,175 @@ def get_shipping_levels() -> List[Dict]:
         List of shipping levels as dictionaries.
     """
     try:
-        levels = cloudprinter_client.get_shipping_levels()
+        levels = get_cloudprinter_client().get_shipping_levels()
         return [level.model_dump() for level in levels]
+    except (DeadlineExceeded, TurnCancelled):
+        raise
     except Exception as e:
         logger.error(f"Error getting shipping levels: {e}")
         return [{"error": str(e)}]
 
-def get_quote(product_reference: str, quantity: str, country: str, state: Optional[str] = None, 
-              options: Optional[List[Dict[str, str]]] = None) -> Dict:
+def _request_quote(product_reference: str, quantity: str, country: str, state: Optional[str],
+                   option_references: List[str]) -> QuoteResponse:
+    """
+    Request a single-item quote from the Cloudprinter API.
+    
+    Args:
+        product_reference: The product reference.
+        quantity: The product quantity.
+        country: The delivery country code.
+        state: The delivery state code, if any.
+        option_references: The option references to price with the product.
+    
+    Returns:
+        The QuoteResponse from the API.
+    """
+    quote_request = QuoteRequest(
+        apikey=get_cloudprinter_client().api_key,
+        country=country,
+        state=state,
+        items=[
+            QuoteItem(
+                # Create a unique reference for the quote item
+                reference=f"quote_{uuid.uuid4().hex[:8]}",
+                product=product_reference,
+                count=quantity,
+                # Most options use count=1 for selection
+                options=[ItemOption(type=reference, count="1") for reference in option_references]
+            )
+        ]
+    )
+    
+    logger.info("Sending quote request: %s", Lazy(quote_request.model_dump_json))
+    quote_response = get_cloudprinter_client().get_quote(quote_request)
+    
+    # Every upstream quote, prefetched or not, teaches the price estimator and
+    # is kept in the history (written in the background)
+    resolved = _resolve_options(product_reference, option_references)
+    price_estimator.observe(product_reference, quantity, country, resolved, quote_response)
+    quote_history.record(product_reference, quantity, country, state, resolved,
+                         quote_request.model_dump(exclude={"apikey"}), quote_response)
+    return quote_response
+
+def _resolve_options(product_reference: str, option_references: List[str]) -> frozenset:
+    """
+    Get the full option combination the API prices for a request, defaults included.
+    """
+    graph = get_option_graphs().get(product_reference)
+    if graph:
+        return graph.resolve({graph.type_of.get(ref, ref): ref for ref in option_references})
+    return frozenset(option_references)
+
+# Quote history, the quote cache backed by it, the speculative prefetcher that
+# fills them, and the local estimator that learns from every quote
+quote_history = QuoteHistoryStore()
+quote_cache = QuoteCache(history=quote_history)
+quote_prefetcher = QuotePrefetcher(quote_cache, _request_quote)
+price_estimator = PriceEstimator(load=quote_history.recent)
+
+def _on_catalog_changes(changes: List[CatalogChange], snapshot) -> None:
+    """
+    Drop only what a catalog change made stale: fetched product info and
+    option graphs for products whose options changed, and cached quotes for
+    products that changed at all. The search index follows the snapshot on
+    its own.
+    """
+    for change in changes:
+        if change.info_changed:
+            product_info_cache.invalidate(change.reference)
+        if change.kind != ChangeKind.ADDED:
+            quote_cache.invalidate_product(change.reference)
+    updated = get_option_graphs().apply_changes(changes, snapshot.product_infos)
+    logger.info(f"Applied {len(changes)} catalog changes, {updated} option graphs updated")
+
+catalog_changes.subscribe(_on_catalog_changes)
+
+def _selected_options_by_type() -> Dict[str, str]:
+    """
+    Get the options selected so far as a mapping of option type to reference.
+    """
+    conversation_context = current_session().context
+    return {
+        opt["type"]: opt["reference"]
+        for opt in conversation_context.get("selected_options") or []
+        if isinstance(opt, dict) and "type" in opt and "reference" in opt
+    }
+
+def prefetch_quotes() -> int:
+    """
+    Speculatively quote the likely next option combinations once the product,
+    quantity and destination country are known.
+    
+    Returns:
+        The number of quotes scheduled.
+    """
+    conversation_context = current_session().context
+    product_reference = conversation_context.get("product_reference")
+    quantity = conversation_context.get("quantity")
+    country = conversation_context.get("country")
+    graph = get_option_graphs().get(product_reference)
+    
+    # Only country codes can be quoted; names are resolved by the model first
+    if not (graph and quantity and country and len(country) == 2):
+        return 0
+    
+    return quote_prefetcher.prefetch(
+        graph, _selected_options_by_type(), quantity, country, conversation_context.get("state")
+    )
+
+def _options_rejected(error: CloudprinterAPIError, product_reference: str, quantity: str, country: str,
+                      state: Optional[str], option_references: List[str]) -> bool:
+    """
+    Tell whether a rejected quote was rejected for its options. A 400 also
+    means a bad quantity, country or missing state, which must not mark the
+    options invalid for every later session.
+
+    Args:
+        error: The quote API's error.
+        product_reference: The product reference.
+        quantity: The quoted quantity.
+        country: The delivery country code.
+        state: The delivery state code, if any.
+        option_references: The option references sent with the quote.
+
+    Returns:
+        True if the error names one of the options, or if the same quote with
+        the default options succeeds.
+    """
+    if any(reference in error.text for reference in option_references):
+        return True
+    try:
+        default_quote = _request_quote(product_reference, quantity, country, state, [])
+    except CloudprinterAPIError:
+        return False
+    key = quote_cache_key(product_reference, quantity, country, state,
+                          _resolve_options(product_reference, []))
+    quote_cache.put(key, default_quote)
+    return True
+
+@registry.tool(description="Get a price quote for an order", idempotent=True)
+def get_quote(
+    product_reference: Annotated[str, Field(description="The reference code of the product")],
+    quantity: Annotated[str, Field(description="The quantity of products to order")],
+    country: Annotated[str, Field(description="The country code (ISO 3166-1 alpha-2) for delivery")],
+    state: Annotated[Optional[str], Field(
+        description="The state code for delivery (required for some countries)")] = None,
+    options: Annotated[Optional[List[OptionArgument]], Field(description="List of product options")] = None,
+) -> Dict:
     """
     Get a price quote for a product with the specified options and shipping details.
     """
+    conversation_context = current_session().context
     try:
-        # Create a unique reference for the quote item
-        item_reference = f"quote_{uuid.uuid4().hex[:8]}"
-        
         # Format the options correctly using the stored selections
-        item_options = []
+        option_references = []
         
         # Use the selected options from the conversation context
         if conversation_context.get("selected_options"):
             for option in conversation_context["selected_options"]:
                 if "type" in option and "reference" in option:
-                    item_options.append(ItemOption(
-                        type=option["reference"],  # The reference is the option identifier
-                        count="1"  # Most options use count=1 for selection
-                    ))
+                    # The reference is the option identifier
+                    option_references.append(option["reference"])
                     logger.info(f"Adding option from context: {option['reference']}")
         
         # Add any additional options provided directly
@@ -466,42 +561,92 @@ def get_quote(product_reference: str, quantity: str, country: str, state: Option
             for option in options:
                 if "reference" in option:
                     # Check if this option is already included
-                    if not any(o.type == option["reference"] for o in item_options):
-                        item_options.append(ItemOption(
-                            type=option["reference"],
-                            count="1"
-                        ))
+                    if option["reference"] not in option_references:
+                        option_references.append(option["reference"])
                         logger.info(f"Adding additional option: {option['reference']}")
         
-        # Create the quote request
-        quote_request = QuoteRequest(
-            apikey=cloudprinter_client.api_key,
-            country=country,
-            state=state,
-            items=[
-                QuoteItem(
-                    reference=item_reference,
-                    product=product_reference,
-                    count=quantity,
-                    options=item_options
-                )
-            ]
-        )
-        
-        logger.info(f"Sending quote request: {quote_request.model_dump_json()}")
+        # Key the quote on the full combination the API will price, so a
+        # prefetched quote with explicit defaults matches this request
+        resolved = _resolve_options(product_reference, option_references)
+        key = quote_cache_key(product_reference, quantity, country, state, resolved)
         
-        # Get the quote from the API
-        quote_response = cloudprinter_client.get_quote(quote_request)
+        # Serve from the cache or an in-flight prefetch, otherwise ask the API
+        quote_response = quote_prefetcher.lookup(key)
+        if quote_response is None:
+            quote_response = _request_quote(product_reference, quantity, country, state, option_references)
+            quote_cache.put(key, quote_response)
+        else:
+            logger.info(f"Served quote for {product_reference} from cache")
         
         # Update the conversation context with the quote result
         update_conversation_context(quote_result=quote_response.model_dump())
         
         return quote_response.model_dump()
     
+    except CloudprinterAPIError as e:
+        # A request rejected for its options teaches us an invalid combination
+        graph = get_option_graphs().get(product_reference)
+        if (e.status_code == 400 and graph and option_references
+                and _options_rejected(e, product_reference, quantity, country, state, option_references)):
+            get_option_graphs().record_invalid(product_reference, option_references)
+            get_option_graphs().save()
+            logger.info(f"Recorded invalid option combination for {product_reference}")
+        logger.error(f"Error getting quote: {e}")
+        return {"error": str(e)}
+    except (DeadlineExceeded, TurnCancelled):
+        raise
     except Exception as e:
         logger.error(f"Error getting quote: {e}")
         return {"error": str(e)}
 
+@registry.tool(description="Estimate a price instantly from past quotes, for ballpark questions like 'roughly how "
+                           "much for 500?'. Tell the user it is an estimate; the exact quote is fetched in the "
+                           "background and get_quote returns it without delay.")
+def estimate_price(
+    product_reference: Annotated[str, Field(description="The reference code of the product")],
+    quantity: Annotated[str, Field(description="The quantity of products to estimate")],
+    country: Annotated[Optional[str], Field(
+        description="The country code (ISO 3166-1 alpha-2) for delivery, to estimate shipping")] = None,
+    state: Annotated[Optional[str], Field(
+        description="The state code for delivery (required for some countries)")] = None,
+) -> Dict:
+    """
+    Estimate the price of a product with the selected options, locally.
+    
+    Args:
+        product_reference: The product reference.
+        quantity: The quantity.
+        country: The delivery country code, if known.
+        state: The delivery state code, if any.
+    
+    Returns:
+        The estimate, marked "estimate": true, with its range and basis.
+    """
+    try:
+        option_references = list(_selected_options_by_type().values())
+        resolved = _resolve_options(product_reference, option_references)
+        snapshot = current_snapshot()
+        product = next((p for p in snapshot.products if p.reference == product_reference), None) if snapshot else None
+        estimate = price_estimator.estimate(product_reference, quantity, country, resolved, product)
+        
+        # Start the authoritative quote so get_quote can serve it straight away
+        if country and len(country) == 2:
+            quote_prefetcher.fetch_in_background(product_reference, quantity, country, state, resolved)
+            key = quote_cache_key(product_reference, quantity, country, state, resolved)
+            estimate["exact_quote"] = "ready" if quote_cache.get(key) is not None else "fetching"
+        logger.info(f"Estimated {product_reference} x {quantity}: {estimate.get('price')} ({estimate.get('basis')})")
+        return estimate
+    except ValueError as e:
+        logger.error(f"Error estimating price: {e}")
+        return {"error": f"Cannot estimate a price for quantity {quantity!r}: {e}"}
+    except (DeadlineExceeded, TurnCancelled):
+        raise
+    except Exception as e:
+        logger.error(f"Error estimating price: {e}")
+        return {"error": str(e)}
+
+@registry.tool(description="Update the conversation context with new information gathered from the user",
+               arguments=ConversationContextUpdate)
 def update_conversation_context(**kwargs) -> Dict:
     """
     Update the conversation context with new information.
@@ -512,7 +657,7 @@ def update_conversation_context(**kwargs) -> Dict:
     Returns:
         The updated context.
     """
-    global conversation_context
+    conversation_context = current_session().context
     
     # Update only the keys that are provided
     for key, value in kwargs.items():
@@ -531,11 +676,22 @@ def update_conversation_context(**kwargs) -> Dict:
             conversation_context[key] = value
     
     # Log the updated context
-    logger.info(f"Updated conversation context: {json.dumps(conversation_context, indent=2)}")
+    logger.info("Updated conversation context keys: %s", ", ".join(kwargs))
+    logger.debug("Updated conversation context: %s", LazyJSON(conversation_context, indent=2))
+    
+    # Warm the quote cache once product, quantity and country are known
+    if "quote_result" not in kwargs:
+        prefetch_quotes()
     
     return conversation_context
 
-def update_option_selection(option_type: str, option_reference: str) -> Dict:
+@registry.tool(description="Select a specific option for the product", idempotent=True)
+def update_option_selection(
+    option_type: Annotated[str, Field(
+        description="The type of option (e.g., 'type_product_material', 'type_sheet_product_finish')")],
+    option_reference: Annotated[str, Field(
+        description="The reference code of the selected option (e.g., 'paper_300ecb', 'product_finish_gloss')")],
+) -> Dict:
     """
     Update the selected option for a specific option type.
     
@@ -544,14 +700,23 @@ def update_option_selection(option_type: str, option_reference: str) -> Dict:
         option_reference: The reference code of the selected option
         
     Returns:
-        The updated conversation context
+        The updated conversation context, or an error if the product's option
+        graph rejects the choice
     """
-    global conversation_context
+    conversation_context = current_session().context
     
     # Initialize selected options if not already present
     if "selected_options" not in conversation_context:
         conversation_context["selected_options"] = []
     
+    # Validate the choice locally before it can cause a failed quote round trip
+    graph = get_option_graphs().get(conversation_context.get("product_reference"))
+    if graph:
+        error = graph.validate_choice(option_type, option_reference, _selected_options_by_type())
+        if error:
+            logger.info(f"Rejected option selection {option_type} = {option_reference}: {error}")
+            return {"error": error}
+    
     # Remove any existing options of the same type
     conversation_context["selected_options"] = [
         opt for opt in conversation_context["selected_options"] 
@@ -566,6 +731,9 @@ def update_option_selection(option_type: str, option_reference: str) -> Dict:
     
     logger.info(f"Updated option selection: {option_type} = {option_reference}")
     
+    # Warm the quote cache for the next question
+    prefetch_quotes()
+    
     return conversation_context
 
 def call_function(name, arguments):
@@ -577,24 +745,18 @@ def call_function(name, arguments):
         arguments: The arguments to pass to the function.
     
     Returns:
-        The result of the function call.
-    """
-    function_map = {
-        "list_all_products": list_all_products,
-        "get_product_info": get_product_info,
-        "get_shipping_countries": get_shipping_countries,
-        "get_shipping_states": get_shipping_states,
-        "get_shipping_levels": get_shipping_levels,
-        "get_quote": get_quote,
-        "update_conversation_context": update_conversation_context,
-        "update_option_selection": update_option_selection
-    }
-    
-    if name not in function_map:
-        raise ValueError(f"Unknown function: {name}")
-    
-    logger.info(f"Calling function {name} with args: {json.dumps(arguments, indent=2)}")
-    result = function_map[name](**arguments)
+        The result of the function call, or {"error": ...} if the turn was
+        cancelled or ran out of time.
+    """
+    logger.info("Calling function %s with args: %s", name, LazyJSON(arguments))
+    try:
+        check_deadline()
+        with span("tool", tool=name):
+            result = registry.call(name, arguments)
+    except (DeadlineExceeded, TurnCancelled) as e:
+        # Every tool call still gets a result, so the history stays valid
+        logger.info(f"Function {name} stopped: {e}")
+        return {"error": str(e)}
     
     # For large results, log a summary instead of the full result
     if name == "list_all_products":
@@ -613,35 +775,245 @@ def call_function(name, arguments):
 # Chat loop
 # --------------------------------------------------------------
 
-def run_chat_loop():
+# Guards every usage counter's read-modify-write updates
+_usage_lock = threading.Lock()
+
+def _track_usage(completion, usage: Dict, call: str, call_model: str) -> Optional[Dict]:
     """
-    Run an interactive chat loop that handles user input, API calls, and responses.
+    Add a completion's token usage and cost to a usage counter and record it
+    in the cost ledger.
+
+    Args:
+        completion: The completion.
+        usage: The usage counter, e.g. the session's.
+        call: What the call was for, i.e. its model_router route.
+        call_model: The model the call went to.
+
+    Returns:
+        The cost ledger record, or None if the completion reported no usage.
+    """
+    record = cost_ledger.record_completion(call_model, call, completion)
+    if record is not None:
+        # Parallel-safe tools make LLM calls for the same session at once
+        with _usage_lock:
+            usage['prompt_tokens'] += record['prompt_tokens']
+            usage['completion_tokens'] += record['completion_tokens']
+            usage['total_tokens'] += record['prompt_tokens'] + record['completion_tokens']
+            
+            # Prompt tokens the provider served from its prefix cache
+            usage['cached_tokens'] = usage.get('cached_tokens', 0) + record['cached_tokens']
+            usage['cost_usd'] = usage.get('cost_usd', 0.0) + record['cost_usd']
+        logger.info(f"Token usage ({call}): +{record['prompt_tokens']} prompt ({record['cached_tokens']} cached), "
+                    f"+{record['completion_tokens']} completion, ${record['cost_usd']:.6f}")
+    return record
+
+def _complete(route: str, usage: Dict, escalation: int = 0, reason: Optional[str] = None, **kwargs) -> Any:
+    """
+    Make an LLM call on the model model_router picks for it, tracking its
+    usage, cost and latency.
+
+    Args:
+        route: The kind of call: 'filter', 'extraction', 'wording' or 'disambiguation'.
+        usage: The usage counter to add the call's tokens to.
+        escalation: How many tiers above the route's own model to use.
+        reason: Why the call was escalated.
+        **kwargs: Passed to the backend's create().
+
+    Returns:
+        The completion.
+    """
+    call_model = model_router.model_for(route, escalation)
+    started = time.perf_counter()
+    with span("openai.chat", call=route, model=call_model):
+        try:
+            completion = current_llm().create(model=call_model, **kwargs)
+        except Exception:
+            # A call cut short by the turn's deadline or cancellation ends the turn
+            check_deadline()
+            raise
+    latency = time.perf_counter() - started
+    record = _track_usage(completion, usage, call=route, call_model=call_model)
+    model_router.record(route, call_model, latency, record["cost_usd"] if record else 0.0,
+                        escalated=escalation > 0, reason=reason)
+    return completion
+
+def _ignore_event(event: str, data: Dict) -> None:
+    pass
+
+def run_turn(messages: List[Dict], usage: Optional[Dict] = None,
+             on_event: Optional[Callable[[str, Dict], None]] = None,
+             deadline: Optional[Deadline] = None, tool_names: Optional[List[str]] = None) -> str:
+    """
+    Generate the assistant's reply to the latest user message, executing any
+    tool calls the model requests along the way.
+    
+    Args:
+        messages: The conversation so far, ending with the user's message. The
+                  assistant's messages and tool results are appended in place.
+        usage: Token counters to add this turn's usage to. Defaults to the
+               current session's token usage.
+        on_event: Called with (event, data) as the turn progresses: "tool_call"
+                  before each tool runs, "tool_result" after it, "reply" with the
+                  assistant's reply, and "cancelled" if the turn was cancelled.
+        deadline: The turn's time budget and cancellation flag, which bound
+                  every LLM and Cloudprinter call it makes. A new
+                  TURN_BUDGET_SECONDS deadline if None.
+        tool_names: Only offer these tools, e.g. for a front end with a
+                  narrower scope. The tools for the conversation phase if None.
+    
+    Returns:
+        The assistant's reply.
     """
-    global token_usage
+    if usage is None:
+        usage = current_session().token_usage
+    if on_event is None:
+        on_event = _ignore_event
+    if deadline is None:
+        deadline = Deadline()
     
+    # Attribute this turn's LLM calls to the session and the turn's number in it
+    turn = sum(1 for message in messages if message.get("role") == "user")
+    with attribute(session=current_session().session_id, turn=turn), use_deadline(deadline):
+        try:
+            return _run_turn(messages, usage, on_event, tool_names)
+        except (DeadlineExceeded, TurnCancelled) as e:
+            # Tools the model asked for have all answered by now, so the
+            # history stays valid for the next turn
+            logger.warning(f"Turn stopped: {e}")
+            if isinstance(e, TurnCancelled):
+                reply = "This request was cancelled."
+                on_event("cancelled", {"message": str(e)})
+            else:
+                reply = "I'm sorry, that took longer than expected. Please try again."
+                on_event("reply", {"content": reply})
+            messages.append({"role": "assistant", "content": reply})
+            return reply
+
+def _run_turn(messages: List[Dict], usage: Dict, on_event: Callable[[str, Dict], None],
+              only_tools: Optional[List[str]] = None) -> str:
+    # Log the current conversation state
+    logger.debug("Current conversation context: %s", LazyJSON(current_session().context, indent=2))
+    logger.info(f"Sending {len(messages)} messages to the LLM")
+    
+    # Only offer the tools that are relevant at this point in the conversation
+    context = current_session().context
+    phase = detect_phase(context, get_option_graphs().get(context.get("product_reference")))
+    tool_names = tools_for_phase(phase, registry.tools) if TOOL_SUBSETTING_MODE != "off" else None
+    if only_tools is not None:
+        # The front end's own scope replaces the phase's
+        tool_names = sent_names = list(only_tools)
+        tool_choice = "auto"
+    elif TOOL_SUBSETTING_MODE == "allowed_tools" and tool_names is not None:
+        # Keep the schema list, and so the cached prompt prefix, identical
+        sent_names, tool_choice = None, allowed_tools_choice(tool_names)
+    else:
+        sent_names, tool_choice = tool_names, "auto"
+    phase_stats.record_request(phase, len(registry.schema_json(sent_names)), len(registry.schema_json()))
+    logger.info(f"Conversation phase: {phase.value}")
+    
+    # Get a response from the AI with tool calls if needed; output a small
+    # model couldn't get right is retried on a larger one
+    escalation, reason = 0, None
+    while True:
+        completion = _complete(
+            "extraction", usage, escalation, reason,
+            messages=assemble_messages(messages, context),
+            tools=registry.schemas(sent_names),
+            tool_choice=tool_choice,
+        )
+        reason = extraction_problem(completion.choices[0].message, registry.tools)
+        if reason is None or not model_router.can_escalate("extraction", escalation):
+            break
+        escalation += 1
+    
+    # Extract the assistant's message
+    assistant_message = completion.choices[0].message
+    
+    # Log the assistant's response
+    if assistant_message.tool_calls:
+        logger.info(f"Assistant requested {len(assistant_message.tool_calls)} tool calls")
+    else:
+        logger.info(f"Assistant response: {assistant_message.content}")
+    
+    # Add to the conversation history
+    with span("model_dump", site="assistant_message"):
+        messages.append(assistant_message.model_dump())
+    
+    # If no tool calls, the assistant's message is the reply
+    if not assistant_message.tool_calls:
+        on_event("reply", {"content": assistant_message.content})
+        return assistant_message.content
+    
+    # Parse the tool calls' arguments
+    calls = []
+    for tool_call in assistant_message.tool_calls:
+        with span("json.loads", site="tool_arguments"):
+            calls.append((tool_call.function.name, json.loads(tool_call.function.arguments)))
+    
+    def run_tool(function_name: str, function_args: Dict) -> Any:
+        on_event("tool_call", {"name": function_name, "arguments": function_args})
+        with attribute(tool=function_name):
+            function_response = call_function(function_name, function_args)
+        error = tool_error(function_response)
+        phase_stats.record_tool_call(tool_names is None or function_name in tool_names, error)
+        on_event("tool_result", {"name": function_name, "error": error})
+        return function_response
+    
+    # Execute the tool calls; parallel-safe tools run concurrently
+    results = registry.execute(calls, call=run_tool)
+    
+    # Add the function responses to messages
+    for tool_call, function_response in zip(assistant_message.tool_calls, results):
+        with span("json.dumps", site="tool_result"):
+            content = json.dumps(function_response)
+        cost_ledger.record_tool_result(tool_call.function.name, content)
+        messages.append({
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "content": content
+        })
+    
+    # Every tool call has its result, so a turn cancelled or out of time
+    # during the tools can stop here rather than ask the model again
+    check_deadline()
+    
+    # Get a new response that takes into account the function results;
+    # failed tools and ambiguous matches go to the disambiguation route
+    reason = disambiguation_reason(calls, results)
+    logger.info(f"Getting final response after tool calls" + (f" ({reason})" if reason else ""))
+    second_completion = _complete(
+        "disambiguation" if reason else "wording", usage,
+        messages=assemble_messages(messages, context),
+    )
+    
+    final_response = second_completion.choices[0].message.content
+    logger.info(f"Final response: {final_response}")
+    
+    messages.append({"role": "assistant", "content": final_response})
+    on_event("reply", {"content": final_response})
+    return final_response
+
+def run_chat_loop(session_id: Optional[str] = None):
+    """
+    Run an interactive chat loop that handles user input, API calls, and responses.
+
+    Args:
+        session_id: Persist the conversation under this id, resuming it if it
+            was persisted before. Not persisted if None.
+    """
+    session_log = SessionLog() if session_id else None
+    session = current_session()
+    if session_log:
+        session = session_log.load(session_id) or Session(session_id)
+        if session.messages:
+            print(f"Resumed session {session_id} with {len(session.messages)} messages")
+
     # Initialize the conversation
-    messages = [
-        {"role": "system", "content": """
-        You are a helpful and friendly chatbot for Cloudprinter.com. Your role is to assist users in getting accurate price information 
-        for print products. Engage in natural conversation to gather the necessary details like product type, paper specifications, 
-        quantity, and delivery location.
-
-        Always maintain a conversational, helpful, and friendly tone. Ask for one piece of information at a time, and guide the user 
-        through the process step by step.
-
-        When helping users select a product:
-        1. First determine what type of product they want (business cards, books, etc.)
-        2. Use list_all_products to find matching products
-        3. When a product is selected, use get_product_info to fetch details and available options
-        4. For each option type (paper, finish, etc.):
-           - Present the exact available options to the user
-           - When they make a selection, use update_option_selection to record their choice
-        5. Ask for quantity and delivery location
-        6. Use get_quote to get pricing with all selected options
-
-        Make sure to use the exact option references from the API when selecting options. Never make up option references.
-        """}
-    ]
+    messages = session.messages
+    if not messages:
+        messages.append({"role": "system", "content": SYSTEM_PROMPT})
+    
+    instrumentation.start_from_env()
     
     print("\nCloudprinter.com Chat Assistant")
     print("Type 'exit' or 'quit' to end the conversation\n")
@@ -656,96 +1028,39 @@ def run_chat_loop():
             # Display token usage statistics before exiting
             print(f"\nToken Usage Statistics:")
             print(f"Model: {model}")
-            print(f"Input tokens: {token_usage['prompt_tokens']}")
-            print(f"Output tokens: {token_usage['completion_tokens']}")
-            print(f"Total tokens: {token_usage['total_tokens']}")
+            print(f"Input tokens: {session.token_usage['prompt_tokens']}")
+            print(f"Output tokens: {session.token_usage['completion_tokens']}")
+            print(f"Total tokens: {session.token_usage['total_tokens']}")
+            print(f"Cost: ${session.token_usage.get('cost_usd', 0.0):.4f}")
+            print(f"Cost by tool: {cost_ledger.breakdown(by=('tool', 'call'), session=session.session_id)}")
+            print(f"Quote prefetch hit rate: {quote_prefetcher.hit_rate():.0%} ({quote_prefetcher.stats})")
+            print(f"Tool subsetting: {phase_stats.summary()}")
+            print(f"Price estimator: {price_estimator.summary()}")
+            print(f"Model routes: {model_router.summary()}")
             break
         
         # Add the user's message to the conversation
         messages.append({"role": "user", "content": user_input})
         
-        try:
-            # Log the current conversation state
-            logger.info(f"Current conversation context: {json.dumps(conversation_context, indent=2)}")
-            logger.info(f"Sending {len(messages)} messages to OpenAI")
-            
-            # Get a response from the AI with tool calls if needed
-            completion = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                tools=tools,
-                tool_choice="auto",
-            )
-            
-            # Track token usage
-            if hasattr(completion, 'usage') and completion.usage:
-                token_usage['prompt_tokens'] += completion.usage.prompt_tokens
-                token_usage['completion_tokens'] += completion.usage.completion_tokens
-                token_usage['total_tokens'] += completion.usage.total_tokens
-                logger.info(f"Token usage: +{completion.usage.prompt_tokens} prompt, +{completion.usage.completion_tokens} completion")
-            
-            # Extract the assistant's message
-            assistant_message = completion.choices[0].message
-            
-            # Log the assistant's response
-            if assistant_message.tool_calls:
-                logger.info(f"Assistant requested {len(assistant_message.tool_calls)} tool calls")
-            else:
-                logger.info(f"Assistant response: {assistant_message.content}")
-            
-            # Add to the conversation history
-            messages.append(assistant_message.model_dump())
-            
-            # Check if the AI wants to call tools
-            if assistant_message.tool_calls:
-                # Execute each tool call
-                for tool_call in assistant_message.tool_calls:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    # Call the function
-                    function_response = call_function(function_name, function_args)
-                    
-                    # Add the function response to messages
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": json.dumps(function_response)
-                    })
-                
-                # Get a new response that takes into account the function results
-                logger.info(f"Getting final response after tool calls")
-                second_completion = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                )
-                
-                # Track token usage for the second completion
-                if hasattr(second_completion, 'usage') and second_completion.usage:
-                    token_usage['prompt_tokens'] += second_completion.usage.prompt_tokens
-                    token_usage['completion_tokens'] += second_completion.usage.completion_tokens
-                    token_usage['total_tokens'] += second_completion.usage.total_tokens
-                    logger.info(f"Token usage: +{second_completion.usage.prompt_tokens} prompt, +{second_completion.usage.completion_tokens} completion")
+        with instrumentation.turn(interface="cli"), use_session(session):
+            try:
+                print(f"Assistant: {run_turn(messages)}")
+            except Exception as e:
+                error_message = f"An error occurred: {str(e)}"
+                logger.error(error_message)
+                print(f"Assistant: I'm sorry, I encountered an error. {error_message}")
                 
-                final_response = second_completion.choices[0].message.content
-                logger.info(f"Final response: {final_response}")
-                
-                messages.append({"role": "assistant", "content": final_response})
-                print(f"Assistant: {final_response}")
-            else:
-                # If no tool calls, just print the assistant's response
-                print(f"Assistant: {assistant_message.content}")
-                
-        except Exception as e:
-            error_message = f"An error occurred: {str(e)}"
-            logger.error(error_message)
-            print(f"Assistant: I'm sorry, I encountered an error. {error_message}")
-            
-            # Add the error message to the conversation
-            messages.append({"role": "assistant", "content": error_message})
+                # Add the error message to the conversation
+                messages.append({"role": "assistant", "content": error_message})
+            if session_log:
+                session_log.append_turn(session)
 
         # Print a divider for readability
         print("\n" + "-" * 10 + "\n")
 
 if __name__ == "__main__":
-    run_chat_loop() 
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chat with the Cloudprinter.com assistant.")
+    parser.add_argument("--session", help="Persist the conversation under this id, resuming it if it exists")
+    run_chat_loop(parser.parse_args().session) 
\ No newline at end of file
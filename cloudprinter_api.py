@@ -1,27 +1,33 @@
-import requests
 import json
 import logging
 import os
 from typing import Dict, List, Optional
-from dotenv import load_dotenv
 
+from deadlines import call_timeout
+from instrumentation import span
+from logging_utils import Lazy, LazyJSON, sampler, truncate
 from models import (
-    Product, ProductInfo, ProductOption, ProductSpec, 
-    QuoteRequest, QuoteResponse, UserIntent,
+    Product, ProductInfo, QuoteRequest, QuoteResponse,
     ShippingLevel, ShippingCountry, ShippingState
 )
 
-# Load environment variables
-load_dotenv()
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+# Environment and logging are configured once by the entry point (chatbot.py,
+# app.py, chat_service.py, ...), not on import
 logger = logging.getLogger(__name__)
 
+# The most one request may take; less if the current turn's budget is nearly spent
+CLOUDPRINTER_TIMEOUT = float(os.getenv("CLOUDPRINTER_TIMEOUT", "15"))
+
+class CloudprinterAPIError(ValueError):
+    """
+    Raised when the Cloudprinter API returns an error status code.
+    """
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"API request failed with status code {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
 class CloudprinterAPIClient:
     """
     Client for interacting with the Cloudprinter API.
@@ -29,7 +35,7 @@ class CloudprinterAPIClient:
     
     BASE_URL = "https://api.cloudprinter.com/cloudcore/1.0"
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
         """
         Initialize the API client with the API key.
         
@@ -37,7 +43,10 @@ class CloudprinterAPIClient:
             api_key: The API key for authenticating with the Cloudprinter API.
                     If None, the API key is loaded from the CLOUDPRINTER_API_KEY
                     environment variable.
+            base_url: The API root, e.g. a local mock_cloudprinter.py server. If None,
+                    CLOUDPRINTER_BASE_URL is used, falling back to the live API.
         """
+        self.base_url = base_url or os.getenv("CLOUDPRINTER_BASE_URL") or self.BASE_URL
         self.api_key = api_key or os.getenv("CLOUDPRINTER_API_KEY")
         if not self.api_key:
             raise ValueError("API key not provided and not found in environment variables.")
@@ -57,45 +66,57 @@ class CloudprinterAPIClient:
             The JSON response from the API.
         
         Raises:
-            requests.exceptions.RequestException: If the request fails.
+            requests.exceptions.RequestException: If the request fails or times out.
+            DeadlineExceeded, TurnCancelled: If the current turn shouldn't make more calls.
             json.JSONDecodeError: If the response is not valid JSON.
-            ValueError: If the API returns an error status code.
+            CloudprinterAPIError: If the API returns an error status code.
         """
-        url = f"{self.BASE_URL}/{endpoint}"
-        
-        # Add API key to payload
-        if payload is None:
-            payload = {}
-        payload["apikey"] = self.api_key
-        
-        # Convert payload to JSON
-        payload_json = json.dumps(payload)
-        
-        # Log request details
-        logger.info(f"Sending request to {url}")
-        logger.debug(f"Request payload: {payload_json}")
-        
-        # Make the request
-        response = requests.post(url, headers=self.headers, data=payload_json)
-        
-        # Log response details
-        logger.info(f"Received response from {url} with status code: {response.status_code}")
-        
-        # Check for successful response
-        if response.status_code not in [200, 201]:
-            logger.error(f"API returned error status code: {response.status_code}")
-            logger.error(f"Response text: {response.text}")
-            raise ValueError(f"API request failed with status code {response.status_code}: {response.text}")
-        
-        # Parse response JSON
-        try:
-            response_json = response.json()
-            logger.debug(f"Response JSON: {json.dumps(response_json, indent=2)}")
-            return response_json
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode JSON response: {e}")
-            logger.error(f"Response text: {response.text}")
-            raise
+        with span("cloudprinter.request", endpoint=endpoint):
+            url = f"{self.base_url}/{endpoint}"
+            
+            # Add API key to payload
+            if payload is None:
+                payload = {}
+            payload["apikey"] = self.api_key
+            
+            # Convert payload to JSON
+            with span("json.dumps", site="cloudprinter.request"):
+                payload_json = json.dumps(payload)
+            
+            # Log request details
+            logger.debug("Sending request to %s", url)
+            logger.debug("Request payload: %s", Lazy(lambda: payload_json))
+            
+            # Make the request (requests is imported on first use to keep startup fast)
+            import requests
+            timeout = call_timeout(CLOUDPRINTER_TIMEOUT)
+            with span("http.post", endpoint=endpoint):
+                response = requests.post(url, headers=self.headers, data=payload_json, timeout=timeout)
+            
+            # Log response details
+            suppressed = sampler.sample(f"response:{endpoint}")
+            if suppressed is not None:
+                logger.info(
+                    "Received response from %s with status code: %s (%d similar suppressed)",
+                    url, response.status_code, suppressed
+                )
+            
+            # Check for successful response
+            if response.status_code not in [200, 201]:
+                logger.error(f"API returned error status code: {response.status_code}")
+                logger.error("Response text: %s", truncate(response.text))
+                raise CloudprinterAPIError(response.status_code, response.text)
+            
+            # Parse response JSON
+            try:
+                with span("json.loads", site="cloudprinter.request"):
+                    response_json = response.json()
+                logger.debug("Response JSON: %s", LazyJSON(response_json, indent=2))
+                return response_json
+            except json.JSONDecodeError as e:
+                logger.error(f"Failed to decode JSON response: {e}")
+                logger.error("Response text: %s", truncate(response.text))
+                raise
     
     def get_products(self) -> List[Product]:
         """
@@ -136,7 +157,7 @@ class CloudprinterAPIClient:
         
         # Convert response to ProductInfo object
         product_info = ProductInfo(**response)
-        logger.info(f"Retrieved product info for {reference}")
+        logger.debug("Retrieved product info for %s", reference)
         return product_info
     
     def get_quote(self, quote_request: QuoteRequest) -> QuoteResponse:
@@ -209,6 +230,12 @@ class CloudprinterAPIClient:
 
 # Example usage
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from logging_utils import setup_logging
+    
+    load_dotenv()
+    setup_logging()
+    
     # Create an API client
     client = CloudprinterAPIClient()
     
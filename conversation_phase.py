@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+
+from option_graph import OptionGraph
+
+logger = logging.getLogger(__name__)
+
+# How the phase's tools are offered:
+#   schemas: send only the phase's tool schemas (fewest prompt tokens, but the
+#     tool list, which the API renders ahead of the messages, changes between
+#     phases and so restarts the provider's prompt cache)
+#   allowed_tools: send every schema and restrict calls with tool_choice, so
+#     the prompt prefix stays identical across phases
+#   off: offer every tool
+TOOL_SUBSETTING_MODE = os.getenv("TOOL_SUBSETTING_MODE", "schemas")
+
+
+class ConversationPhase(str, Enum):
+    """Where the conversation is on the way to a quote."""
+    PRODUCT_SELECTION = "product_selection"
+    OPTION_SELECTION = "option_selection"
+    DELIVERY_DETAILS = "delivery_details"
+    QUOTING = "quoting"
+    QUOTED = "quoted"
+
+
+# Shipping questions ("do you deliver to ...?") come up at any point and their
+# lookups are read-only, so every phase offers them
+SHIPPING_TOOLS = frozenset({"get_shipping_countries", "get_shipping_states", "get_shipping_levels"})
+
+# The tools the model can use in each phase. Every phase keeps the tools to
+# record what the user said and to step back (pick another product or option),
+# so a subset never blocks the conversation; it only hides tools that have
+# nothing to work with yet.
+PHASE_TOOLS: Dict[ConversationPhase, frozenset] = {
+    ConversationPhase.PRODUCT_SELECTION: SHIPPING_TOOLS | {
+        "search_catalog", "list_all_products", "get_product_info", "get_product_infos",
+        "update_conversation_context",
+    },
+    ConversationPhase.OPTION_SELECTION: SHIPPING_TOOLS | {
+        "search_catalog", "list_all_products", "get_product_info", "get_product_infos", "update_option_selection",
+        "update_conversation_context", "estimate_price", "get_quote",
+    },
+    ConversationPhase.DELIVERY_DETAILS: SHIPPING_TOOLS | {
+        "search_catalog", "list_all_products", "get_product_info", "update_option_selection",
+        "update_conversation_context", "estimate_price",
+    },
+    ConversationPhase.QUOTING: SHIPPING_TOOLS | {
+        "get_quote", "estimate_price", "search_catalog", "get_product_info", "update_option_selection",
+        "update_conversation_context",
+    },
+}
+
+
+def options_complete(context: Dict, graph: Optional[OptionGraph]) -> bool:
+    """
+    Check whether the user has chosen every option that offers a real choice.
+
+    Args:
+        context: The conversation context.
+        graph: The selected product's option graph, if known.
+
+    Returns:
+        True when every option type with more than one value has a selection.
+    """
+    if graph is None:
+        return False
+    selected_types = {
+        option.get("type") for option in context.get("selected_options") or [] if isinstance(option, dict)
+    }
+    return all(
+        option_type in selected_types
+        for option_type, references in graph.option_types.items()
+        if len(references) > 1
+    )
+
+
+def detect_phase(context: Dict, graph: Optional[OptionGraph]) -> ConversationPhase:
+    """
+    Work out the conversation phase from what we know about the request.
+
+    Args:
+        context: The conversation context.
+        graph: The selected product's option graph, if known.
+
+    Returns:
+        The current phase.
+    """
+    if context.get("quote_result"):
+        return ConversationPhase.QUOTED
+    if not context.get("product_reference"):
+        return ConversationPhase.PRODUCT_SELECTION
+    if not options_complete(context, graph):
+        return ConversationPhase.OPTION_SELECTION
+    if not (context.get("quantity") and context.get("country")):
+        return ConversationPhase.DELIVERY_DETAILS
+    return ConversationPhase.QUOTING
+
+
+def allowed_tools_choice(tool_names: Iterable[str]) -> Dict:
+    """
+    Build a tool_choice that lets the model call only the given tools.
+    """
+    return {
+        "type": "allowed_tools",
+        "allowed_tools": {
+            "mode": "auto",
+            "tools": [{"type": "function", "function": {"name": name}} for name in tool_names],
+        },
+    }
+
+
+def tools_for_phase(phase: ConversationPhase, all_tools: Iterable[str]) -> Optional[Tuple[str, ...]]:
+    """
+    Get the tools to expose in a phase.
+
+    Args:
+        phase: The conversation phase.
+        all_tools: Every registered tool name, in registry order.
+
+    Returns:
+        The tool names in registry order (so the schema list for a phase is
+        always identical), or None to expose every tool.
+    """
+    allowed = PHASE_TOOLS.get(phase)
+    if allowed is None:
+        return None
+    return tuple(name for name in all_tools if name in allowed)
+
+
+class PhaseStats:
+    """
+    Counters showing what tool subsetting saves: schema characters not sent
+    and tool calls that failed or named a tool outside the exposed subset.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.schema_chars_sent = 0
+        self.schema_chars_full = 0
+        self.tool_calls = 0
+        self.tool_errors = 0
+        self.unexposed_calls = 0
+
+    def record_request(self, phase: ConversationPhase, sent_chars: int, full_chars: int) -> None:
+        with self._lock:
+            self.requests[phase.value] = self.requests.get(phase.value, 0) + 1
+            self.schema_chars_sent += sent_chars
+            self.schema_chars_full += full_chars
+
+    def record_tool_call(self, exposed: bool, error: Optional[str]) -> None:
+        with self._lock:
+            self.tool_calls += 1
+            if error is not None:
+                self.tool_errors += 1
+            if not exposed:
+                self.unexposed_calls += 1
+
+    def summary(self) -> Dict:
+        """
+        Summarize the counters. Tokens are estimated at four characters each.
+        """
+        with self._lock:
+            saved_chars = self.schema_chars_full - self.schema_chars_sent
+            return {
+                "requests_by_phase": dict(self.requests),
+                "schema_tokens_sent": self.schema_chars_sent // 4,
+                "schema_tokens_saved": saved_chars // 4,
+                "schema_savings": round(saved_chars / self.schema_chars_full, 3) if self.schema_chars_full else 0.0,
+                "tool_calls": self.tool_calls,
+                "tool_errors": self.tool_errors,
+                "unexposed_tool_calls": self.unexposed_calls,
+            }
+
+
+phase_stats = PhaseStats()
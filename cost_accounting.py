@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# USD per million tokens: (input, cached input, output). COST_MODEL_PRICES
+# overrides or extends it with JSON, e.g. '{"my-model": [1.0, 0.5, 4.0]}'
+MODEL_PRICES: Dict[str, Tuple[float, float, float]] = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+}
+MODEL_PRICES.update({name: tuple(prices) for name, prices in json.loads(os.getenv("COST_MODEL_PRICES", "{}")).items()})
+# Time windows, in seconds, the metrics page aggregates over
+COST_WINDOWS = tuple(int(seconds) for seconds in os.getenv("COST_WINDOWS", "60,300,3600").split(","))
+# Individual LLM calls kept for per-session and per-turn breakdowns
+COST_MAX_RECORDS = int(os.getenv("COST_MAX_RECORDS", "50000"))
+
+BUCKET_SECONDS = 60
+
+_attribution: ContextVar[Dict[str, str]] = ContextVar("cost_attribution", default={})
+
+
+@contextmanager
+def attribute(**labels):
+    """
+    Attribute the LLM calls and tool results recorded in a block to the given
+    labels, on top of the ones already active, e.g. session and turn around a
+    turn and tool around a tool call.
+
+    Args:
+        **labels: Any of session, turn and tool.
+    """
+    token = _attribution.set({**_attribution.get(), **{key: str(value) for key, value in labels.items()}})
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def model_prices(model: str) -> Optional[Tuple[float, float, float]]:
+    """
+    Get a model's prices, matching dated snapshots (e.g. gpt-4o-2024-08-06)
+    by the longest known prefix.
+
+    Returns:
+        (input, cached input, output) in USD per million tokens, or None if unknown.
+    """
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    matches = [name for name in MODEL_PRICES if model.startswith(name)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def completion_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """
+    Get the price of one completion in USD; cached prompt tokens are billed at
+    the cached input price. Unknown models cost 0.
+    """
+    prices = model_prices(model)
+    if prices is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+            + completion_tokens * output_price) / 1_000_000
+
+
+def _new_totals() -> Dict:
+    return {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+
+
+def _add(totals: Dict, prompt_tokens: int, cached_tokens: int, completion_tokens: int, cost: float) -> None:
+    totals["calls"] += 1
+    totals["prompt_tokens"] += prompt_tokens
+    totals["cached_tokens"] += cached_tokens
+    totals["completion_tokens"] += completion_tokens
+    totals["cost_usd"] += cost
+
+
+class CostLedger:
+    """
+    Token and dollar accounting for every LLM call, attributed to session,
+    turn, tool, model and call type (the model_router route), plus the size
+    of what each tool adds to the prompt.
+
+    Keeps lifetime totals, per-minute buckets for time-window aggregates and
+    a bounded list of recent calls for per-session and per-turn breakdowns.
+    """
+
+    def __init__(self, windows: Iterable[int] = COST_WINDOWS, max_records: int = COST_MAX_RECORDS):
+        """
+        Initialize the ledger.
+
+        Args:
+            windows: Time windows, in seconds, reported on the metrics page.
+            max_records: Recent LLM calls kept for breakdowns.
+        """
+        self.windows = tuple(sorted(windows))
+        self.records = deque(maxlen=max_records)
+        self.totals: Dict[Tuple[str, str, str], Dict] = {}
+        self.tool_results: Dict[str, Dict] = {}
+        self.unpriced_models = set()
+        # Minute -> (model, call, tool) -> totals, covering the longest window
+        self._buckets: Dict[int, Dict[Tuple[str, str, str], Dict]] = {}
+        self._lock = threading.Lock()
+
+    def record_completion(self, model: str, call: str, completion) -> Optional[Dict]:
+        """
+        Record an LLM call's usage under the active attribution.
+
+        Args:
+            model: The model that was requested.
+            call: What the call was for, e.g. 'extraction' or 'filter'.
+            completion: The completion, with an OpenAI-style usage.
+
+        Returns:
+            The recorded call with its cost, or None if it reported no usage.
+        """
+        usage = getattr(completion, "usage", None)
+        if not usage:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        return self.record(model, call, usage.prompt_tokens, getattr(details, "cached_tokens", None) or 0,
+                           usage.completion_tokens)
+
+    def record(self, model: str, call: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> Dict:
+        """
+        Record an LLM call's token counts under the active attribution.
+
+        Returns:
+            The recorded call with its cost.
+        """
+        now = time.time()
+        cost = completion_cost(model, prompt_tokens, cached_tokens, completion_tokens)
+        labels = _attribution.get()
+        record = {"time": now, "session": labels.get("session", ""), "turn": labels.get("turn", ""),
+                  "tool": labels.get("tool", ""), "model": model, "call": call,
+                  "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens,
+                  "completion_tokens": completion_tokens, "cost_usd": cost}
+        key = (model, call, record["tool"])
+        minute = int(now // BUCKET_SECONDS)
+        with self._lock:
+            if model_prices(model) is None and model not in self.unpriced_models:
+                self.unpriced_models.add(model)
+                logger.warning(f"No price known for model {model}; its calls are counted at $0")
+            _add(self.totals.setdefault(key, _new_totals()), prompt_tokens, cached_tokens, completion_tokens, cost)
+            bucket = self._buckets.get(minute)
+            if bucket is None:
+                bucket = self._buckets[minute] = {}
+                self._expire(minute)
+            _add(bucket.setdefault(key, _new_totals()), prompt_tokens, cached_tokens, completion_tokens, cost)
+            self.records.append(record)
+        return record
+
+    def record_tool_result(self, tool: str, content: str) -> None:
+        """
+        Record the size of a tool result added to the conversation. It is sent
+        again with every later request of the session, so large results are
+        what grows prompts.
+
+        Args:
+            tool: The tool name.
+            content: The serialized result.
+        """
+        with self._lock:
+            totals = self.tool_results.setdefault(tool, {"calls": 0, "result_chars": 0, "max_result_chars": 0})
+            totals["calls"] += 1
+            totals["result_chars"] += len(content)
+            totals["max_result_chars"] = max(totals["max_result_chars"], len(content))
+
+    def _expire(self, minute: int) -> None:
+        oldest = minute - (self.windows[-1] if self.windows else 0) // BUCKET_SECONDS
+        for stale in [bucket for bucket in self._buckets if bucket < oldest]:
+            del self._buckets[stale]
+
+    def window(self, seconds: int) -> Dict[Tuple[str, str, str], Dict]:
+        """
+        Aggregate the calls of the last `seconds`, to minute granularity.
+
+        Returns:
+            Totals per (model, call, tool).
+        """
+        first = int(time.time() // BUCKET_SECONDS) - seconds // BUCKET_SECONDS + 1
+        aggregated: Dict[Tuple[str, str, str], Dict] = {}
+        with self._lock:
+            buckets = [bucket for minute, bucket in self._buckets.items() if minute >= first]
+            for bucket in buckets:
+                for key, totals in bucket.items():
+                    target = aggregated.setdefault(key, _new_totals())
+                    for field, value in totals.items():
+                        target[field] += value
+        return aggregated
+
+    def breakdown(self, by: Iterable[str] = ("tool",), session: Optional[str] = None,
+                  since: Optional[float] = None) -> List[Dict]:
+        """
+        Group the recent calls by any of the labels, most expensive first.
+
+        Args:
+            by: The labels to group by, from session, turn, tool, model and call.
+            session: Only count this session's calls.
+            since: Only count calls made after this Unix time.
+
+        Returns:
+            One entry per group with its labels and totals.
+        """
+        by = tuple(by)
+        groups: Dict[Tuple, Dict] = {}
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            if (session is not None and record["session"] != session) or (since is not None and record["time"] < since):
+                continue
+            totals = groups.setdefault(tuple(record[label] for label in by), _new_totals())
+            _add(totals, record["prompt_tokens"], record["cached_tokens"], record["completion_tokens"],
+                 record["cost_usd"])
+        entries = [{**dict(zip(by, key)), **totals, "cost_usd": round(totals["cost_usd"], 6)}
+                   for key, totals in groups.items()]
+        return sorted(entries, key=lambda entry: entry["cost_usd"], reverse=True)
+
+    def summary(self) -> Dict:
+        """
+        Summarize lifetime totals per model and call type and tool result sizes.
+        Tokens are estimated at four characters each for tool results.
+        """
+        with self._lock:
+            totals = [{"model": model, "call": call, "tool": tool, **counts, "cost_usd": round(counts["cost_usd"], 6)}
+                      for (model, call, tool), counts in sorted(self.totals.items())]
+            tool_results = {tool: {"calls": counts["calls"], "result_tokens": counts["result_chars"] // 4,
+                                   "max_result_tokens": counts["max_result_chars"] // 4}
+                            for tool, counts in sorted(self.tool_results.items())}
+        return {"cost_usd": round(sum(entry["cost_usd"] for entry in totals), 6), "llm_calls": totals,
+                "tool_results": tool_results}
+
+    def render_prometheus(self) -> str:
+        """
+        Render the totals and window aggregates in the Prometheus text exposition format.
+        """
+        with self._lock:
+            totals = sorted((key, dict(counts)) for key, counts in self.totals.items())
+            tool_results = sorted((tool, dict(counts)) for tool, counts in self.tool_results.items())
+
+        windows = [(seconds, sorted(self.window(seconds).items())) for seconds in self.windows]
+
+        def labels(model: str, call: str, tool: str) -> str:
+            return f'model="{model}",call="{call}",tool="{tool}"'
+
+        lines = ["# TYPE chatbot_llm_calls_total counter"]
+        lines += [f"chatbot_llm_calls_total{{{labels(*key)}}} {counts['calls']}" for key, counts in totals]
+        lines.append("# TYPE chatbot_llm_tokens_total counter")
+        for key, counts in totals:
+            for kind in ("prompt", "cached", "completion"):
+                lines.append(f'chatbot_llm_tokens_total{{{labels(*key)},kind="{kind}"}} {counts[kind + "_tokens"]}')
+        lines.append("# TYPE chatbot_llm_cost_usd_total counter")
+        lines += [f"chatbot_llm_cost_usd_total{{{labels(*key)}}} {counts['cost_usd']:.6f}" for key, counts in totals]
+
+        lines.append("# TYPE chatbot_tool_result_chars_total counter")
+        lines += [f'chatbot_tool_result_chars_total{{tool="{tool}"}} {counts["result_chars"]}'
+                  for tool, counts in tool_results]
+        lines.append("# TYPE chatbot_tool_result_chars_max gauge")
+        lines += [f'chatbot_tool_result_chars_max{{tool="{tool}"}} {counts["max_result_chars"]}'
+                  for tool, counts in tool_results]
+
+        lines.append("# TYPE chatbot_llm_window_tokens gauge")
+        for seconds, aggregated in windows:
+            for key, counts in aggregated:
+                for kind in ("prompt", "cached", "completion"):
+                    lines.append(f'chatbot_llm_window_tokens{{window="{seconds}s",{labels(*key)},kind="{kind}"}} '
+                                 f'{counts[kind + "_tokens"]}')
+        lines.append("# TYPE chatbot_llm_window_cost_usd gauge")
+        for seconds, aggregated in windows:
+            lines += [f'chatbot_llm_window_cost_usd{{window="{seconds}s",{labels(*key)}}} {counts["cost_usd"]:.6f}'
+                      for key, counts in aggregated]
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide ledger the chat loop records every LLM call in, exported on the
+# instrumentation metrics page
+cost_ledger = CostLedger()
+instrumentation.add_collector(cost_ledger.render_prometheus)
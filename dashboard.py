@@ -1,16 +1,16 @@
 import streamlit as st
-import json
-import os
-from openai import OpenAI
 from dotenv import load_dotenv
-from v2 import list_all_products, get_product_info, system_prompt, tools
 
-# Load environment variables
+# Load environment variables before the project modules read their settings
 load_dotenv()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-model = "gpt-4o"
+from catalog_warmup import current_snapshot
+from chatbot import SYSTEM_PROMPT as system_prompt, get_cloudprinter_client, run_turn
+from instrumentation import instrumentation
+from sessions import Session, use_session
+
+# This dashboard only offers the product lookup tools
+TOOL_NAMES = ["list_all_products", "get_product_info", "get_product_infos"]
 
 # Page configuration
 st.set_page_config(
@@ -101,19 +101,24 @@ if "messages" not in st.session_state:
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
 
+# Each browser session gets its own conversation context and token usage,
+# so users don't read or change each other's
+if "session" not in st.session_state:
+    st.session_state.session = Session(messages=st.session_state.messages)
+
 # Initialize action flags
 if "should_clear_chat" not in st.session_state:
     st.session_state.should_clear_chat = False
 
-def call_function(name, args):
-    """Call the appropriate function based on the name and arguments."""
-    if name == "list_all_products":
-        return [p.model_dump() for p in list_all_products()]
-    elif name == "get_product_info":
-        return get_product_info(**args).model_dump()
+@st.cache_data(ttl=3600)
+def list_catalog():
+    """List the catalog's products, preferring the warmed-up snapshot."""
+    snapshot = current_snapshot()
+    products = snapshot.products if snapshot else get_cloudprinter_client().get_products()
+    return [(product.name, product.reference) for product in products]
 
 def submit_message(user_input):
-    """Process user input, call OpenAI API, and update chat history."""
+    """Process user input, run an agent turn, and update chat history."""
     if not user_input.strip():
         return
     
@@ -121,47 +126,14 @@ def submit_message(user_input):
     st.session_state.messages.append({"role": "user", "content": user_input})
     st.session_state.chat_history.append({"role": "user", "content": user_input})
     
-    with st.spinner("Thinking..."):
+    session = st.session_state.session
+    with st.spinner("Thinking..."), instrumentation.turn(interface="dashboard"):
         try:
-            # Call OpenAI API with tools
-            completion = client.chat.completions.create(
-                model=model,
-                messages=st.session_state.messages,
-                tools=tools,
-            )
-            
-            # Add assistant's response to messages
-            assistant_message = completion.choices[0].message
-            st.session_state.messages.append(assistant_message.model_dump())
-            
-            # Handle any tool calls
-            if assistant_message.tool_calls:
-                for tool_call in assistant_message.tool_calls:
-                    name = tool_call.function.name
-                    args = json.loads(tool_call.function.arguments)
-                    
-                    # Call the function
-                    result = call_function(name, args)
-                    
-                    # Add the function response to messages
-                    st.session_state.messages.append(
-                        {"role": "tool", "tool_call_id": tool_call.id, "content": json.dumps(result)}
-                    )
-                
-                # Get a new response from the assistant with the tool results
-                completion_2 = client.chat.completions.create(
-                    model=model,
-                    messages=st.session_state.messages,
-                )
-                
-                # Add the final response to messages
-                final_message = completion_2.choices[0].message
-                st.session_state.messages.append(final_message.model_dump())
-                st.session_state.chat_history.append({"role": "assistant", "content": final_message.content})
-            else:
-                # If no tool calls, just display the assistant's message
-                st.session_state.chat_history.append({"role": "assistant", "content": assistant_message.content})
-                
+            # The same agent loop as the chat app: routed models, cost
+            # accounting and a deadline for every call
+            with use_session(session):
+                reply = run_turn(session.messages, tool_names=TOOL_NAMES)
+            st.session_state.chat_history.append({"role": "assistant", "content": reply})
         except Exception as e:
             st.error(f"Error: {e}")
             st.session_state.chat_history.append({"role": "assistant", "content": f"Sorry, I encountered an error: {str(e)}"})
@@ -171,6 +143,7 @@ def clear_chat():
     st.session_state.messages = [
         {"role": "system", "content": system_prompt}
     ]
+    st.session_state.session = Session(messages=st.session_state.messages)
     st.session_state.chat_history = []
     st.session_state.should_clear_chat = True
     st.rerun()
@@ -230,6 +203,5 @@ with st.sidebar:
     
     # Display available products in the sidebar
     st.subheader("Available Products")
-    products = list_all_products()
-    for product in products:
-        st.markdown(f"**{product.name}** - {product.reference}")
+    for name, reference in list_catalog():
+        st.markdown(f"**{name}** - {reference}")
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Seconds a turn may take, from the user's message to the reply
+TURN_BUDGET_SECONDS = float(os.getenv("TURN_BUDGET_SECONDS", "60"))
+# Upstream calls get at least this long, so a nearly spent budget fails
+# fast with DeadlineExceeded rather than with a doomed request
+MIN_CALL_TIMEOUT = float(os.getenv("MIN_CALL_TIMEOUT", "0.5"))
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised when a turn's time budget has run out.
+    """
+
+
+class TurnCancelled(Exception):
+    """
+    Raised when a turn was cancelled, e.g. superseded by a newer message or
+    abandoned by the user.
+    """
+
+
+class Deadline:
+    """
+    A turn's time budget and cancellation flag, checked cooperatively by the
+    code the turn runs and turned into per-call timeouts for upstream calls.
+    """
+
+    def __init__(self, budget: Optional[float] = TURN_BUDGET_SECONDS, cancelled: Optional[threading.Event] = None):
+        """
+        Initialize the deadline.
+
+        Args:
+            budget: Seconds from now until the deadline. No deadline if None.
+            cancelled: Set to cancel the turn. A new event if None.
+        """
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget if budget is not None else None
+        self.cancelled = cancelled or threading.Event()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Seconds left, or None if there is no deadline.
+        """
+        return max(0.0, self.expires_at - time.monotonic()) if self.expires_at is not None else None
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def check(self) -> None:
+        """
+        Raises:
+            TurnCancelled: If the turn was cancelled.
+            DeadlineExceeded: If the budget has run out.
+        """
+        if self.cancelled.is_set():
+            raise TurnCancelled("The request was cancelled")
+        remaining = self.remaining()
+        if remaining is not None and remaining < MIN_CALL_TIMEOUT:
+            raise DeadlineExceeded(f"The request's {self.budget:g}s time budget ran out")
+
+    def timeout(self, cap: float) -> float:
+        """
+        Get the timeout for one upstream call.
+
+        Args:
+            cap: The most any single call of this kind may take.
+
+        Returns:
+            The cap, or what is left of the budget if less.
+
+        Raises:
+            TurnCancelled, DeadlineExceeded: See check.
+        """
+        self.check()
+        remaining = self.remaining()
+        return cap if remaining is None else min(cap, remaining)
+
+
+# The deadline of the turn running in this context, if any. Tool calls run in
+# copies of the turn's context, so they see it too.
+_current_deadline: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def use_deadline(deadline: Optional[Deadline]):
+    """
+    Make a deadline the current one for the duration of a block.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+def call_timeout(cap: float) -> float:
+    """
+    Get the timeout for an upstream call: the cap, bounded by the current
+    turn's remaining budget.
+
+    Raises:
+        TurnCancelled, DeadlineExceeded: If the current turn shouldn't make more calls.
+    """
+    deadline = _current_deadline.get()
+    return deadline.timeout(cap) if deadline is not None else cap
+
+
+def check_deadline() -> None:
+    """
+    Stop the current turn if it was cancelled or its budget ran out.
+
+    Raises:
+        TurnCancelled, DeadlineExceeded: See Deadline.check.
+    """
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INSTRUMENTATION_ENABLED = os.getenv("INSTRUMENTATION_ENABLED", "0") == "1"
+INSTRUMENTATION_EXPORT_PATH = os.getenv("INSTRUMENTATION_EXPORT_PATH")
+INSTRUMENTATION_PORT = os.getenv("INSTRUMENTATION_PORT")
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _NoopSpan:
+    """
+    Span returned when instrumentation is disabled, so the hot path only pays
+    for one attribute check and an empty context manager.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """
+    A timed section of work, nested under the span that was open on the same
+    thread when it started.
+    """
+
+    def __init__(self, owner: "Instrumentation", name: str, tags: Dict[str, str], is_turn: bool = False):
+        self.owner = owner
+        self.name = name
+        self.tags = tags
+        self.is_turn = is_turn
+        self.children: List["Span"] = []
+        self.start = 0.0
+        self.duration = 0.0
+        self.error = None
+
+    def __enter__(self):
+        stack = self.owner._stack()
+        if stack:
+            stack[-1].children.append(self)
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.owner._stack().pop()
+        self.owner._finish(self)
+        return False
+
+    def to_dict(self) -> Dict:
+        data = {"name": self.name, "ms": round(self.duration * 1000, 3)}
+        if self.tags:
+            data["tags"] = self.tags
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+
+class Histogram:
+    """
+    Latency samples for one span name and tag set. Keeps a bounded window of
+    recent samples for percentiles plus exact totals.
+    """
+
+    def __init__(self, max_samples: int):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Instrumentation:
+    """
+    Span-based timing for the hot path: per-turn timing trees plus aggregate
+    latency histograms per span name and tags.
+    """
+
+    def __init__(self, enabled: bool = INSTRUMENTATION_ENABLED, export_path: Optional[str] = INSTRUMENTATION_EXPORT_PATH,
+                 max_samples: int = 2048, max_turns: int = 200):
+        """
+        Initialize the instrumentation.
+
+        Args:
+            enabled: Whether spans are recorded at all.
+            export_path: File that finished turn trees are appended to as JSON lines.
+            max_samples: Samples kept per histogram for percentile estimates.
+            max_turns: Finished turn trees kept in memory.
+        """
+        self.enabled = enabled
+        self.export_path = export_path
+        self.max_samples = max_samples
+        self.turns = deque(maxlen=max_turns)
+        self.histograms: Dict[Tuple[str, Tuple], Histogram] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._server = None
+        self._collectors: List[Callable[[], str]] = []
+
+    def add_collector(self, render: Callable[[], str]) -> None:
+        """
+        Add more metrics to the Prometheus page, e.g. token and cost counters.
+
+        Args:
+            render: Returns metrics in the Prometheus text exposition format.
+        """
+        self._collectors.append(render)
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def span(self, name: str, **tags):
+        """
+        Time a section of work.
+
+        Args:
+            name: The span name, e.g. 'cloudprinter.request' or 'tool'.
+            **tags: Labels that split the span's histogram, e.g. endpoint='products'.
+
+        Returns:
+            A context manager.
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, tags)
+
+    def turn(self, **tags):
+        """
+        Time a whole conversation turn; spans opened inside it form its timing tree.
+
+        Args:
+            **tags: Labels recorded on the turn.
+
+        Returns:
+            A context manager.
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, "turn", tags, is_turn=True)
+
+    def _finish(self, span: Span) -> None:
+        key = (span.name, tuple(sorted(span.tags.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.max_samples)
+            histogram.observe(span.duration)
+            if span.is_turn:
+                self.turns.append(span)
+
+        if span.is_turn and self.export_path:
+            try:
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span.to_dict()) + "\n")
+            except OSError as e:
+                logger.error(f"Failed to export turn timings to {self.export_path}: {e}")
+
+    def summary(self) -> List[Dict]:
+        """
+        Aggregate latency per span name and tag set.
+
+        Returns:
+            One entry per histogram with count, total and p50/p95/p99 in milliseconds.
+        """
+        with self._lock:
+            items = list(self.histograms.items())
+
+        summary = []
+        for (name, tags), histogram in sorted(items):
+            entry = {"span": name, "tags": dict(tags), "count": histogram.count,
+                     "total_ms": round(histogram.total * 1000, 3)}
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}_ms"] = round(histogram.percentile(q) * 1000, 3)
+            summary.append(entry)
+        return summary
+
+    def render_prometheus(self) -> str:
+        """
+        Render the histograms and collected metrics in the Prometheus text exposition format.
+
+        Returns:
+            The metrics page.
+        """
+        with self._lock:
+            items = list(self.histograms.items())
+
+        lines = ["# TYPE chatbot_span_seconds summary"]
+        for (name, tags), histogram in sorted(items):
+            labels = [f'span="{name}"'] + [f'{k}="{v}"' for k, v in tags]
+            for q in QUANTILES:
+                quantile_labels = ",".join(labels + [f'quantile="{q}"'])
+                lines.append(f"chatbot_span_seconds{{{quantile_labels}}} {histogram.percentile(q):.6f}")
+            lines.append(f"chatbot_span_seconds_count{{{','.join(labels)}}} {histogram.count}")
+            lines.append(f"chatbot_span_seconds_sum{{{','.join(labels)}}} {histogram.total:.6f}")
+        page = "\n".join(lines) + "\n"
+        for render in self._collectors:
+            try:
+                page += render()
+            except Exception as e:
+                logger.error(f"Failed to render metrics collector: {e}")
+        return page
+
+    def export_summary(self, path: str) -> None:
+        """
+        Write the aggregate summary and the most recent turn trees to a JSON file.
+
+        Args:
+            path: The file to write.
+        """
+        with self._lock:
+            turns = [turn.to_dict() for turn in self.turns]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"spans": self.summary(), "turns": turns}, f, indent=2)
+
+    def serve(self, port: int) -> None:
+        """
+        Expose the Prometheus metrics page on /metrics from a background thread.
+        Calling it again is a no-op.
+
+        Args:
+            port: The local port to listen on.
+        """
+        if self._server is not None:
+            return
+
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = instrumentation.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics").start()
+        logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    def start_from_env(self) -> None:
+        """
+        Start the metrics endpoint if INSTRUMENTATION_PORT is set.
+        """
+        if self.enabled and INSTRUMENTATION_PORT:
+            self.serve(int(INSTRUMENTATION_PORT))
+
+
+# Process-wide instrumentation used by the API client, tools and chat loops
+instrumentation = Instrumentation()
+span = instrumentation.span
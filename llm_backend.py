@@ -0,0 +1,270 @@
+import abc
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from deadlines import call_timeout
+
+# The most one completion may take; less if the current turn's budget is nearly spent
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+
+
+class LLMBackend(abc.ABC):
+    """
+    Interface for chat completion backends. Implementations accept the same
+    keyword arguments as OpenAI's chat.completions.create and return an object
+    with the same shape (choices[0].message, usage).
+    """
+
+    @abc.abstractmethod
+    def create(self, **kwargs) -> Any:
+        """
+        Create a chat completion.
+        """
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    Backend that calls the OpenAI API.
+    """
+
+    def __init__(self, api_key: Optional[str] = None):
+        """
+        Initialize the backend.
+
+        Args:
+            api_key: The OpenAI API key. If None, OPENAI_API_KEY is used.
+        """
+        from openai import OpenAI
+
+        self.client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+
+    def create(self, **kwargs) -> Any:
+        kwargs.setdefault("timeout", call_timeout(LLM_TIMEOUT))
+        return self.client.chat.completions.create(**kwargs)
+
+
+# --------------------------------------------------------------
+# Response objects mirroring the parts of the OpenAI types we use
+# --------------------------------------------------------------
+
+class ScriptedFunction:
+    def __init__(self, name: str, arguments: str):
+        self.name = name
+        self.arguments = arguments
+
+
+class ScriptedToolCall:
+    def __init__(self, id: str, name: str, arguments: str):
+        self.id = id
+        self.type = "function"
+        self.function = ScriptedFunction(name, arguments)
+
+
+class ScriptedMessage:
+    def __init__(self, content: Optional[str], tool_calls: Optional[List[ScriptedToolCall]] = None):
+        self.role = "assistant"
+        self.content = content
+        self.tool_calls = tool_calls or None
+
+    def model_dump(self) -> Dict:
+        data = {"role": self.role, "content": self.content}
+        if self.tool_calls:
+            data["tool_calls"] = [
+                {"id": call.id, "type": call.type,
+                 "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                for call in self.tool_calls
+            ]
+        return data
+
+
+class ScriptedChoice:
+    def __init__(self, message: ScriptedMessage):
+        self.index = 0
+        self.message = message
+        self.finish_reason = "tool_calls" if message.tool_calls else "stop"
+
+
+class ScriptedPromptTokensDetails:
+    def __init__(self, cached_tokens: int):
+        self.cached_tokens = cached_tokens
+
+
+class ScriptedUsage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.prompt_tokens_details = ScriptedPromptTokensDetails(cached_tokens)
+
+
+class ScriptedCompletion:
+    def __init__(self, model: str, message: ScriptedMessage, usage: ScriptedUsage):
+        self.model = model
+        self.choices = [ScriptedChoice(message)]
+        self.usage = usage
+
+
+class PromptPrefixCache:
+    """
+    Simulates provider-side prompt caching: a request's leading tokens are
+    cached when an earlier request started with exactly the same content.
+    Like OpenAI's cache, prompts under 1024 tokens are never cached and hits
+    are counted in 128-token blocks.
+    """
+
+    BLOCK_CHARS = 128 * 4
+    MIN_CHARS = 1024 * 4
+
+    def __init__(self):
+        self._prefixes = set()
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, prompt: str) -> int:
+        """
+        Record a prompt and get how many of its tokens were already cached.
+        """
+        digest = hashlib.sha256()
+        prefixes = []
+        for start in range(0, len(prompt) - self.BLOCK_CHARS + 1, self.BLOCK_CHARS):
+            digest.update(prompt[start:start + self.BLOCK_CHARS].encode("utf-8"))
+            prefixes.append(digest.copy().digest())
+
+        with self._lock:
+            cached_blocks = 0
+            for prefix in prefixes:
+                if prefix not in self._prefixes:
+                    break
+                cached_blocks += 1
+            if len(prompt) >= self.MIN_CHARS:
+                self._prefixes.update(prefixes)
+        if cached_blocks * self.BLOCK_CHARS < self.MIN_CHARS:
+            return 0
+        return cached_blocks * self.BLOCK_CHARS // 4
+
+
+# Shared by all scripted backends, like a provider's cache is shared by all
+# requests from one account
+prompt_prefix_cache = PromptPrefixCache()
+
+
+class ScriptExhausted(RuntimeError):
+    """
+    Raised when a scripted backend is asked for more completions than it recorded.
+    """
+
+
+class ScriptedLLMBackend(LLMBackend):
+    """
+    Deterministic fake backend that replays a recorded sequence of responses,
+    one per create() call, with configurable latency and token counts.
+
+    Each scripted response is a dict with any of:
+        content: The assistant text.
+        tool_calls: A list of {"name": ..., "arguments": {...}}.
+        prompt_tokens / completion_tokens: Reported usage. When omitted they are
+            estimated from the size of the request and the response.
+        cached_tokens: Reported cached prompt tokens. When omitted they are
+            simulated with the shared PromptPrefixCache.
+        latency_ms: Delay before returning, overriding the backend default.
+    """
+
+    def __init__(self, responses: List[Dict], latency_ms: float = 0.0, loop: bool = False):
+        """
+        Initialize the backend.
+
+        Args:
+            responses: The scripted responses, in call order.
+            latency_ms: Default delay per call.
+            loop: Start over from the first response instead of raising when exhausted.
+        """
+        self.responses = responses
+        self.latency_ms = latency_ms
+        self.loop = loop
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "ScriptedLLMBackend":
+        """
+        Load a recorded conversation script (see fixtures/conversations).
+
+        Args:
+            path: The script file.
+            **kwargs: Passed to the constructor.
+
+        Returns:
+            The backend.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            script = json.load(f)
+        return cls(script["responses"], **kwargs)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = 0
+
+    def create(self, **kwargs) -> ScriptedCompletion:
+        # Time out like the OpenAI client would
+        timeout = kwargs.get("timeout") or call_timeout(LLM_TIMEOUT)
+        with self._lock:
+            index = self.calls
+            self.calls += 1
+        if index >= len(self.responses):
+            if not self.loop:
+                raise ScriptExhausted(f"Script has only {len(self.responses)} responses")
+            index %= len(self.responses)
+        step = self.responses[index]
+
+        tool_calls = [
+            ScriptedToolCall(f"call_{index}_{i}", call["name"], json.dumps(call.get("arguments", {})))
+            for i, call in enumerate(step.get("tool_calls", []))
+        ]
+        message = ScriptedMessage(step.get("content"), tool_calls)
+
+        # Roughly four characters per token, like the OpenAI tokenizers on English.
+        # Tools are rendered ahead of the messages, as the API does.
+        prompt = json.dumps(kwargs.get("tools") or []) + json.dumps(kwargs.get("messages", []), default=str)
+        prompt_tokens = step.get("prompt_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = len(prompt) // 4
+        cached_tokens = step.get("cached_tokens")
+        if cached_tokens is None:
+            cached_tokens = min(prompt_prefix_cache.cached_tokens(prompt), prompt_tokens)
+        completion_tokens = step.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = len(json.dumps(message.model_dump())) // 4
+
+        latency_ms = step.get("latency_ms", self.latency_ms)
+        if latency_ms:
+            time.sleep(min(latency_ms / 1000, timeout))
+            if latency_ms / 1000 > timeout:
+                raise TimeoutError(f"Scripted completion timed out after {timeout:.2f}s")
+
+        return ScriptedCompletion(kwargs.get("model", "scripted"), message,
+                                  ScriptedUsage(prompt_tokens, completion_tokens, cached_tokens))
+
+
+def create_backend() -> LLMBackend:
+    """
+    Create the backend selected by the environment.
+
+    LLM_BACKEND=openai (default) uses the OpenAI API. LLM_BACKEND=scripted replays
+    LLM_SCRIPT_PATH with LLM_SCRIPT_LATENCY_MS delay per call.
+
+    Returns:
+        The backend.
+    """
+    kind = os.getenv("LLM_BACKEND", "openai")
+    if kind == "scripted":
+        return ScriptedLLMBackend.from_file(
+            os.environ["LLM_SCRIPT_PATH"],
+            latency_ms=float(os.getenv("LLM_SCRIPT_LATENCY_MS", "0")),
+            loop=True,
+        )
+    if kind == "openai":
+        return OpenAIBackend()
+    raise ValueError(f"Unknown LLM backend: {kind}")
@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "10"))
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def truncate(text: str, max_chars: int = LOG_PAYLOAD_MAX_CHARS) -> str:
+    """
+    Cap a payload for logging.
+
+    Args:
+        text: The text to cap.
+        max_chars: Maximum number of characters kept.
+
+    Returns:
+        The text, with a marker noting how much was cut if it was too long.
+    """
+    if max_chars and len(text) > max_chars:
+        return f"{text[:max_chars]}... [{len(text) - max_chars} more chars]"
+    return text
+
+
+class Lazy:
+    """
+    Defers building a log message argument until a handler actually formats
+    the record, so disabled levels cost nothing beyond the object itself.
+
+    Usage: logger.debug("Quote request: %s", Lazy(quote_request.model_dump_json))
+    """
+
+    __slots__ = ("fn", "max_chars")
+
+    def __init__(self, fn: Callable[[], Any], max_chars: int = LOG_PAYLOAD_MAX_CHARS):
+        self.fn = fn
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        return truncate(str(self.fn()), self.max_chars)
+
+
+class LazyJSON:
+    """
+    Defers json.dumps of a log payload until the record is formatted, and caps
+    its size.
+
+    Usage: logger.debug("Context: %s", LazyJSON(conversation_context))
+    """
+
+    __slots__ = ("obj", "indent", "max_chars")
+
+    def __init__(self, obj: Any, indent: Optional[int] = None, max_chars: int = LOG_PAYLOAD_MAX_CHARS):
+        self.obj = obj
+        self.indent = indent
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        return truncate(json.dumps(self.obj, indent=self.indent, default=str), self.max_chars)
+
+
+class LogSampler:
+    """
+    Lets through the first occurrence of a high-volume event and then one in
+    every N, reporting how many were suppressed in between.
+    """
+
+    def __init__(self, every: int = LOG_SAMPLE_EVERY):
+        self.every = max(1, every)
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def sample(self, key: str) -> Optional[int]:
+        """
+        Decide whether to log an occurrence of an event.
+
+        Args:
+            key: Identifies the event stream, e.g. 'response:products/info'.
+
+        Returns:
+            None to skip this occurrence, otherwise the number of occurrences
+            suppressed since the last one logged.
+        """
+        with self._lock:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+        if count % self.every:
+            return None
+        return self.every - 1 if count else 0
+
+
+# Shared sampler for per-request log lines
+sampler = LogSampler()
+
+# The active queue listener and the target it writes to
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_target: Optional[str] = None
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        # Stopping flushed the queue; release the old target, e.g. its open file
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def setup_logging(filename: Optional[str] = None, level: str = LOG_LEVEL) -> None:
+    """
+    Configure root logging once per process.
+
+    Records are put on an in-memory queue by the calling thread and written by
+    a background listener thread, so slow disks or terminals never block a
+    request thread. Calling it again with the same target is a no-op; calling
+    it with a different target (e.g. app.py switching to a log file after
+    chatbot.py configured the console) replaces the handler.
+
+    Args:
+        filename: Append logs to this file instead of the console.
+        level: The root log level.
+    """
+    global _listener, _queue_handler, _target
+
+    root = logging.getLogger()
+    root.setLevel(level)
+
+    target = filename or "<stderr>"
+    if target == _target:
+        return
+
+    if filename:
+        handler = logging.FileHandler(filename, mode="a", encoding="utf-8")
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+
+    _stop_listener()
+    if _queue_handler is not None:
+        root.removeHandler(_queue_handler)
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    _target = target
+
+
+# Flush queued records on interpreter exit
+atexit.register(_stop_listener)
@@ -0,0 +1,489 @@
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cloudprinter.json")
+API_PREFIX = "/cloudcore/1.0/"
+
+# Option templates used by the synthetic catalog generator
+SYNTHETIC_FAMILIES = [
+    ("Business Cards", "businesscard", [
+        ("type_product_material", ["paper_300ecb", "paper_350mcg", "paper_350mcs", "paper_400mcs"]),
+        ("type_sheet_product_finish", ["product_finish_none", "product_finish_gloss", "product_finish_matte"]),
+    ]),
+    ("Flyers", "flyer", [
+        ("type_product_material", ["paper_135mcg", "paper_170mcs", "paper_250mcg"]),
+        ("type_sheet_product_finish", ["product_finish_none", "product_finish_gloss"]),
+    ]),
+    ("Textbook BW", "textbook", [
+        ("type_book_cover_finish", ["cover_finish_matte", "cover_finish_gloss"]),
+        ("type_book_paper", ["pageblock_80off", "pageblock_90off", "pageblock_130mcs"]),
+        ("type_canvas_paper", ["cover_130mcg", "cover_170mcg"]),
+    ]),
+    ("Posters", "poster", [
+        ("type_product_material", ["paper_170mcs", "paper_200mcg", "paper_250mcs"]),
+    ]),
+    ("Calendars", "calendar", [
+        ("type_calendar_start", ["calendar_start_jan", "calendar_start_jul"]),
+    ]),
+]
+SYNTHETIC_SIZES = ["A6", "A5", "A4", "A3", "85x55", "89x51", "148x148", "210x210"]
+
+
+def load_fixtures(path: str = FIXTURES_PATH) -> Dict:
+    """
+    Load the recorded API fixtures.
+
+    Args:
+        path: The fixture file.
+
+    Returns:
+        The fixture data keyed by endpoint family.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def generate_catalog(count: int, seed: int = 0) -> Tuple[List[Dict], Dict[str, Dict]]:
+    """
+    Generate a synthetic catalog for load testing.
+
+    Args:
+        count: Number of products to generate.
+        seed: Seed for reproducible catalogs.
+
+    Returns:
+        The /products list and the /products/info result per reference.
+    """
+    rng = random.Random(seed)
+    products = []
+    product_infos = {}
+    for i in range(count):
+        category, prefix, option_types = SYNTHETIC_FAMILIES[i % len(SYNTHETIC_FAMILIES)]
+        size = rng.choice(SYNTHETIC_SIZES)
+        reference = f"{prefix}_{size.lower()}_{i:06d}"
+        name = f"{category} {size} #{i}"
+        note = f"{category} {size}, variant {i}"
+        products.append({
+            "name": name,
+            "note": note,
+            "reference": reference,
+            "category": category,
+            "from_price": f"{rng.uniform(0.05, 12.0):.2f}",
+            "currency": "EUR",
+        })
+
+        options = []
+        for option_type, references in option_types:
+            default = rng.randrange(len(references))
+            for j, option_reference in enumerate(references):
+                options.append({
+                    "reference": option_reference,
+                    "note": option_reference.replace("_", " ").capitalize(),
+                    "type": option_type,
+                    "default": 1 if j == default else 0,
+                })
+        product_infos[reference] = {
+            "name": name,
+            "note": note,
+            "reference": reference,
+            "options": options,
+            "specs": [
+                {"note": "Size category", "value": size},
+                {"note": "Minimum order quantity", "value": str(rng.choice([1, 25, 50, 100]))},
+            ],
+        }
+    return products, product_infos
+
+
+def _stable_fraction(*parts: str) -> float:
+    """
+    Map strings to a deterministic number in [0, 1) so quotes are repeatable.
+    """
+    digest = hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0xFFFFFFFF
+
+
+class MockCloudprinterState:
+    """
+    In-memory data and fault-injection settings behind the mock server.
+    """
+
+    def __init__(self, fixtures: Dict, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, rate_limit: float = 0.0, seed: Optional[int] = None):
+        """
+        Initialize the state.
+
+        Args:
+            fixtures: Fixture data as returned by load_fixtures.
+            latency_ms: Base latency added to every response.
+            jitter_ms: Maximum random latency added on top of the base latency.
+            error_rate: Fraction of requests answered with HTTP 500.
+            rate_limit: Requests per second allowed before HTTP 429; 0 disables limiting.
+            seed: Seed for latency and error injection.
+        """
+        self.products = fixtures.get("products", [])
+        self.products_by_reference = {p["reference"]: p for p in self.products}
+        self.product_infos = fixtures.get("product_infos", {})
+        self.shipping_levels = fixtures.get("shipping_levels", [])
+        self.shipping_countries = fixtures.get("shipping_countries", [])
+        self.shipping_states = fixtures.get("shipping_states", {})
+        self.orders = {order["reference"]: copy.deepcopy(order) for order in fixtures.get("orders", [])}
+        self.order_logs = {ref: [{"reference": ref, "create_date": order["order_date"], "state": order["state"]}]
+                           for ref, order in self.orders.items()}
+
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rng = random.Random(seed)
+        self.request_counts: Dict[str, int] = {}
+
+        self._lock = threading.Lock()
+        self._tokens = rate_limit
+        self._last_refill = time.monotonic()
+
+    def add_products(self, products: List[Dict], product_infos: Dict[str, Dict]) -> None:
+        self.products = self.products + products
+        self.products_by_reference.update((p["reference"], p) for p in products)
+        self.product_infos = {**self.product_infos, **product_infos}
+
+    def admit(self) -> bool:
+        """
+        Take a token from the rate-limit bucket.
+
+        Returns:
+            False if the request should be rejected with HTTP 429.
+        """
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._last_refill) * self.rate_limit)
+            self._last_refill = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def injected_delay(self) -> float:
+        with self._lock:
+            jitter = self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        return (self.latency_ms + jitter) / 1000
+
+    def injected_error(self) -> bool:
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self.rng.random() < self.error_rate
+
+    def count(self, endpoint: str) -> None:
+        with self._lock:
+            self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+    # ----------------------------------------------------------
+    # Endpoint handlers: each returns (status code, response body)
+    # ----------------------------------------------------------
+
+    def products_list(self, payload: Dict) -> Tuple[int, object]:
+        return 200, self.products
+
+    def products_info(self, payload: Dict) -> Tuple[int, object]:
+        info = self.product_infos.get(payload.get("reference"))
+        if info is None:
+            return 204, None
+        return 200, info
+
+    def orders_quote(self, payload: Dict) -> Tuple[int, object]:
+        country = payload.get("country")
+        if not country or not payload.get("items"):
+            return 400, {"error": "country and items are required"}
+        countries = {c["country_reference"]: c for c in self.shipping_countries}
+        if country not in countries:
+            return 400, {"error": f"Shipping to {country} is not available"}
+        if countries[country]["require_state"] and not payload.get("state"):
+            return 400, {"error": f"State is required for {country}"}
+
+        currency = payload.get("currency") or "EUR"
+        items_total = 0.0
+        total_weight = 0
+        shipment_items = []
+        for item in payload["items"]:
+            info = self.product_infos.get(item.get("product"))
+            if info is None:
+                return 400, {"error": f"Unknown product {item.get('product')}"}
+            try:
+                count = int(item.get("count", "0"))
+            except ValueError:
+                return 400, {"error": f"Invalid count {item.get('count')}"}
+            if count < 1:
+                return 400, {"error": "Count must be at least 1"}
+
+            valid_options = {option["reference"]: option["type"] for option in info["options"]}
+            option_types = {}
+            surcharge = 0.0
+            for option in item.get("options", []):
+                reference = option.get("type")
+                if reference not in valid_options:
+                    return 400, {"error": f"Option {reference} is not available for {info['reference']}"}
+                option_type = valid_options[reference]
+                if option_type in option_types:
+                    return 400, {"error": f"Options {option_types[option_type]} and {reference} are exclusive"}
+                option_types[option_type] = reference
+                surcharge += 0.02 + 0.2 * _stable_fraction(info["reference"], reference)
+
+            product = self.products_by_reference.get(info["reference"])
+            unit_price = float(product["from_price"]) if product and product.get("from_price") else 1.0
+            # Volume discount: unit price falls with the log of the quantity
+            discount = max(0.35, 1.0 - 0.08 * len(str(count)))
+            items_total += count * (unit_price + surcharge) * discount
+            total_weight += count * 8
+            shipment_items.append({"reference": item.get("reference", "")})
+
+        fee = 2.75
+        quotes = []
+        for i, level in enumerate(self.shipping_levels):
+            shipping_price = (4.2 + 2.5 * i) * (1.0 + _stable_fraction(country, level["shipping_level_reference"]))
+            quotes.append({
+                "quote": hashlib.sha256(f"{payload}|{level}".encode("utf-8")).hexdigest(),
+                "service": level["name"],
+                "shipping_level": level["shipping_level_reference"],
+                "shipping_option": f"Carrier {i + 1} - {level['name']}",
+                "price": f"{shipping_price:.4f}",
+                "vat": "0.0000",
+                "currency": currency,
+            })
+
+        expire = datetime.now(timezone.utc) + timedelta(hours=48)
+        return 200, {
+            "price": f"{items_total + fee:.4f}",
+            "vat": "0.00",
+            "currency": currency,
+            "expire_date": expire.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+            "subtotals": {"items": f"{items_total:.4f}", "fee": f"{fee:.4f}", "app_fee": "0.0000"},
+            "shipments": [{"total_weight": str(total_weight), "items": shipment_items, "quotes": quotes}],
+            "invoice_currency": currency,
+            "invoice_exchange_rate": "1.0000",
+        }
+
+    def shipping_levels_list(self, payload: Dict) -> Tuple[int, object]:
+        return 200, self.shipping_levels
+
+    def shipping_countries_list(self, payload: Dict) -> Tuple[int, object]:
+        return 200, self.shipping_countries
+
+    def shipping_states_list(self, payload: Dict) -> Tuple[int, object]:
+        if not payload.get("country_reference"):
+            return 400, {"error": "country_reference is required"}
+        return 200, self.shipping_states.get(payload["country_reference"], [])
+
+    def orders_list(self, payload: Dict) -> Tuple[int, object]:
+        with self._lock:
+            return 200, [
+                {key: order[key] for key in ("reference", "order_date", "state", "state_code")}
+                for order in self.orders.values()
+            ]
+
+    def orders_info(self, payload: Dict) -> Tuple[int, object]:
+        with self._lock:
+            order = self.orders.get(payload.get("reference"))
+        if order is None:
+            return 410, {"error": "Order not found"}
+        return 200, order
+
+    def orders_add(self, payload: Dict) -> Tuple[int, object]:
+        reference = payload.get("reference")
+        if not reference or not payload.get("email") or not payload.get("items"):
+            return 400, {"error": "reference, email and items are required"}
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        order = {
+            "reference": reference,
+            "order_date": now,
+            "state": "1",
+            "state_code": "order_state_new",
+            "email": payload["email"],
+            "addresses": payload.get("addresses", []),
+            "items": [
+                {"reference": item.get("reference"), "name": item.get("product"), "count": item.get("count"),
+                 "shipping_option": item.get("shipping_level", ""), "tracking": "",
+                 "options": item.get("options", []), "files": item.get("files", [])}
+                for item in payload["items"]
+            ],
+        }
+        with self._lock:
+            if reference in self.orders:
+                return 400, {"error": f"Order {reference} already exists"}
+            self.orders[reference] = order
+            self.order_logs[reference] = [{"reference": reference, "create_date": now, "state": "1"}]
+        return 201, {"order": reference}
+
+    def orders_cancel(self, payload: Dict) -> Tuple[int, object]:
+        with self._lock:
+            order = self.orders.get(payload.get("reference"))
+            if order is None:
+                return 410, {"error": "Order not found"}
+            if order["state_code"] != "order_state_new":
+                return 409, {"error": "Order can no longer be cancelled"}
+            order["state"] = "9"
+            order["state_code"] = "order_state_cancelled"
+            self.order_logs[order["reference"]].append({
+                "reference": order["reference"],
+                "create_date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "state": "9",
+            })
+        return 200, {}
+
+    def orders_log(self, payload: Dict) -> Tuple[int, object]:
+        with self._lock:
+            log = self.order_logs.get(payload.get("reference"))
+        if log is None:
+            return 410, {"error": "Order not found"}
+        return 200, log
+
+    def routes(self) -> Dict:
+        return {
+            "products": self.products_list,
+            "products/info": self.products_info,
+            "orders/quote": self.orders_quote,
+            "shipping/levels": self.shipping_levels_list,
+            "shipping/countries": self.shipping_countries_list,
+            "shipping/states": self.shipping_states_list,
+            "orders": self.orders_list,
+            "orders/info": self.orders_info,
+            "orders/add": self.orders_add,
+            "orders/cancel": self.orders_cancel,
+            "orders/log": self.orders_log,
+        }
+
+
+def make_handler(state: MockCloudprinterState):
+    routes = state.routes()
+
+    class MockCloudprinterHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status: int, body: object) -> None:
+            data = b"" if body is None else json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length) if length else b""
+
+            if not self.path.startswith(API_PREFIX):
+                self._send(404, {"error": "Not found"})
+                return
+            endpoint = self.path[len(API_PREFIX):].strip("/")
+            handler = routes.get(endpoint)
+            if handler is None:
+                self._send(404, {"error": f"Unknown endpoint {endpoint}"})
+                return
+            state.count(endpoint)
+
+            delay = state.injected_delay()
+            if delay:
+                time.sleep(delay)
+            if not state.admit():
+                self._send(429, {"error": "Rate limit exceeded"})
+                return
+            if state.injected_error():
+                self._send(500, {"error": "Injected failure"})
+                return
+
+            try:
+                payload = json.loads(raw or b"{}")
+            except json.JSONDecodeError:
+                self._send(400, {"error": "Request body must be JSON"})
+                return
+            if not payload.get("apikey"):
+                self._send(403, {"error": "Missing API key"})
+                return
+
+            status, body = handler(payload)
+            self._send(status, body)
+
+        def log_message(self, format, *args):
+            logger.debug("mock: " + format, *args)
+
+    return MockCloudprinterHandler
+
+
+def start_mock_server(state: MockCloudprinterState, host: str = "127.0.0.1",
+                      port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start the mock server on a background thread.
+
+    Args:
+        state: The data and fault-injection settings to serve.
+        host: The interface to bind.
+        port: The port to bind; 0 picks a free port.
+
+    Returns:
+        The server (call shutdown() to stop it) and the base URL to pass to
+        CloudprinterAPIClient.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-cloudprinter").start()
+    base_url = f"http://{host}:{server.server_address[1]}{API_PREFIX.rstrip('/')}"
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline mock of the Cloudprinter Core API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH, help="Recorded fixture file")
+    parser.add_argument("--synthetic-products", type=int, default=0,
+                        help="Add this many generated products to the fixture catalog")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Base latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra latency per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with HTTP 500")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second before HTTP 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    state = MockCloudprinterState(
+        load_fixtures(args.fixtures),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed,
+    )
+    if args.synthetic_products:
+        state.add_products(*generate_catalog(args.synthetic_products, seed=args.seed or 0))
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    logger.info(
+        f"Mock Cloudprinter API with {len(state.products)} products on "
+        f"http://{args.host}:{args.port}{API_PREFIX} - set CLOUDPRINTER_BASE_URL to use it"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
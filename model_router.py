@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from instrumentation import QUANTILES, Histogram, instrumentation
+from tool_registry import tool_error
+
+logger = logging.getLogger(__name__)
+
+# Model tiers, cheapest first; escalation moves a call to the next tier
+MODEL_TIERS: Dict[str, str] = json.loads(os.getenv("MODEL_TIERS", "null")) or {
+    "small": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+    "large": os.getenv("OPENAI_LARGE_MODEL", "gpt-4o"),
+}
+# The tier each kind of call starts on:
+#   filter          matching the catalog to a category in list_all_products
+#   extraction      the main call, which picks tools and extracts their arguments
+#   wording         phrasing the reply from the tool results
+#   disambiguation  phrasing the reply when tools failed or matched several things
+MODEL_ROUTES: Dict[str, str] = {
+    "filter": "small",
+    "extraction": "small",
+    "wording": "small",
+    "disambiguation": "large",
+    **json.loads(os.getenv("MODEL_ROUTES", "{}")),
+}
+# Search results count as ambiguous when this many matches score within the
+# margin (relative to the best score) of the best one
+ROUTER_AMBIGUOUS_MATCHES = int(os.getenv("ROUTER_AMBIGUOUS_MATCHES", "3"))
+ROUTER_AMBIGUITY_MARGIN = float(os.getenv("ROUTER_AMBIGUITY_MARGIN", "0.1"))
+
+
+def extraction_problem(message: Any, tool_names: Iterable[str]) -> Optional[str]:
+    """
+    Check an extraction call's output for signs the model was out of its depth.
+
+    Args:
+        message: The assistant message.
+        tool_names: The tools that exist.
+
+    Returns:
+        What is wrong, or None if the output is usable.
+    """
+    if not message.tool_calls:
+        return None if (message.content or "").strip() else "empty reply"
+    known = set(tool_names)
+    for tool_call in message.tool_calls:
+        if tool_call.function.name not in known:
+            return f"unknown tool {tool_call.function.name}"
+        try:
+            arguments = json.loads(tool_call.function.arguments or "{}")
+        except json.JSONDecodeError:
+            return f"malformed arguments for {tool_call.function.name}"
+        if not isinstance(arguments, dict):
+            return f"malformed arguments for {tool_call.function.name}"
+    return None
+
+
+def disambiguation_reason(calls: Sequence[Tuple[str, Dict]], results: Sequence[Any]) -> Optional[str]:
+    """
+    Check whether a turn's tool results need more than plain wording: a tool
+    failed, or a search matched several things about equally well.
+
+    Args:
+        calls: The (name, arguments) tool calls.
+        results: Their results, in the same order.
+
+    Returns:
+        Why the reply needs disambiguation, or None.
+    """
+    for (name, _), result in zip(calls, results):
+        error = tool_error(result)
+        if error is not None:
+            return f"{name} failed"
+        if name == "search_catalog" and isinstance(result, list) and result:
+            best = result[0].get("score") or 0.0
+            close = [match for match in result if (match.get("score") or 0.0) >= best * (1 - ROUTER_AMBIGUITY_MARGIN)]
+            if len(close) >= ROUTER_AMBIGUOUS_MATCHES:
+                return f"{len(close)} equally good search matches"
+    return None
+
+
+class ModelRouter:
+    """
+    Picks the model for each kind of LLM call, so most calls go to the
+    cheapest tier and only the ones showing low confidence are escalated,
+    and records latency and cost per route and model.
+    """
+
+    def __init__(self, tiers: Dict[str, str] = None, routes: Dict[str, str] = None, max_samples: int = 2048):
+        """
+        Initialize the router.
+
+        Args:
+            tiers: Tier name to model, cheapest first. MODEL_TIERS if None.
+            routes: Route to the tier it starts on. MODEL_ROUTES if None.
+            max_samples: Latency samples kept per route and model.
+        """
+        self.tiers = list((tiers or MODEL_TIERS).items())
+        self.routes = dict(routes or MODEL_ROUTES)
+        unknown = set(self.routes.values()) - {name for name, _ in self.tiers}
+        if unknown:
+            raise ValueError(f"Routes use unknown model tiers: {sorted(unknown)}")
+        self.max_samples = max_samples
+        self.stats: Dict[Tuple[str, str], Dict] = {}
+        self._lock = threading.Lock()
+
+    def _tier_index(self, route: str) -> int:
+        tier = self.routes.get(route)
+        if tier is None:
+            raise ValueError(f"Unknown route: {route}")
+        return next(index for index, (name, _) in enumerate(self.tiers) if name == tier)
+
+    def model_for(self, route: str, escalation: int = 0) -> str:
+        """
+        Get the model for a call.
+
+        Args:
+            route: The kind of call, e.g. 'extraction'.
+            escalation: How many tiers above the route's own to go; capped at the top tier.
+
+        Returns:
+            The model name.
+        """
+        index = min(self._tier_index(route) + escalation, len(self.tiers) - 1)
+        return self.tiers[index][1]
+
+    def can_escalate(self, route: str, escalation: int = 0) -> bool:
+        """
+        Whether a call made at this escalation has a higher tier to retry on.
+        """
+        return self._tier_index(route) + escalation < len(self.tiers) - 1
+
+    def record(self, route: str, model: str, latency: float, cost: float, escalated: bool = False,
+               reason: Optional[str] = None) -> None:
+        """
+        Record a finished call.
+
+        Args:
+            route: The kind of call.
+            model: The model it went to.
+            latency: Seconds the call took.
+            cost: Its price in USD.
+            escalated: Whether it retried a call a lower tier handled poorly.
+            reason: Why it was escalated.
+        """
+        if escalated:
+            logger.info(f"Escalated {route} call to {model}: {reason}")
+        with self._lock:
+            stats = self.stats.get((route, model))
+            if stats is None:
+                stats = self.stats[(route, model)] = {"calls": 0, "escalations": 0, "cost_usd": 0.0,
+                                                      "latency": Histogram(self.max_samples)}
+            stats["calls"] += 1
+            stats["escalations"] += int(escalated)
+            stats["cost_usd"] += cost
+            stats["latency"].observe(latency)
+
+    def summary(self) -> List[Dict]:
+        """
+        Summarize calls, escalations, cost and latency per route and model.
+        """
+        with self._lock:
+            items = sorted(self.stats.items())
+            summary = []
+            for (route, model), stats in items:
+                entry = {"route": route, "model": model, "calls": stats["calls"],
+                         "escalations": stats["escalations"], "cost_usd": round(stats["cost_usd"], 6),
+                         "mean_ms": round(stats["latency"].total / stats["calls"] * 1000, 2)}
+                for q in QUANTILES:
+                    entry[f"p{int(q * 100)}_ms"] = round(stats["latency"].percentile(q) * 1000, 2)
+                summary.append(entry)
+        return summary
+
+    def render_prometheus(self) -> str:
+        """
+        Render per-route latency, calls and escalations in the Prometheus text exposition format.
+        """
+        summary = self.summary()
+        lines = ["# TYPE chatbot_llm_route_seconds summary"]
+        for entry in summary:
+            labels = f'route="{entry["route"]}",model="{entry["model"]}"'
+            for q in QUANTILES:
+                lines.append(f'chatbot_llm_route_seconds{{{labels},quantile="{q}"}} '
+                             f'{entry[f"p{int(q * 100)}_ms"] / 1000:.6f}')
+            lines.append(f"chatbot_llm_route_seconds_count{{{labels}}} {entry['calls']}")
+            lines.append(f"chatbot_llm_route_seconds_sum{{{labels}}} {entry['mean_ms'] * entry['calls'] / 1000:.6f}")
+        lines.append("# TYPE chatbot_llm_route_escalations_total counter")
+        lines += [f'chatbot_llm_route_escalations_total{{route="{entry["route"]}",model="{entry["model"]}"}} '
+                  f'{entry["escalations"]}' for entry in summary]
+        lines.append("# TYPE chatbot_llm_route_cost_usd_total counter")
+        lines += [f'chatbot_llm_route_cost_usd_total{{route="{entry["route"]}",model="{entry["model"]}"}} '
+                  f'{entry["cost_usd"]:.6f}' for entry in summary]
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide router used by the chat loop, exported on the instrumentation
+# metrics page
+model_router = ModelRouter()
+instrumentation.add_collector(model_router.render_prometheus)
@@ -1,6 +1,6 @@
 from typing import Dict, List, Optional
 from enum import Enum
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 class UserIntent(str, Enum):
     """Enum for user intents."""
@@ -157,4 +157,29 @@ class ShippingState(BaseModel):
     """Model for a shipping state from /shipping/states API."""
     state_reference: str
     name: str
-    note: str 
\ No newline at end of file
+    note: str 
+
+# Models for tool arguments
+class OptionArgument(BaseModel):
+    """Model for a product option passed to a tool."""
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    type: Optional[str] = Field(None, description="The option type")
+    reference: Optional[str] = Field(None, description="The option reference")
+    count: Optional[str] = Field(None, description="The count or quantity for this option")
+
+class ConversationContextUpdate(BaseModel):
+    """Model for the arguments of the update_conversation_context tool."""
+    model_config = ConfigDict(coerce_numbers_to_str=True, extra="ignore")
+
+    product_type: Optional[str] = Field(None, description="The type of product (e.g., 'business cards', 'book', 'flyer')")
+    product_reference: Optional[str] = Field(None, description="The reference code for the selected product")
+    quantity: Optional[str] = Field(None, description="The quantity requested by the user")
+    paper_type: Optional[str] = Field(None, description="The type of paper (e.g., 'glossy', 'matte', 'offset')")
+    paper_weight: Optional[str] = Field(None, description="The weight of paper (e.g., '250gsm', '300gsm')")
+    laminate: Optional[str] = Field(None, description="The laminate finish (e.g., 'glossy', 'matte', 'none')")
+    country: Optional[str] = Field(None, description="The delivery country")
+    state: Optional[str] = Field(None, description="The delivery state/region (for countries requiring it)")
+    city: Optional[str] = Field(None, description="The delivery city")
+    delivery_speed: Optional[str] = Field(None, description="The preferred delivery speed (e.g., 'fast', 'standard')")
+    selected_options: Optional[List[OptionArgument]] = Field(None, description="List of selected product options")
@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+from models import ProductInfo
+
+logger = logging.getLogger(__name__)
+
+OPTION_GRAPH_PATH = os.getenv("OPTION_GRAPH_PATH", "option_graphs.json")
+
+
+class OptionGraph:
+    """
+    Precomputed option structure for a single product: which option types exist,
+    which references belong to each type, the default per type, and the option
+    combinations the quote API is known to reject.
+    """
+
+    def __init__(self, product_reference: str, option_types: Dict[str, List[str]],
+                 defaults: Dict[str, str], invalid_combinations: Optional[Set[FrozenSet[str]]] = None):
+        self.product_reference = product_reference
+        self.option_types = option_types
+        self.defaults = defaults
+        self.invalid_combinations = invalid_combinations or set()
+
+        # Reverse lookups so every query below is a dict/set membership test
+        self.type_of = {
+            reference: option_type
+            for option_type, references in option_types.items()
+            for reference in references
+        }
+        self.reference_sets = {
+            option_type: frozenset(references)
+            for option_type, references in option_types.items()
+        }
+
+    @classmethod
+    def from_product_info(cls, product_info: ProductInfo) -> "OptionGraph":
+        """
+        Build the graph from a /products/info result.
+
+        Args:
+            product_info: The product info to index.
+
+        Returns:
+            The option graph for the product.
+        """
+        option_types = {}
+        defaults = {}
+        for option in product_info.options:
+            option_types.setdefault(option.type, []).append(option.reference)
+            if option.default == 1:
+                defaults[option.type] = option.reference
+        return cls(product_info.reference, option_types, defaults)
+
+    def resolve(self, selected: Dict[str, str]) -> FrozenSet[str]:
+        """
+        Resolve a partial selection into the full combination the API will price,
+        filling unselected option types with their defaults.
+
+        Args:
+            selected: Mapping of option type to the chosen option reference.
+
+        Returns:
+            The set of option references making up the combination.
+        """
+        combination = dict(self.defaults)
+        combination.update(selected)
+        return frozenset(combination.values())
+
+    def validate_choice(self, option_type: str, option_reference: str,
+                        selected: Optional[Dict[str, str]] = None) -> Optional[str]:
+        """
+        Check a single option choice against the graph.
+
+        Args:
+            option_type: The option type being selected.
+            option_reference: The option reference being selected.
+            selected: The other option choices already made, by type.
+
+        Returns:
+            None if the choice is valid, otherwise a description of the problem.
+        """
+        if option_type not in self.reference_sets:
+            return (f"Unknown option type '{option_type}' for product {self.product_reference}. "
+                    f"Available types: {', '.join(self.option_types)}")
+
+        if option_reference not in self.reference_sets[option_type]:
+            return (f"Option '{option_reference}' is not available for type '{option_type}'. "
+                    f"Available options: {', '.join(self.option_types[option_type])}")
+
+        combination = dict(selected or {})
+        combination[option_type] = option_reference
+        if self.resolve(combination) in self.invalid_combinations:
+            return (f"The combination {', '.join(sorted(self.resolve(combination)))} "
+                    f"was previously rejected by the quote API")
+
+        return None
+
+    def record_invalid(self, references: Iterable[str]) -> None:
+        """
+        Remember a combination of option references the quote API rejected.
+
+        Args:
+            references: The option references that were sent with the failed quote.
+        """
+        selected = {self.type_of[ref]: ref for ref in references if ref in self.type_of}
+        self.invalid_combinations.add(self.resolve(selected))
+
+    def to_dict(self) -> Dict:
+        return {
+            "product_reference": self.product_reference,
+            "option_types": self.option_types,
+            "defaults": self.defaults,
+            "invalid_combinations": sorted(sorted(c) for c in self.invalid_combinations),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "OptionGraph":
+        return cls(
+            product_reference=data["product_reference"],
+            option_types=data.get("option_types", {}),
+            defaults=data.get("defaults", {}),
+            invalid_combinations={frozenset(c) for c in data.get("invalid_combinations", [])},
+        )
+
+
+class OptionGraphStore:
+    """
+    Option graphs for every product in the catalog, persisted next to the
+    catalog snapshot. Thread-safe: tool calls add graphs and record rejected
+    combinations while the catalog change feed re-indexes products. Both the
+    chat process and the warm-up job write the file, so saves merge with it.
+    """
+
+    def __init__(self, graphs: Optional[Dict[str, OptionGraph]] = None, path: str = OPTION_GRAPH_PATH):
+        self.graphs = graphs or {}
+        self.path = path
+        self._lock = threading.RLock()
+        # Products dropped from this store, which a save must not bring back from the file
+        self._removed: Set[str] = set()
+
+    def get(self, product_reference: str) -> Optional[OptionGraph]:
+        """
+        Get the option graph for a product.
+
+        Args:
+            product_reference: The product reference.
+
+        Returns:
+            The graph, or None if the product has not been indexed.
+        """
+        return self.graphs.get(product_reference)
+
+    def add(self, product_info: ProductInfo) -> OptionGraph:
+        """
+        Index a product, keeping any invalid combinations already learned for it.
+
+        Args:
+            product_info: The product info to index.
+
+        Returns:
+            The new option graph.
+        """
+        graph = OptionGraph.from_product_info(product_info)
+        with self._lock:
+            previous = self.graphs.get(product_info.reference)
+            if previous and previous.option_types == graph.option_types:
+                graph.invalid_combinations = previous.invalid_combinations
+            self.graphs[product_info.reference] = graph
+            self._removed.discard(product_info.reference)
+        return graph
+
+    def remove(self, product_reference: str) -> bool:
+        with self._lock:
+            self._removed.add(product_reference)
+            return self.graphs.pop(product_reference, None) is not None
+
+    def record_invalid(self, product_reference: str, references: Iterable[str]) -> bool:
+        """
+        Remember a combination of option references the quote API rejected for a product.
+
+        Args:
+            product_reference: The product reference.
+            references: The option references that were sent with the failed quote.
+
+        Returns:
+            False if the product has not been indexed.
+        """
+        with self._lock:
+            graph = self.graphs.get(product_reference)
+            if graph is None:
+                return False
+            graph.record_invalid(references)
+            return True
+
+    def apply_changes(self, changes: Iterable, product_infos: Dict[str, ProductInfo]) -> int:
+        """
+        Re-index only the products a catalog diff says have new options, and
+        drop removed ones.
+
+        Args:
+            changes: CatalogChange objects from catalog_diff.
+            product_infos: Product info per reference after the changes.
+
+        Returns:
+            The number of graphs added, replaced or dropped.
+        """
+        updated = 0
+        with self._lock:
+            for change in changes:
+                if not change.info_changed:
+                    continue
+                product_info = product_infos.get(change.reference)
+                if product_info is None:
+                    updated += self.remove(change.reference)
+                else:
+                    self.add(product_info)
+                    updated += 1
+            # Products indexed by nothing so far, e.g. after a failed fetch
+            for reference in product_infos.keys() - self.graphs.keys():
+                self.add(product_infos[reference])
+                updated += 1
+        return updated
+
+    @classmethod
+    def build(cls, product_infos: Dict[str, ProductInfo], previous: Optional["OptionGraphStore"] = None,
+              path: str = OPTION_GRAPH_PATH) -> "OptionGraphStore":
+        """
+        Build graphs for a whole catalog.
+
+        Args:
+            product_infos: Product info per reference, e.g. from a catalog snapshot.
+            previous: A previous store to carry learned invalid combinations over from.
+            path: Where the store is persisted.
+
+        Returns:
+            The new store.
+        """
+        store = cls(dict(previous.graphs) if previous else {}, path)
+        for product_info in product_infos.values():
+            store.add(product_info)
+        # Drop products that are no longer in the catalog
+        store._removed = store.graphs.keys() - product_infos.keys()
+        store.graphs = {ref: store.graphs[ref] for ref in product_infos}
+        return store
+
+    def save(self) -> None:
+        """
+        Write the store, merged with what another process wrote since it was
+        loaded: products only the file has are kept, and invalid combinations
+        learned by either side are combined. The merge is kept in memory too.
+        """
+        with self._lock:
+            for reference, graph in self.load(self.path).graphs.items():
+                if reference in self._removed:
+                    continue
+                ours = self.graphs.get(reference)
+                if ours is None:
+                    self.graphs[reference] = graph
+                elif ours.option_types == graph.option_types:
+                    ours.invalid_combinations |= graph.invalid_combinations
+            data = {ref: graph.to_dict() for ref, graph in self.graphs.items()}
+
+            # A temporary file per writer, swapped in whole, so readers never see a torn file
+            tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, path: str = OPTION_GRAPH_PATH) -> "OptionGraphStore":
+        """
+        Load the store from disk.
+
+        Args:
+            path: The file to read.
+
+        Returns:
+            The store, which is empty if the file is missing or unreadable.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls({ref: OptionGraph.from_dict(graph) for ref, graph in data.items()}, path)
+        except FileNotFoundError:
+            return cls(path=path)
+        except (json.JSONDecodeError, KeyError, ValueError) as e:
+            logger.error(f"Failed to load option graphs from {path}: {e}")
+            return cls(path=path)
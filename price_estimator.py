@@ -0,0 +1,385 @@
+import bisect
+import logging
+import math
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from models import Product, QuoteResponse
+
+logger = logging.getLogger(__name__)
+
+# Quotes kept per product for fitting; older ones age out as prices change
+ESTIMATOR_MAX_OBSERVATIONS = int(os.getenv("ESTIMATOR_MAX_OBSERVATIONS", "200"))
+# Most quantity breakpoints in a product's price curve
+ESTIMATOR_MAX_KNOTS = int(os.getenv("ESTIMATOR_MAX_KNOTS", "6"))
+# The smallest +/- range reported around a model-based estimate
+MIN_RELATIVE_RANGE = 0.05
+
+
+class QuoteObservation:
+    """
+    One upstream quote, reduced to what the estimator learns from.
+    """
+
+    __slots__ = ("quantity", "options", "items_price", "fees", "currency", "country",
+                 "unit_weight", "shipping", "observed_at")
+
+    def __init__(self, quantity: int, options: FrozenSet[str], items_price: float, fees: float,
+                 currency: str, country: str, unit_weight: Optional[float], shipping: Dict[str, float],
+                 observed_at: Optional[float] = None):
+        self.quantity = quantity
+        self.options = options
+        self.items_price = items_price
+        self.fees = fees
+        self.currency = currency
+        self.country = country
+        self.unit_weight = unit_weight
+        self.shipping = shipping
+        self.observed_at = observed_at or time.time()
+
+    @classmethod
+    def from_response(cls, quantity: int, options: Iterable[str], country: str,
+                      response: QuoteResponse) -> "QuoteObservation":
+        """
+        Split a single-item quote into item price, fixed fees and shipping per level.
+        """
+        price = float(response.price)
+        items_price = float(response.subtotals.get("items", price))
+        total_weight = sum(float(shipment.total_weight) for shipment in response.shipments)
+        shipping = {}
+        for shipment in response.shipments:
+            for quote in shipment.quotes:
+                shipping[quote.shipping_level] = shipping.get(quote.shipping_level, 0.0) + float(quote.price)
+        return cls(quantity, frozenset(options), items_price, max(0.0, price - items_price),
+                   response.currency, country.upper(), total_weight / quantity if total_weight else None,
+                   shipping)
+
+
+def _identity(observation: QuoteObservation) -> Tuple:
+    return (observation.quantity, observation.options, observation.country, observation.items_price)
+
+
+class PriceCurve:
+    """
+    A product's fitted price model: log unit price is piecewise linear in log
+    quantity, plus an additive term per option (a multiplicative surcharge).
+    """
+
+    def __init__(self, knots: List[float], values: List[float], surcharges: Dict[str, float],
+                 relative_error: float, fees: float, currency: str, unit_weight: Optional[float]):
+        self.knots = knots
+        self.values = values
+        self.surcharges = surcharges
+        self.relative_error = relative_error
+        self.fees = fees
+        self.currency = currency
+        self.unit_weight = unit_weight
+
+    def log_unit_price(self, quantity: int, options: FrozenSet[str]) -> Tuple[float, int]:
+        """
+        Evaluate the curve. Quantities outside the observed range keep the
+        nearest breakpoint's unit price.
+
+        Returns:
+            The log unit price and the number of options without a learned surcharge.
+        """
+        x = math.log(quantity)
+        i = bisect.bisect_left(self.knots, x)
+        if i == 0:
+            value = self.values[0]
+        elif i == len(self.knots):
+            value = self.values[-1]
+        else:
+            x0, x1 = self.knots[i - 1], self.knots[i]
+            value = self.values[i - 1] + (self.values[i] - self.values[i - 1]) * (x - x0) / (x1 - x0)
+        unknown = 0
+        for option in options:
+            surcharge = self.surcharges.get(option)
+            if surcharge is None:
+                unknown += 1
+            else:
+                value += surcharge
+        return value, unknown
+
+
+class PriceEstimator:
+    """
+    Instant ballpark prices learned from the quotes the chatbot has already
+    fetched, for "roughly how much for 500?" without a /orders/quote round trip.
+
+    Each product gets a PriceCurve, refit on the first estimate after new
+    quotes arrive; observing a quote only records it, so the quote path never
+    waits on a fit. Shipping is estimated per country and shipping level by
+    interpolating past shipping prices over the shipment weight; countries
+    without quotes fall back to the median of the others. Products without
+    any quotes fall back to Product.from_price times the quantity, which
+    ignores options and volume discounts.
+    """
+
+    def __init__(self, max_observations: int = ESTIMATOR_MAX_OBSERVATIONS,
+                 max_knots: int = ESTIMATOR_MAX_KNOTS,
+                 load: Optional[Callable[[str, int], Iterable[Tuple[int, str, FrozenSet[str], QuoteResponse]]]] = None):
+        """
+        Initialize the estimator.
+
+        Args:
+            max_observations: Quotes kept per product.
+            max_knots: The most quantity breakpoints per price curve.
+            load: Returns a product's stored quotes, oldest first, as (quantity,
+                country, options, response); called once per product on first
+                use, e.g. QuoteHistoryStore.recent.
+        """
+        self.max_observations = max_observations
+        self.max_knots = max_knots
+        self.load = load
+        self._loaded = set()
+        self._observations: Dict[str, Deque[QuoteObservation]] = {}
+        # Quotes observed since the product's curve was fit; scored and learned from on the next estimate
+        self._unfitted: Dict[str, Deque[QuoteObservation]] = {}
+        self._curves: Dict[str, PriceCurve] = {}
+        self._shipping: Dict[Tuple[str, str], List[Tuple[float, float]]] = {}
+        self._lock = threading.Lock()
+        self._errors: Deque[float] = deque(maxlen=1000)
+        self.stats = {"observations": 0, "fits": 0, "estimates": 0, "from_price": 0, "unavailable": 0}
+
+    def observe(self, product_reference: str, quantity: str, country: str,
+                options: Iterable[str], response: QuoteResponse) -> None:
+        """
+        Learn from an upstream quote. Only records it: the product's curve is
+        scored against it and refit on the product's next estimate.
+
+        Args:
+            product_reference: The quoted product.
+            quantity: The quoted quantity.
+            country: The delivery country code.
+            options: The full option combination that was priced, defaults included.
+            response: The quote.
+        """
+        try:
+            observation = QuoteObservation.from_response(int(quantity), options, country, response)
+        except (ValueError, ZeroDivisionError) as e:
+            logger.info(f"Not learning from quote for {product_reference}: {e}")
+            return
+        if observation.items_price <= 0:
+            return
+
+        with self._lock:
+            self._unfitted.setdefault(product_reference, deque(maxlen=self.max_observations)).append(observation)
+            self._add_shipping(observation)
+            self.stats["observations"] += 1
+
+    def _score(self, curve: PriceCurve, observation: QuoteObservation) -> None:
+        # Callers hold the lock
+        if curve.currency != observation.currency:
+            return
+        value, unknown = curve.log_unit_price(observation.quantity, observation.options)
+        if not unknown:
+            estimate = math.exp(value) * observation.quantity
+            self._errors.append(abs(estimate - observation.items_price) / observation.items_price)
+
+    def _add(self, product_reference: str, observation: QuoteObservation) -> None:
+        # Callers hold the lock
+        history = self._observations.setdefault(product_reference, deque(maxlen=self.max_observations))
+        history.append(observation)
+        self._curves.pop(product_reference, None)
+
+    def _add_shipping(self, observation: QuoteObservation) -> None:
+        # Callers hold the lock
+        if observation.unit_weight is not None:
+            weight = observation.unit_weight * observation.quantity
+            for level, price in observation.shipping.items():
+                points = self._shipping.setdefault((observation.country, level), [])
+                bisect.insort(points, (weight, price))
+                if len(points) > self.max_observations:
+                    # Thin out the middle; the lightest and heaviest bound the interpolation
+                    del points[len(points) // 2]
+
+    def _load(self, product_reference: str) -> None:
+        # Callers hold the lock
+        self._loaded.add(product_reference)
+        if self.load is None:
+            return
+        # The history may already hold quotes observed since startup
+        unfitted = {_identity(observation) for observation in self._unfitted.get(product_reference, ())}
+        loaded = 0
+        for quantity, country, options, response in self.load(product_reference, self.max_observations):
+            try:
+                observation = QuoteObservation.from_response(quantity, options, country, response)
+            except (ValueError, ZeroDivisionError):
+                continue
+            if observation.items_price > 0 and _identity(observation) not in unfitted:
+                self._add(product_reference, observation)
+                self._add_shipping(observation)
+                loaded += 1
+        if loaded:
+            logger.info(f"Loaded {loaded} stored quotes for {product_reference} into the price estimator")
+
+    def _curve(self, product_reference: str) -> Optional[PriceCurve]:
+        # Callers hold the lock
+        if product_reference not in self._loaded:
+            self._load(product_reference)
+        unfitted = self._unfitted.pop(product_reference, None)
+        if unfitted:
+            # Score the curve on the quotes that arrived after it was fit, then learn from them
+            curve = self._curves.get(product_reference)
+            for observation in unfitted:
+                if curve is not None:
+                    self._score(curve, observation)
+                self._add(product_reference, observation)
+        curve = self._curves.get(product_reference)
+        if curve is None and self._observations.get(product_reference):
+            curve = self._curves[product_reference] = self._fit(list(self._observations[product_reference]))
+            self.stats["fits"] += 1
+        return curve
+
+    def _fit(self, observations: List[QuoteObservation]) -> PriceCurve:
+        # Imported here so NumPy is only loaded once there is something to fit
+        import numpy as np
+
+        currency = observations[-1].currency
+        observations = [observation for observation in observations if observation.currency == currency]
+        x = np.log([observation.quantity for observation in observations])
+        y = np.log([observation.items_price / observation.quantity for observation in observations])
+
+        knots = np.unique(x)
+        if len(knots) > self.max_knots:
+            knots = np.unique(np.quantile(knots, np.linspace(0.0, 1.0, self.max_knots)))
+
+        # Hat basis: each quantity is a linear blend of its two nearest knots
+        basis = np.zeros((len(x), len(knots)))
+        positions = np.clip(np.searchsorted(knots, x), 1, len(knots) - 1) if len(knots) > 1 else None
+        if positions is None:
+            basis[:, 0] = 1.0
+        else:
+            x0, x1 = knots[positions - 1], knots[positions]
+            t = np.clip((x - x0) / (x1 - x0), 0.0, 1.0)
+            rows = np.arange(len(x))
+            basis[rows, positions - 1] = 1.0 - t
+            basis[rows, positions] = t
+
+        options = sorted({option for observation in observations for option in observation.options})
+        indicators = np.zeros((len(x), len(options)))
+        column = {option: i for i, option in enumerate(options)}
+        for row, observation in enumerate(observations):
+            for option in observation.options:
+                indicators[row, column[option]] = 1.0
+
+        # Options always chosen together can't be told apart from the base
+        # price; the minimum-norm solution still prices the combinations seen
+        coefficients = np.linalg.lstsq(np.hstack([basis, indicators]), y, rcond=None)[0]
+        residuals = np.hstack([basis, indicators]) @ coefficients - y
+        relative_error = float(np.sqrt(np.mean(np.expm1(np.abs(residuals)) ** 2)))
+
+        weights = [observation.unit_weight for observation in observations if observation.unit_weight]
+        return PriceCurve(
+            knots=knots.tolist(),
+            values=coefficients[:len(knots)].tolist(),
+            surcharges={option: float(coefficients[len(knots) + i]) for i, option in enumerate(options)},
+            relative_error=relative_error,
+            fees=statistics.median(observation.fees for observation in observations),
+            currency=currency,
+            unit_weight=statistics.median(weights) if weights else None,
+        )
+
+    def _estimate_shipping(self, country: str, weight: Optional[float]) -> Optional[Dict]:
+        # Callers hold the lock. The cheapest level, interpolated over weight
+        def level_price(points: List[Tuple[float, float]]) -> float:
+            if weight is None or len(points) == 1:
+                return statistics.median(price for _, price in points)
+            i = bisect.bisect_left(points, (weight, -math.inf))
+            if i == 0:
+                return points[0][1]
+            if i == len(points):
+                return points[-1][1]
+            (w0, p0), (w1, p1) = points[i - 1], points[i]
+            return p0 if w1 == w0 else p0 + (p1 - p0) * (weight - w0) / (w1 - w0)
+
+        levels = {level: level_price(points) for (known, level), points in self._shipping.items()
+                  if known == country}
+        basis = "country"
+        if not levels:
+            by_level: Dict[str, List[float]] = {}
+            for (_, level), points in self._shipping.items():
+                by_level.setdefault(level, []).append(level_price(points))
+            levels = {level: statistics.median(prices) for level, prices in by_level.items()}
+            basis = "other_countries"
+        if not levels:
+            return None
+        level = min(levels, key=levels.get)
+        return {"shipping_level": level, "price": round(levels[level], 2), "basis": basis}
+
+    def estimate(self, product_reference: str, quantity: str, country: Optional[str] = None,
+                 options: Iterable[str] = (), product: Optional[Product] = None) -> Dict:
+        """
+        Estimate a quote locally.
+
+        Args:
+            product_reference: The product.
+            quantity: The quantity.
+            country: The delivery country code, to estimate shipping.
+            options: The option combination, defaults included.
+            product: The product's /products record, for the from_price fallback.
+
+        Returns:
+            The estimated price excluding shipping, with a low/high range when
+            it comes from past quotes, the cheapest estimated shipping level,
+            and the basis of the estimate. Always marked "estimate": True.
+        """
+        count = int(quantity)
+        options = frozenset(options)
+        with self._lock:
+            curve = self._curve(product_reference)
+            shipping = None
+            if country:
+                weight = curve.unit_weight * count if curve and curve.unit_weight else None
+                shipping = self._estimate_shipping(country.upper(), weight)
+
+            if curve is not None:
+                value, unknown = curve.log_unit_price(count, options)
+                price = math.exp(value) * count + curve.fees
+                spread = max(curve.relative_error, MIN_RELATIVE_RANGE) * (1 + unknown)
+                result = {
+                    "estimate": True,
+                    "price": round(price, 2),
+                    "low": round(price * (1 - min(spread, 0.9)), 2),
+                    "high": round(price * (1 + spread), 2),
+                    "currency": curve.currency,
+                    "basis": "past_quotes" if not unknown else "past_quotes_other_options",
+                    "quotes_used": len(self._observations[product_reference]),
+                }
+                self.stats["estimates"] += 1
+            elif product is not None and product.from_price:
+                result = {
+                    "estimate": True,
+                    "price": round(float(product.from_price) * count, 2),
+                    "currency": product.currency or "EUR",
+                    "basis": "from_price",
+                    "note": "Rough: the catalog's starting unit price, before options and volume discounts",
+                }
+                self.stats["from_price"] += 1
+            else:
+                self.stats["unavailable"] += 1
+                return {"estimate": True, "error": f"No pricing data for {product_reference} yet"}
+
+        if shipping is not None:
+            result["shipping"] = shipping
+        return result
+
+    def summary(self) -> Dict:
+        """
+        Summarize usage and accuracy: the mean absolute percentage error of the
+        model's estimates against quotes that arrived later. Quotes are scored
+        when the product is next estimated.
+        """
+        with self._lock:
+            errors = list(self._errors)
+            return {
+                **self.stats,
+                "products": len(self._observations.keys() | self._unfitted.keys()),
+                "scored_quotes": len(errors),
+                "mean_abs_pct_error": round(100 * statistics.mean(errors), 2) if errors else None,
+            }
@@ -0,0 +1,188 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from deadlines import current_deadline
+from models import ProductInfo
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_INFO_CACHE_TTL = int(os.getenv("PRODUCT_INFO_CACHE_TTL", "3600"))
+PRODUCT_INFO_WORKERS = int(os.getenv("PRODUCT_INFO_WORKERS", "8"))
+
+
+class ProductInfoCache:
+    """
+    Product info served from the catalog snapshot, then from an in-memory TTL
+    cache, then from the API. Concurrent requests for the same reference share
+    one upstream fetch.
+    """
+
+    def __init__(self, fetch: Callable[[str], ProductInfo], snapshot: Optional[Callable] = None,
+                 ttl: int = PRODUCT_INFO_CACHE_TTL, max_workers: int = PRODUCT_INFO_WORKERS):
+        """
+        Initialize the cache.
+
+        Args:
+            fetch: Fetches one product's info from the API.
+            snapshot: Returns the current catalog snapshot, or None, which is consulted first.
+            ttl: How long fetched product info is served, in seconds.
+            max_workers: Maximum number of concurrent upstream fetches.
+        """
+        self.fetch = fetch
+        self.snapshot = snapshot
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._entries: Dict[str, Tuple[float, ProductInfo]] = {}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.stats = {"snapshot_hits": 0, "cache_hits": 0, "shared_fetches": 0, "fetches": 0, "errors": 0}
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Callers hold the lock
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="product-info")
+        return self._executor
+
+    def _cached(self, reference: str, snapshot) -> Optional[ProductInfo]:
+        product_info = snapshot.get_product_info(reference) if snapshot else None
+        if product_info is not None:
+            self.stats["snapshot_hits"] += 1
+            return product_info
+        entry = self._entries.get(reference)
+        if entry is not None and entry[0] > time.time():
+            self.stats["cache_hits"] += 1
+            return entry[1]
+        return None
+
+    def _run(self, reference: str) -> ProductInfo:
+        try:
+            product_info = self.fetch(reference)
+            with self._lock:
+                self._entries[reference] = (time.time() + self.ttl, product_info)
+            return product_info
+        except Exception:
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(reference, None)
+
+    def get_many(self, references: Iterable[str]) -> Dict[str, Union[ProductInfo, Exception]]:
+        """
+        Get several products' info, fetching the missing ones concurrently.
+
+        Args:
+            references: The product references.
+
+        Returns:
+            The product info, or the exception its fetch raised, per reference.
+            Fetches still running when the current turn's deadline passes
+            give a TimeoutError; they finish in the background for whoever
+            asks next.
+        """
+        results: Dict[str, Union[ProductInfo, Exception]] = {}
+        futures: Dict[str, Future] = {}
+        # Looked up before taking the lock: loading a newer snapshot publishes
+        # catalog changes, whose subscribers invalidate this cache
+        snapshot = self.snapshot() if self.snapshot else None
+        with self._lock:
+            for reference in dict.fromkeys(references):
+                product_info = self._cached(reference, snapshot)
+                if product_info is not None:
+                    results[reference] = product_info
+                elif reference in self._in_flight:
+                    self.stats["shared_fetches"] += 1
+                    futures[reference] = self._in_flight[reference]
+                else:
+                    self.stats["fetches"] += 1
+                    futures[reference] = self._in_flight[reference] = self._get_executor().submit(self._run, reference)
+
+        # Fetches are shared between turns, so they aren't bound by this
+        # turn's deadline, only the wait for them is
+        deadline = current_deadline()
+        for reference, future in futures.items():
+            try:
+                results[reference] = future.result(timeout=deadline.remaining() if deadline else None)
+            except Exception as e:
+                results[reference] = e
+        return results
+
+    def get(self, reference: str) -> ProductInfo:
+        """
+        Get one product's info.
+
+        Raises:
+            Whatever the upstream fetch raised.
+        """
+        result = self.get_many([reference])[reference]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def invalidate(self, reference: Optional[str] = None) -> int:
+        """
+        Drop cached product info, e.g. after the catalog changed.
+
+        Args:
+            reference: Only drop this product. Everything if None.
+
+        Returns:
+            The number of entries dropped.
+        """
+        with self._lock:
+            if reference is None:
+                dropped = len(self._entries)
+                self._entries.clear()
+                return dropped
+            return 1 if self._entries.pop(reference, None) is not None else 0
+
+
+def compare_products(product_infos: List[ProductInfo]) -> Dict:
+    """
+    Merge several products' info into one side-by-side comparison. What all
+    of them share is listed once; for the rest, specs list one value per
+    product and options list the products that offer them.
+
+    Args:
+        product_infos: The products, in the order they are compared.
+
+    Returns:
+        The comparison.
+    """
+    references = [product_info.reference for product_info in product_infos]
+    comparison = {
+        "products": [{"reference": info.reference, "name": info.name, "note": info.note} for info in product_infos],
+        "common_specs": {},
+        "differing_specs": {},
+        "common_options": {},
+        "differing_options": {},
+    }
+
+    spec_notes = list(dict.fromkeys(spec.note for info in product_infos for spec in info.specs))
+    spec_values = [{spec.note: spec.value for spec in info.specs} for info in product_infos]
+    for note in spec_notes:
+        values = [values.get(note) for values in spec_values]
+        if len(set(values)) == 1:
+            comparison["common_specs"][note] = values[0]
+        else:
+            comparison["differing_specs"][note] = values
+
+    offered: Dict[str, Dict[str, List[str]]] = {}
+    for info in product_infos:
+        for option in info.options:
+            label = f"{option.note} [{option.reference}]"
+            offered.setdefault(option.type, {}).setdefault(label, []).append(info.reference)
+    for option_type, labels in offered.items():
+        common = [label for label, offered_by in labels.items() if len(offered_by) == len(references)]
+        differing = {label: offered_by for label, offered_by in labels.items() if len(offered_by) < len(references)}
+        if common:
+            comparison["common_options"][option_type] = common
+        if differing:
+            comparison["differing_options"][option_type] = differing
+    return comparison
@@ -0,0 +1,218 @@
+import json
+import os
+import re
+import textwrap
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from catalog_warmup import CatalogSnapshot, current_snapshot
+from models import Product
+
+# Providers cache the longest previously seen prompt prefix, so everything
+# that is the same for every session (the system prompt, the tool schemas,
+# which the API renders ahead of the messages, and the catalog summary) comes
+# first and stays byte-identical. The conversation follows, and the session's
+# current state goes last.
+
+SYSTEM_PROMPT = textwrap.dedent("""
+    You are a helpful and friendly chatbot for Cloudprinter.com. Your role is to assist users in getting accurate price information
+    for print products. Engage in natural conversation to gather the necessary details like product type, paper specifications,
+    quantity, and delivery location.
+
+    Always maintain a conversational, helpful, and friendly tone. Ask for one piece of information at a time, and guide the user
+    through the process step by step.
+
+    When helping users select a product:
+    1. First determine what type of product they want (business cards, books, etc.)
+    2. Use search_catalog to find the products matching what they described (or list_all_products to browse a category)
+    3. When a product is selected, use get_product_info to fetch details and available options. If the user is
+       choosing between several candidates, compare them with one get_product_infos call
+    4. For each option type (paper, finish, etc.):
+       - Present the exact available options to the user
+       - When they make a selection, use update_option_selection to record their choice
+       - If they describe a choice in their own words, use search_catalog with the product reference to find the option
+    5. Ask for quantity and delivery location
+    6. Use get_quote to get pricing with all selected options
+
+    For ballpark questions ("roughly how much for 500?") use estimate_price and always say the price is an estimate.
+
+    Make sure to use the exact option references from the API when selecting options. Never make up option references.
+""").strip()
+
+# Precedes the catalog digest, and is left out with it
+CATALOG_DIGEST_PROMPT = (
+    "Answer questions about what we offer from the catalog digest below when it covers them. If it lists the "
+    "matching product's reference, use it directly instead of searching."
+)
+
+# Append the session's request state as the last message. Off by default:
+# the tool results already carry it, and the extra message costs uncached
+# prompt tokens on every call.
+PROMPT_SESSION_STATE_ENABLED = os.getenv("PROMPT_SESSION_STATE_ENABLED", "0") == "1"
+
+# Context fields that are large or already visible in the tool results
+STATE_EXCLUDED_FIELDS = ("quote_result", "available_options")
+
+# Cap on the catalog digest in the system prompt, in estimated tokens (four
+# characters each); 0 leaves the digest out
+CATALOG_DIGEST_MAX_TOKENS = int(os.getenv("CATALOG_DIGEST_MAX_TOKENS", "600"))
+# Categories with at most this many products list them with their references
+CATALOG_DIGEST_LISTED_PRODUCTS = int(os.getenv("CATALOG_DIGEST_LISTED_PRODUCTS", "3"))
+# The most common sizes shown per category
+CATALOG_DIGEST_SIZES = int(os.getenv("CATALOG_DIGEST_SIZES", "4"))
+
+SIZE_PATTERN = re.compile(r"\b(A\d|\d+(?:\.\d+)?x\d+(?:\.\d+)?)\b")
+
+_summary_cache = {"snapshot": None, "summary": None}
+_summary_lock = threading.Lock()
+
+
+def _price(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _category_line(category: str, products: List[Product], detail: int) -> str:
+    """
+    Describe one category, at detail 2 (sizes, prices and, for small
+    categories, the products), 1 (sizes and prices) or 0 (the count only).
+    """
+    line = f"- {category}: {len(products)} product{'s' if len(products) != 1 else ''}"
+    if detail >= 1:
+        sizes = Counter(size for product in products for size in set(SIZE_PATTERN.findall(product.name)))
+        if sizes:
+            line += "; sizes " + ", ".join(size for size, _ in sizes.most_common(CATALOG_DIGEST_SIZES))
+            if len(sizes) > CATALOG_DIGEST_SIZES:
+                line += " and more"
+        prices = [price for price in (_price(product.from_price) for product in products) if price is not None]
+        if prices:
+            currency = Counter(product.currency for product in products if product.currency).most_common(1)
+            price_range = f"{min(prices):.2f}" + (f"-{max(prices):.2f}" if max(prices) > min(prices) else "")
+            line += f"; from {price_range} {currency[0][0] if currency else ''}".rstrip() + " per unit"
+    if detail >= 2 and len(products) <= CATALOG_DIGEST_LISTED_PRODUCTS:
+        line += ". " + "; ".join(f"{product.name} = {product.reference}" for product in products)
+    return line
+
+
+def catalog_digest(products: List[Product], max_tokens: int = CATALOG_DIGEST_MAX_TOKENS) -> str:
+    """
+    Describe the catalog compactly enough for every prompt: its categories
+    with product counts, common sizes and starting price ranges, and the
+    references of categories with only a few products.
+
+    Detail is reduced until the digest fits the token budget; categories
+    that still don't fit, the smallest first, are only counted.
+
+    Args:
+        products: The /products list.
+        max_tokens: The budget, in estimated tokens.
+
+    Returns:
+        The digest, or an empty string for an empty catalog or budget.
+    """
+    by_category: Dict[str, List[Product]] = {}
+    for product in products:
+        by_category.setdefault(product.category or "Other", []).append(product)
+    if not by_category or max_tokens <= 0:
+        return ""
+    categories = sorted(by_category.items(), key=lambda item: (-len(item[1]), item[0]))
+    header = (f"Catalog digest ({len(products)} products; use the listed references directly, "
+              f"and search_catalog for anything more specific):")
+    max_chars = max_tokens * 4
+
+    for detail in (2, 1, 0):
+        lines = [header] + [_category_line(category, members, detail) for category, members in categories]
+        if sum(len(line) + 1 for line in lines) <= max_chars:
+            return "\n".join(lines)
+
+    # Even the counts don't fit: keep the largest categories
+    lines, used = [header], len(header)
+    for index, (category, members) in enumerate(categories):
+        line = _category_line(category, members, 0)
+        rest = f"- and {len(categories) - index} more categories"
+        if used + len(line) + len(rest) + 2 > max_chars:
+            lines.append(rest)
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join(lines)
+
+
+def catalog_summary(snapshot: Optional[CatalogSnapshot]) -> str:
+    """
+    Summarize the catalog for the stable part of the prompt.
+
+    The summary is regenerated only when a new snapshot is loaded.
+
+    Args:
+        snapshot: The catalog snapshot, if one has been built.
+
+    Returns:
+        The catalog digest, or an empty string without a snapshot.
+    """
+    if snapshot is None:
+        return ""
+    with _summary_lock:
+        if _summary_cache["snapshot"] is not snapshot:
+            _summary_cache["summary"] = catalog_digest(snapshot.products)
+            _summary_cache["snapshot"] = snapshot
+        return _summary_cache["summary"]
+
+
+def stable_system_message() -> Dict:
+    """
+    Build the system message shared by every session.
+    """
+    summary = catalog_summary(current_snapshot())
+    content = f"{SYSTEM_PROMPT}\n\n{CATALOG_DIGEST_PROMPT}\n{summary}" if summary else SYSTEM_PROMPT
+    return {"role": "system", "content": content}
+
+
+def session_state_message(context: Dict) -> Optional[Dict]:
+    """
+    Describe what we know about the user's request, as the last message.
+
+    Args:
+        context: The conversation context.
+
+    Returns:
+        A system message with the known fields, or None if nothing is known yet.
+    """
+    known = {
+        key: value for key, value in context.items()
+        if value not in (None, "", []) and key not in STATE_EXCLUDED_FIELDS
+    }
+    if not known:
+        return None
+    state = json.dumps(known, sort_keys=True, separators=(",", ":"))
+    return {"role": "system", "content": f"Current request state: {state}"}
+
+
+def assemble_messages(history: List[Dict], context: Optional[Dict] = None) -> List[Dict]:
+    """
+    Build the messages to send to the model: the stable system message, the
+    conversation without its own system messages, then the session state.
+
+    Args:
+        history: The conversation history, which may start with a system prompt.
+        context: The conversation context, appended when PROMPT_SESSION_STATE_ENABLED is set.
+
+    Returns:
+        The messages for the request. The history itself is not modified.
+    """
+    messages = [stable_system_message()]
+    messages.extend(message for message in history if message.get("role") != "system")
+    state = session_state_message(context) if context is not None and PROMPT_SESSION_STATE_ENABLED else None
+    if state is not None:
+        messages.append(state)
+    return messages
+
+
+def cached_token_ratio(usage: Dict) -> float:
+    """
+    Get the share of prompt tokens the provider served from its prompt cache.
+    """
+    return usage.get("cached_tokens", 0) / usage["prompt_tokens"] if usage.get("prompt_tokens") else 0.0
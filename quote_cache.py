@@ -0,0 +1,299 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from deadlines import current_deadline
+from models import QuoteResponse
+from option_graph import OptionGraph
+from quote_history import QuoteHistoryStore
+
+logger = logging.getLogger(__name__)
+
+QUOTE_CACHE_TTL = int(os.getenv("QUOTE_CACHE_TTL", "3600"))
+QUOTE_PREFETCH_ENABLED = os.getenv("QUOTE_PREFETCH_ENABLED", "1") == "1"
+QUOTE_PREFETCH_WORKERS = int(os.getenv("QUOTE_PREFETCH_WORKERS", "2"))
+QUOTE_PREFETCH_BUDGET = int(os.getenv("QUOTE_PREFETCH_BUDGET", "6"))
+
+QuoteKey = Tuple[str, str, str, Optional[str], FrozenSet[str]]
+
+
+def quote_cache_key(product_reference: str, quantity: str, country: str,
+                    state: Optional[str], option_references: Iterable[str]) -> QuoteKey:
+    """
+    Build the cache key for a single-item quote.
+
+    Args:
+        product_reference: The product reference.
+        quantity: The product quantity.
+        country: The delivery country code.
+        state: The delivery state code, if any.
+        option_references: The option references priced with the product.
+
+    Returns:
+        A hashable key identifying the quote.
+    """
+    return (
+        product_reference,
+        str(quantity).strip(),
+        country.strip().upper(),
+        state.strip().upper() if state else None,
+        frozenset(option_references),
+    )
+
+
+class QuoteCache:
+    """
+    In-memory TTL cache of quote responses keyed by quote_cache_key, backed
+    by the persistent quote history so quotes survive restarts.
+    """
+
+    def __init__(self, ttl: int = QUOTE_CACHE_TTL, history: Optional[QuoteHistoryStore] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: How long a quote is served, in seconds.
+            history: Looked up on a miss, for quotes fetched by earlier processes.
+        """
+        self.ttl = ttl
+        self.history = history
+        self._entries: Dict[QuoteKey, Tuple[float, QuoteResponse]] = {}
+        self._invalidated: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: QuoteKey) -> Optional[QuoteResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, response = entry
+                if time.time() - stored_at <= self.ttl:
+                    return response
+                del self._entries[key]
+            since = max(time.time() - self.ttl, self._invalidated.get(key[0], 0.0))
+        if self.history is None:
+            return None
+
+        found = self.history.lookup(*key, since=since)
+        if found is None:
+            return None
+        stored_at, response = found
+        with self._lock:
+            self._entries.setdefault(key, (stored_at, response))
+        return response
+
+    def put(self, key: QuoteKey, response: QuoteResponse) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), response)
+
+    def invalidate_product(self, product_reference: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == product_reference]:
+                del self._entries[key]
+            # Stored quotes from before now are stale too
+            self._invalidated[product_reference] = time.time()
+
+
+class QuotePrefetcher:
+    """
+    Speculatively fetches the quotes a conversation is likely to ask for next
+    and stores them in a QuoteCache, so the confirmation quote is served
+    without an upstream round trip.
+    """
+
+    def __init__(self, cache: QuoteCache,
+                 fetch: Callable[[str, str, str, Optional[str], List[str]], QuoteResponse],
+                 max_workers: int = QUOTE_PREFETCH_WORKERS, budget: int = QUOTE_PREFETCH_BUDGET,
+                 enabled: bool = QUOTE_PREFETCH_ENABLED):
+        """
+        Initialize the prefetcher.
+
+        Args:
+            cache: The cache prefetched quotes are stored in.
+            fetch: Performs an upstream quote for (product, quantity, country, state, option references).
+            max_workers: Maximum number of concurrent prefetch requests.
+            budget: Maximum number of prefetches per product, quantity and
+                destination within the cache's TTL.
+            enabled: Whether speculative requests are issued at all.
+        """
+        self.cache = cache
+        self.fetch = fetch
+        self.budget = budget
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="quote-prefetch")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[QuoteKey, Future] = {}
+        # Both expire with the cache's TTL, oldest first: prefetched keys when
+        # their quote would, budgets when the window they were spent in ends
+        self._prefetched: "OrderedDict[QuoteKey, float]" = OrderedDict()
+        self._spent: "OrderedDict[Tuple, List]" = OrderedDict()
+        self.stats = {"issued": 0, "errors": 0, "over_budget": 0, "hits": 0, "cache_hits": 0, "misses": 0}
+
+    def candidate_combinations(self, graph: OptionGraph, selected: Dict[str, str]) -> List[FrozenSet[str]]:
+        """
+        List the option combinations the user is most likely to confirm next: the
+        current selection with defaults, then each value of the first option type
+        the user has not chosen yet.
+
+        Args:
+            graph: The product's option graph.
+            selected: The user's choices so far, by option type.
+
+        Returns:
+            Resolved option combinations, most likely first.
+        """
+        combinations = [graph.resolve(selected)]
+        pending = [option_type for option_type in graph.option_types if option_type not in selected]
+        if pending:
+            for reference in graph.option_types[pending[0]]:
+                combinations.append(graph.resolve({**selected, pending[0]: reference}))
+
+        unique = []
+        for combination in combinations:
+            if combination not in unique and combination not in graph.invalid_combinations:
+                unique.append(combination)
+        return unique
+
+    def prefetch(self, graph: OptionGraph, selected: Dict[str, str], quantity: str,
+                 country: str, state: Optional[str] = None) -> int:
+        """
+        Schedule background quotes for the likely next combinations.
+
+        Args:
+            graph: The product's option graph.
+            selected: The user's choices so far, by option type.
+            quantity: The product quantity.
+            country: The delivery country code.
+            state: The delivery state code, if any.
+
+        Returns:
+            The number of quotes scheduled.
+        """
+        if not self.enabled:
+            return 0
+
+        scheduled = 0
+        budget_key = quote_cache_key(graph.product_reference, quantity, country, state, ())[:4]
+        for combination in self.candidate_combinations(graph, selected):
+            key = quote_cache_key(graph.product_reference, quantity, country, state, combination)
+            # May hit the quote history, so not under the lock
+            if self.cache.get(key) is not None:
+                continue
+            with self._lock:
+                self._expire()
+                if key in self._in_flight:
+                    continue
+                spent = self._spent.setdefault(budget_key, [time.time(), 0])
+                if spent[1] >= self.budget:
+                    self.stats["over_budget"] += 1
+                    break
+                spent[1] += 1
+                self._submit(key, graph.product_reference, quantity, country, state, sorted(combination))
+            scheduled += 1
+
+        if scheduled:
+            logger.info(f"Prefetching {scheduled} quotes for {graph.product_reference}")
+        return scheduled
+
+    def fetch_in_background(self, product_reference: str, quantity: str, country: str,
+                            state: Optional[str], option_references: Iterable[str]) -> bool:
+        """
+        Start a quote the user asked for in the background, e.g. while they
+        are shown an estimate. Unlike prefetches this is not speculative, so it
+        ignores the budget and runs even when prefetching is disabled.
+
+        Args:
+            product_reference: The product reference.
+            quantity: The product quantity.
+            country: The delivery country code.
+            state: The delivery state code, if any.
+            option_references: The full option combination to quote.
+
+        Returns:
+            True if a request was started, False if the quote is already cached or in flight.
+        """
+        key = quote_cache_key(product_reference, quantity, country, state, option_references)
+        if self.cache.get(key) is not None:
+            return False
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._submit(key, product_reference, quantity, country, state, sorted(key[4]))
+        return True
+
+    def _expire(self) -> None:
+        # Callers hold the lock
+        now = time.time()
+        while self._prefetched and next(iter(self._prefetched.values())) <= now:
+            self._prefetched.popitem(last=False)
+        while self._spent and next(iter(self._spent.values()))[0] + self.cache.ttl <= now:
+            self._spent.popitem(last=False)
+
+    def _submit(self, key: QuoteKey, product_reference: str, quantity: str, country: str,
+                state: Optional[str], option_references: List[str]) -> None:
+        # Callers hold the lock
+        self.stats["issued"] += 1
+        self._in_flight[key] = self._executor.submit(
+            self._run, key, product_reference, quantity, country, state, option_references
+        )
+
+    def _run(self, key: QuoteKey, product_reference: str, quantity: str, country: str,
+             state: Optional[str], option_references: List[str]) -> Optional[QuoteResponse]:
+        try:
+            response = self.fetch(product_reference, quantity, country, state, option_references)
+            self.cache.put(key, response)
+            with self._lock:
+                self._prefetched.pop(key, None)
+                self._prefetched[key] = time.time() + self.cache.ttl
+            return response
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            logger.info(f"Quote prefetch for {product_reference} failed: {e}")
+            return None
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def lookup(self, key: QuoteKey) -> Optional[QuoteResponse]:
+        """
+        Serve a quote from the cache, waiting for a matching in-flight prefetch
+        rather than issuing a duplicate request.
+
+        Args:
+            key: The quote's cache key.
+
+        Returns:
+            The quote response, or None if the caller must fetch it, including
+            when the prefetch doesn't finish within the current turn's deadline.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+        if future is not None:
+            deadline = current_deadline()
+            try:
+                response = future.result(timeout=deadline.remaining() if deadline else None)
+            except FutureTimeoutError:
+                response = None
+        else:
+            response = self.cache.get(key)
+
+        with self._lock:
+            self._expire()
+            if response is None:
+                self.stats["misses"] += 1
+            elif key in self._prefetched:
+                self.stats["hits"] += 1
+            else:
+                self.stats["cache_hits"] += 1
+        return response
+
+    def hit_rate(self) -> float:
+        """
+        Fraction of quote lookups served by a speculative prefetch.
+        """
+        lookups = self.stats["hits"] + self.stats["cache_hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
@@ -0,0 +1,373 @@
+import argparse
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from models import QuoteResponse
+
+logger = logging.getLogger(__name__)
+
+QUOTE_HISTORY_PATH = os.getenv("QUOTE_HISTORY_PATH", "quote_history.sqlite3")
+QUOTE_HISTORY_ENABLED = os.getenv("QUOTE_HISTORY_ENABLED", "1") == "1"
+# Writes are buffered and committed together, at most this many per transaction
+QUOTE_HISTORY_BATCH_SIZE = int(os.getenv("QUOTE_HISTORY_BATCH_SIZE", "100"))
+QUOTE_HISTORY_FLUSH_INTERVAL = float(os.getenv("QUOTE_HISTORY_FLUSH_INTERVAL", "1.0"))
+# Quotes waiting to be written; beyond this, new quotes are dropped rather than block a turn
+QUOTE_HISTORY_QUEUE_SIZE = int(os.getenv("QUOTE_HISTORY_QUEUE_SIZE", "10000"))
+QUOTE_HISTORY_RETENTION_DAYS = int(os.getenv("QUOTE_HISTORY_RETENTION_DAYS", "90"))
+# Compaction keeps this many of the newest quotes for each identical request
+QUOTE_HISTORY_KEEP_PER_KEY = int(os.getenv("QUOTE_HISTORY_KEEP_PER_KEY", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quotes (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    product_reference TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    country TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT '',
+    options TEXT NOT NULL,
+    price REAL NOT NULL,
+    currency TEXT NOT NULL,
+    expires_at REAL,
+    request TEXT NOT NULL,
+    response TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_quotes_lookup ON quotes (product_reference, country, quantity, created_at);
+CREATE INDEX IF NOT EXISTS idx_quotes_country ON quotes (country, created_at);
+CREATE INDEX IF NOT EXISTS idx_quotes_quantity ON quotes (quantity);
+CREATE INDEX IF NOT EXISTS idx_quotes_created ON quotes (created_at);
+"""
+
+INSERT = """
+INSERT INTO quotes (created_at, product_reference, quantity, country, state, options, price,
+                    currency, expires_at, request, response)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _options_column(option_references: Iterable[str]) -> str:
+    return json.dumps(sorted(option_references), separators=(",", ":"))
+
+
+def _expires_at(response: QuoteResponse) -> Optional[float]:
+    try:
+        expires = datetime.fromisoformat(response.expire_date)
+    except ValueError:
+        return None
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+    return expires.timestamp()
+
+
+class QuoteHistoryStore:
+    """
+    Every quote the chatbot has fetched, persisted in SQLite so quotes survive
+    restarts and can be reused without another API call.
+
+    The database runs in WAL mode, so readers never wait for the writer.
+    record() only enqueues: a background thread commits queued quotes in
+    batches, so a chat turn never waits on disk. The connection and the writer
+    thread are created on first use.
+    """
+
+    def __init__(self, path: str = QUOTE_HISTORY_PATH, enabled: bool = QUOTE_HISTORY_ENABLED,
+                 batch_size: int = QUOTE_HISTORY_BATCH_SIZE,
+                 flush_interval: float = QUOTE_HISTORY_FLUSH_INTERVAL,
+                 queue_size: int = QUOTE_HISTORY_QUEUE_SIZE):
+        """
+        Initialize the store.
+
+        Args:
+            path: The SQLite database file.
+            enabled: Whether quotes are stored and looked up at all.
+            batch_size: The most quotes committed in one transaction.
+            flush_interval: The longest a quote waits in the queue, in seconds.
+            queue_size: The most quotes waiting to be written.
+        """
+        self.path = path
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Tuple]]" = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._writer: Optional[threading.Thread] = None
+        self._initialized = False
+        self.stats = {"queued": 0, "written": 0, "failed": 0, "dropped": 0, "batches": 0, "hits": 0, "misses": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets them read while the writer commits
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            with self._lock:
+                if not self._initialized:
+                    setup = sqlite3.connect(self.path)
+                    setup.execute("PRAGMA journal_mode=WAL")
+                    setup.executescript(SCHEMA)
+                    setup.close()
+                    self._initialized = True
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def record(self, product_reference: str, quantity: str, country: str, state: Optional[str],
+               option_references: Iterable[str], request: Dict, response: QuoteResponse) -> bool:
+        """
+        Queue a quote to be written. Never blocks.
+
+        Args:
+            product_reference: The quoted product.
+            quantity: The quoted quantity.
+            country: The delivery country code.
+            state: The delivery state code, if any.
+            option_references: The full option combination priced, defaults included.
+            request: The quote request, without the API key.
+            response: The quote response.
+
+        Returns:
+            True if queued, False if the store is disabled or the queue is full.
+        """
+        if not self.enabled:
+            return False
+        try:
+            row = (
+                time.time(), product_reference, int(quantity), country.strip().upper(),
+                state.strip().upper() if state else "", _options_column(option_references),
+                float(response.price), response.currency, _expires_at(response),
+                json.dumps(request, separators=(",", ":")), response.model_dump_json(),
+            )
+        except ValueError as e:
+            logger.info(f"Not recording quote for {product_reference}: {e}")
+            return False
+
+        self._ensure_writer()
+        # Counted before the writer can see it, so flush() never returns early
+        self._count("queued")
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._count("queued", -1)
+            self._count("dropped")
+            return False
+        return True
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[stat] += amount
+
+    def _ensure_writer(self) -> None:
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, daemon=True,
+                                                    name="quote-history-writer")
+                    self._writer.start()
+                    atexit.register(self.close)
+
+    def _write_loop(self) -> None:
+        connection = self._connect()
+        while True:
+            rows = []
+            stop = False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is None:
+                    stop = True
+                else:
+                    rows.append(item)
+                # Take whatever else is waiting, up to a batch
+                while len(rows) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is None:
+                        stop = True
+                        break
+                    rows.append(item)
+            except queue.Empty:
+                pass
+            if rows:
+                try:
+                    with connection:
+                        connection.executemany(INSERT, rows)
+                    self._count("written", len(rows))
+                    self._count("batches")
+                except sqlite3.Error as e:
+                    self._count("failed", len(rows))
+                    logger.error(f"Failed to write {len(rows)} quotes to {self.path}: {e}")
+            if stop:
+                return
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """
+        Wait until every queued quote has been written.
+        """
+        deadline = time.time() + timeout
+        while self.stats["written"] + self.stats["failed"] < self.stats["queued"] and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        """
+        Write the queued quotes and stop the writer thread.
+        """
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join(timeout=10)
+
+    def lookup(self, product_reference: str, quantity: str, country: str, state: Optional[str],
+               option_references: Iterable[str], since: float) -> Optional[Tuple[float, QuoteResponse]]:
+        """
+        Find the newest stored quote for exactly this request.
+
+        Args:
+            product_reference: The product.
+            quantity: The quantity.
+            country: The delivery country code.
+            state: The delivery state code, if any.
+            option_references: The full option combination, defaults included.
+            since: The oldest quote to accept (epoch seconds).
+
+        Returns:
+            When the quote was fetched and the quote, or None if there is no
+            recent enough, unexpired one.
+        """
+        if not self.enabled:
+            return None
+        try:
+            count = int(quantity)
+        except ValueError:
+            return None
+        now = time.time()
+        try:
+            row = self._connect().execute(
+                "SELECT created_at, response FROM quotes WHERE product_reference = ? AND country = ? AND quantity = ? "
+                "AND state = ? AND options = ? AND created_at >= ? AND (expires_at IS NULL OR expires_at > ?) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (product_reference, country.strip().upper(), count, state.strip().upper() if state else "",
+                 _options_column(option_references), since, now),
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read quote history from {self.path}: {e}")
+            return None
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return row[0], QuoteResponse.model_validate_json(row[1])
+
+    def recent(self, product_reference: str, limit: int) -> List[Tuple[int, str, FrozenSet[str], QuoteResponse]]:
+        """
+        Get a product's newest quotes, e.g. to train the price estimator.
+
+        Args:
+            product_reference: The product.
+            limit: The most quotes to return.
+
+        Returns:
+            (quantity, country, option references, response) tuples, oldest first.
+        """
+        if not self.enabled:
+            return []
+        try:
+            rows = self._connect().execute(
+                "SELECT quantity, country, options, response FROM quotes WHERE product_reference = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (product_reference, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Failed to read quote history from {self.path}: {e}")
+            return []
+        return [
+            (quantity, country, frozenset(json.loads(options)), QuoteResponse.model_validate_json(response))
+            for quantity, country, options, response in reversed(rows)
+        ]
+
+    def summary(self, since: Optional[float] = None) -> List[Dict]:
+        """
+        Quote counts and price ranges per product and country.
+
+        Args:
+            since: Only count quotes from this time (epoch seconds) on.
+
+        Returns:
+            One entry per product and country, most quoted first.
+        """
+        rows = self._connect().execute(
+            "SELECT product_reference, country, currency, COUNT(*), MIN(quantity), MAX(quantity), "
+            "MIN(price), MAX(price), MAX(created_at) FROM quotes WHERE created_at >= ? "
+            "GROUP BY product_reference, country, currency ORDER BY COUNT(*) DESC",
+            (since or 0,),
+        ).fetchall()
+        return [
+            {"product_reference": product, "country": country, "currency": currency, "quotes": count,
+             "min_quantity": min_quantity, "max_quantity": max_quantity, "min_price": min_price,
+             "max_price": max_price, "last_quoted": last}
+            for product, country, currency, count, min_quantity, max_quantity, min_price, max_price, last in rows
+        ]
+
+    def compact(self, retention_days: int = QUOTE_HISTORY_RETENTION_DAYS,
+                keep_per_key: int = QUOTE_HISTORY_KEEP_PER_KEY, vacuum: bool = False) -> int:
+        """
+        Drop quotes older than the retention period and all but the newest few
+        quotes of each identical request, then truncate the WAL.
+
+        Args:
+            retention_days: Quotes older than this are deleted.
+            keep_per_key: Quotes kept per product, quantity, destination and options.
+            vacuum: Also rebuild the database file to return free pages to the OS.
+
+        Returns:
+            The number of quotes deleted.
+        """
+        connection = self._connect()
+        with connection:
+            deleted = connection.execute(
+                "DELETE FROM quotes WHERE created_at < ?", (time.time() - retention_days * 86400,)
+            ).rowcount
+            deleted += connection.execute(
+                "DELETE FROM quotes WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER ("
+                "PARTITION BY product_reference, quantity, country, state, options ORDER BY created_at DESC"
+                ") AS position FROM quotes) WHERE position > ?)",
+                (keep_per_key,),
+            ).rowcount
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if vacuum:
+            connection.execute("VACUUM")
+        logger.info(f"Compacted quote history {self.path}: {deleted} quotes deleted")
+        return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and compact the quote history.")
+    parser.add_argument("--path", default=QUOTE_HISTORY_PATH, help="The quote history database")
+    parser.add_argument("--compact", action="store_true", help="Delete old and duplicate quotes")
+    parser.add_argument("--vacuum", action="store_true", help="Rebuild the file after compacting")
+    parser.add_argument("--retention-days", type=int, default=QUOTE_HISTORY_RETENTION_DAYS,
+                        help="Quotes older than this are deleted when compacting")
+    parser.add_argument("--since-days", type=float, help="Only summarize quotes from the last N days")
+    args = parser.parse_args()
+
+    from logging_utils import setup_logging
+
+    setup_logging()
+
+    store = QuoteHistoryStore(args.path, enabled=True)
+    if args.compact:
+        store.compact(args.retention_days, vacuum=args.vacuum)
+    since = time.time() - args.since_days * 86400 if args.since_days else None
+    for entry in store.summary(since):
+        print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+def replay(script_path: str, times: int = 1, latency_ms: float = 0.0) -> Dict:
+    """
+    Replay a recorded conversation through the real agent loop with the
+    scripted LLM backend, so it runs offline and deterministically.
+
+    Cloudprinter calls go wherever the API client points; set
+    CLOUDPRINTER_BASE_URL to a mock_cloudprinter.py server to stay offline.
+
+    Args:
+        script_path: The conversation script (see fixtures/conversations).
+        times: How many times to replay the conversation.
+        latency_ms: Simulated latency per LLM call.
+
+    Returns:
+        Totals for the replay: conversations, turns, elapsed seconds and tokens.
+    """
+    # The chatbot builds its backend at import time; never reach for OpenAI here
+    os.environ.setdefault("LLM_BACKEND", "scripted")
+    os.environ.setdefault("LLM_SCRIPT_PATH", script_path)
+
+    import chatbot
+    from llm_backend import ScriptedLLMBackend
+    from sessions import new_token_usage
+
+    with open(script_path, "r", encoding="utf-8") as f:
+        script = json.load(f)
+
+    backend = ScriptedLLMBackend(script["responses"], latency_ms=latency_ms)
+    chatbot.llm = backend
+
+    usage = new_token_usage()
+    turns = 0
+    started = time.perf_counter()
+    for _ in range(times):
+        backend.reset()
+        chatbot.reset_conversation_context()
+        messages = [{"role": "system", "content": chatbot.SYSTEM_PROMPT}]
+        for user_input in script["user_turns"]:
+            messages.append({"role": "user", "content": user_input})
+            chatbot.run_turn(messages, usage=usage)
+            turns += 1
+
+    return {
+        "script": script.get("name", script_path),
+        "conversations": times,
+        "turns": turns,
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        **usage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded conversation offline.")
+    parser.add_argument("script", help="Conversation script, e.g. fixtures/conversations/business_cards.json")
+    parser.add_argument("--times", type=int, default=1, help="Number of replays")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated latency per LLM call")
+    args = parser.parse_args()
+
+    print(json.dumps(replay(args.script, args.times, args.latency_ms), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from models import Product, ProductInfo
+
+logger = logging.getLogger(__name__)
+
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search_index.npz")
+
+# Features are hashed into this many buckets; collisions only add a little noise
+HASH_BITS = 20
+# Character trigrams match spelling variants ("laminated", "lamination") but
+# say less than a whole word does
+TRIGRAM_WEIGHT = 0.3
+# Matches scoring below this fraction of the best match are noise, not alternatives
+MIN_RELATIVE_SCORE = 0.2
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+PART_RE = re.compile(r"[a-z]+|[0-9]+")
+
+# Words users say for the terms the catalog uses
+SYNONYMS = {
+    "gram": "gsm", "grams": "gsm", "gr": "gsm", "g": "gsm",
+    "glossy": "gloss", "shiny": "gloss",
+    "matt": "matte", "mat": "matte",
+    "hardback": "hardcover", "hardbound": "hardcover", "casewrap": "hardcover", "cw": "hardcover",
+    "softback": "softcover", "paperback": "softcover", "pb": "softcover",
+    "laminate": "lamination", "laminated": "lamination",
+    "color": "colour", "colored": "colour",
+    "bw": "black", "mono": "black",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into normalized words. Words mixing letters and digits
+    ("300gsm", "A5") are kept whole and also split into their parts, so
+    "300 gram" matches "300gsm".
+    """
+    tokens = []
+    for word in WORD_RE.findall(text.lower()):
+        tokens.append(SYNONYMS.get(word, word))
+        parts = PART_RE.findall(word)
+        if len(parts) > 1:
+            tokens.extend(SYNONYMS.get(part, part) for part in parts)
+    return tokens
+
+
+@lru_cache(maxsize=1 << 16)
+def _bucket(feature: str) -> int:
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(feature.encode("utf-8")) & ((1 << HASH_BITS) - 1)
+
+
+def hashed_features(text: str) -> Dict[int, float]:
+    """
+    Compute the hashed n-gram term frequencies of a text: words, word pairs
+    and character trigrams, with sublinear term frequency.
+
+    Args:
+        text: The text to vectorize.
+
+    Returns:
+        Weight per feature bucket.
+    """
+    counts: Dict[int, float] = {}
+    tokens = tokenize(text)
+    for token in tokens:
+        bucket = _bucket(f"w:{token}")
+        counts[bucket] = counts.get(bucket, 0.0) + 1.0
+        padded = f" {token} "
+        for i in range(len(padded) - 2):
+            bucket = _bucket(f"c:{padded[i:i + 3]}")
+            counts[bucket] = counts.get(bucket, 0.0) + TRIGRAM_WEIGHT
+    for first, second in zip(tokens, tokens[1:]):
+        bucket = _bucket(f"b:{first} {second}")
+        counts[bucket] = counts.get(bucket, 0.0) + 1.0
+    return {bucket: 1.0 + math.log(count) if count >= 1.0 else count for bucket, count in counts.items()}
+
+
+def product_text(product: Product, product_info: Optional[ProductInfo]) -> str:
+    """
+    The text a product is matched on: name, category, note and specs.
+    """
+    parts = [product.name, product.category or "", product.note or "", product.reference.replace("_", " ")]
+    if product_info is not None:
+        parts.extend(f"{spec.note} {spec.value}" for spec in product_info.specs)
+    return " ".join(parts)
+
+
+class CatalogSearchIndex:
+    """
+    Top-k search over products and product options by hashed n-gram vectors.
+
+    Documents are TF-IDF weighted, L2-normalized sparse vectors stored as an
+    inverted index (postings sorted by feature), so scoring a batch of queries
+    is a single vectorized gather and bincount whatever the catalog size.
+    Options shared by several products (the same paper on every business
+    card) are indexed once.
+    """
+
+    def __init__(self, documents: List[Dict], features: np.ndarray, offsets: np.ndarray,
+                 postings: np.ndarray, weights: np.ndarray, idf: np.ndarray,
+                 snapshot_created_at: Optional[float] = None):
+        """
+        Initialize the index. Use build() or load() rather than calling this directly.
+
+        Args:
+            documents: Per document: its kind ("product" or "option") and what
+                the search returns for it; options also list their products.
+            features: The sorted distinct feature buckets.
+            offsets: Where each feature's postings start; one longer than features.
+            postings: The documents containing each feature, grouped by feature.
+            weights: The normalized TF-IDF weight of each posting.
+            idf: The inverse document frequency of each feature.
+            snapshot_created_at: The catalog snapshot the index was built from.
+        """
+        self.documents = documents
+        self.features = features
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self.idf = idf
+        self.snapshot_created_at = snapshot_created_at
+
+        kinds = np.array([document["kind"] for document in documents])
+        self._kind_masks = {kind: kinds == kind for kind in ("product", "option")}
+        self._product_options: Dict[str, List[int]] = {}
+        for index, document in enumerate(documents):
+            for reference in document.get("products", ()):
+                self._product_options.setdefault(reference, []).append(index)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @classmethod
+    def build(cls, products: Sequence[Product], product_infos: Dict[str, ProductInfo],
+              snapshot_created_at: Optional[float] = None) -> "CatalogSearchIndex":
+        """
+        Build an index over a catalog.
+
+        Args:
+            products: The /products list.
+            product_infos: Product info per reference; their options and specs are indexed too.
+            snapshot_created_at: The catalog snapshot the catalog came from.
+
+        Returns:
+            The index.
+        """
+        started = time.perf_counter()
+        documents: List[Dict] = []
+        texts: List[str] = []
+        for product in products:
+            documents.append({"kind": "product", "reference": product.reference, "name": product.name,
+                              "category": product.category})
+            texts.append(product_text(product, product_infos.get(product.reference)))
+
+        options: Dict[tuple, Dict] = {}
+        for reference, product_info in product_infos.items():
+            for option in product_info.options:
+                key = (option.type, option.reference, option.note)
+                document = options.get(key)
+                if document is None:
+                    document = options[key] = {"kind": "option", "type": option.type,
+                                               "reference": option.reference, "note": option.note,
+                                               "products": []}
+                    documents.append(document)
+                    texts.append(f"{option.note} {option.reference.replace('_', ' ')} "
+                                 f"{option.type.replace('_', ' ')}")
+                document["products"].append(reference)
+
+        # Term frequencies as (feature, document, weight) triples
+        rows, columns, values = [], [], []
+        for index, text in enumerate(texts):
+            for bucket, weight in hashed_features(text).items():
+                rows.append(bucket)
+                columns.append(index)
+                values.append(weight)
+        feature_of = np.array(rows, dtype=np.uint32)
+        document_of = np.array(columns, dtype=np.int32)
+        weight_of = np.array(values, dtype=np.float32)
+
+        order = np.lexsort((document_of, feature_of))
+        feature_of, document_of, weight_of = feature_of[order], document_of[order], weight_of[order]
+        features, starts, frequencies = np.unique(feature_of, return_index=True, return_counts=True)
+        offsets = np.append(starts, len(feature_of)).astype(np.int64)
+
+        idf = (np.log((len(documents) + 1) / (frequencies + 1)) + 1.0).astype(np.float32)
+        weight_of *= np.repeat(idf, frequencies)
+        norms = np.sqrt(np.bincount(document_of, weights=weight_of.astype(np.float64) ** 2,
+                                    minlength=len(documents)))
+        weight_of /= np.maximum(norms, 1e-12)[document_of].astype(np.float32)
+
+        index = cls(documents, features, offsets, document_of, weight_of, idf, snapshot_created_at)
+        logger.info(f"Built search index over {len(products)} products and {len(options)} options "
+                    f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return index
+
+    def search(self, queries: Sequence[str], limit: int = 5, kind: Optional[str] = None,
+               product_reference: Optional[str] = None) -> List[List[Dict]]:
+        """
+        Find the best-matching documents for a batch of queries.
+
+        Args:
+            queries: The texts to match.
+            limit: The most matches to return per query.
+            kind: Only return "product" or "option" documents.
+            product_reference: Only return options of this product.
+
+        Returns:
+            Per query, the matches best first, each with its cosine similarity as
+            "score". Matches far weaker than the best one are left out.
+        """
+        if not queries or not self.documents:
+            return [[] for _ in queries]
+        query_rows, query_features, query_weights = [], [], []
+        for row, query in enumerate(queries):
+            for bucket, weight in hashed_features(query).items():
+                query_rows.append(row)
+                query_features.append(bucket)
+                query_weights.append(weight)
+        query_rows = np.array(query_rows, dtype=np.int64)
+        query_features = np.array(query_features, dtype=np.uint32)
+        query_weights = np.array(query_weights, dtype=np.float32)
+
+        # Keep the query features the catalog has, weighted by IDF
+        positions = np.searchsorted(self.features, query_features)
+        positions = np.minimum(positions, len(self.features) - 1)
+        known = self.features[positions] == query_features
+        query_rows, positions = query_rows[known], positions[known]
+        query_weights = query_weights[known] * self.idf[positions]
+        norms = np.sqrt(np.bincount(query_rows, weights=query_weights.astype(np.float64) ** 2,
+                                    minlength=len(queries)))
+        query_weights /= np.maximum(norms, 1e-12)[query_rows].astype(np.float32)
+
+        # Gather every posting of every query feature and sum per (query, document)
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        total = int(lengths.sum())
+        gather = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        cells = np.repeat(query_rows, lengths) * len(self.documents) + self.postings[gather]
+        products = self.weights[gather] * np.repeat(query_weights, lengths)
+        scores = np.bincount(cells, weights=products, minlength=len(queries) * len(self.documents))
+        scores = scores.reshape(len(queries), len(self.documents))
+
+        allowed = self._allowed(kind, product_reference)
+        if allowed is not None:
+            scores[:, ~allowed] = 0.0
+
+        limit = max(1, min(limit, len(self.documents)))
+        top = np.argpartition(-scores, limit - 1, axis=1)[:, :limit]
+        results = []
+        for row in range(len(queries)):
+            best = top[row][np.argsort(-scores[row, top[row]], kind="stable")]
+            threshold = max(scores[row, best[0]] * MIN_RELATIVE_SCORE, 1e-6)
+            results.append([
+                {**self._result(self.documents[index]), "score": round(float(scores[row, index]), 2)}
+                for index in best if scores[row, index] >= threshold
+            ])
+        return results
+
+    def _allowed(self, kind: Optional[str], product_reference: Optional[str]) -> Optional[np.ndarray]:
+        if product_reference is not None:
+            allowed = np.zeros(len(self.documents), dtype=bool)
+            allowed[self._product_options.get(product_reference, [])] = True
+            return allowed
+        if kind is not None:
+            return self._kind_masks[kind]
+        return None
+
+    @staticmethod
+    def _result(document: Dict) -> Dict:
+        # The product list of a shared option is only for filtering
+        return {key: value for key, value in document.items() if key != "products"}
+
+    def has_options(self, product_reference: str) -> bool:
+        return product_reference in self._product_options
+
+    def save(self, path: str = SEARCH_INDEX_PATH) -> None:
+        """
+        Write the index to disk atomically.
+
+        Args:
+            path: The file to write.
+        """
+        tmp_path = f"{path}.tmp.npz"
+        metadata = {"documents": self.documents, "snapshot_created_at": self.snapshot_created_at}
+        np.savez(tmp_path, features=self.features, offsets=self.offsets, postings=self.postings,
+                 weights=self.weights, idf=self.idf, metadata=np.array(json.dumps(metadata)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = SEARCH_INDEX_PATH) -> Optional["CatalogSearchIndex"]:
+        """
+        Load an index from disk.
+
+        Args:
+            path: The file to read.
+
+        Returns:
+            The index, or None if the file is missing or unreadable.
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                metadata = json.loads(str(data["metadata"]))
+                return cls(metadata["documents"], data["features"], data["offsets"], data["postings"],
+                           data["weights"], data["idf"], metadata.get("snapshot_created_at"))
+        except FileNotFoundError:
+            return None
+        except (KeyError, ValueError, OSError) as e:
+            logger.error(f"Failed to load search index from {path}: {e}")
+            return None
+
+
+_index_cache = {"key": None, "index": None}
+_index_lock = threading.Lock()
+
+
+def current_index(snapshot, path: str = SEARCH_INDEX_PATH,
+                  get_products: Optional[Callable[[], List[Product]]] = None) -> CatalogSearchIndex:
+    """
+    Get the search index for a catalog snapshot.
+
+    The index the warm-up job persisted is used when it was built from this
+    snapshot; otherwise one is built in memory. Either way it is kept until
+    the snapshot changes.
+
+    Args:
+        snapshot: The catalog snapshot, or None if no crawl has been persisted.
+        path: The persisted index.
+        get_products: Fetches the product list to index when there is no snapshot.
+
+    Returns:
+        The index.
+    """
+    key = snapshot.created_at if snapshot is not None else None
+    with _index_lock:
+        if _index_cache["index"] is None or _index_cache["key"] != key:
+            index = CatalogSearchIndex.load(path) if snapshot is not None else None
+            if index is None or index.snapshot_created_at != key:
+                if snapshot is not None:
+                    index = CatalogSearchIndex.build(snapshot.products, snapshot.product_infos, key)
+                else:
+                    index = CatalogSearchIndex.build(get_products() if get_products else [], {})
+            _index_cache["key"] = key
+            _index_cache["index"] = index
+        return _index_cache["index"]
@@ -0,0 +1,290 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sessions import Session
+
+logger = logging.getLogger(__name__)
+
+SESSION_LOG_PATH = os.getenv("SESSION_LOG_PATH", "sessions.sqlite3")
+SESSION_LOG_ENABLED = os.getenv("SESSION_LOG_ENABLED", "1") == "1"
+# Stored histories longer than this are compacted to their most recent messages
+SESSION_LOG_MAX_MESSAGES = int(os.getenv("SESSION_LOG_MAX_MESSAGES", "200"))
+SESSION_LOG_MAX_CHARS = int(os.getenv("SESSION_LOG_MAX_CHARS", "200000"))
+# What compaction keeps, as a share of the limits, so it doesn't run every turn
+SESSION_LOG_KEEP_FRACTION = 0.5
+SESSION_LOG_RETENTION_DAYS = int(os.getenv("SESSION_LOG_RETENTION_DAYS", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    base_messages TEXT NOT NULL,
+    persisted_count INTEGER NOT NULL,
+    stored_messages INTEGER NOT NULL,
+    stored_chars INTEGER NOT NULL,
+    context TEXT NOT NULL,
+    token_usage TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    messages TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at);
+"""
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, separators=(",", ":"), default=str)
+
+
+def compact_messages(messages: List[Dict], max_messages: int, max_chars: int) -> List[Dict]:
+    """
+    Shorten a history to its system messages and the most recent messages
+    that fit the limits. The kept part starts at a user message, so no tool
+    result is separated from the assistant message that called the tool.
+
+    Args:
+        messages: The history.
+        max_messages: The most messages to keep, system messages included.
+        max_chars: The most serialized characters to keep.
+
+    Returns:
+        The compacted history.
+    """
+    system = [message for message in messages if message.get("role") == "system"]
+    rest = [message for message in messages if message.get("role") != "system"]
+    budget_messages = max_messages - len(system)
+    budget_chars = max_chars - sum(len(_dumps(message)) for message in system)
+
+    start = len(rest)
+    for index in range(len(rest) - 1, -1, -1):
+        budget_messages -= 1
+        budget_chars -= len(_dumps(rest[index]))
+        if budget_messages < 0 or budget_chars < 0:
+            break
+        if rest[index].get("role") == "user":
+            start = index
+    return system + rest[start:]
+
+
+class SessionLog:
+    """
+    Durable conversation state in SQLite, so a session survives restarts and
+    recycled workers and can be resumed by id.
+
+    Each turn appends only the messages added since the previous write, plus
+    the current context (selected options and last quote included) and token
+    usage. When a stored history outgrows the limits it is compacted to its
+    most recent messages; the context keeps what was learned from the rest.
+    """
+
+    def __init__(self, path: str = SESSION_LOG_PATH, enabled: bool = SESSION_LOG_ENABLED,
+                 max_messages: int = SESSION_LOG_MAX_MESSAGES, max_chars: int = SESSION_LOG_MAX_CHARS):
+        """
+        Initialize the log. The database is opened on first use.
+
+        Args:
+            path: The SQLite database file.
+            enabled: Whether sessions are persisted at all.
+            max_messages: Stored messages per session before compaction.
+            max_chars: Stored message characters per session before compaction.
+        """
+        self.path = path
+        self.enabled = enabled
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._initialized = False
+        self.stats = {"appends": 0, "resumes": 0, "compactions": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets them read while another writes
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            with self._lock:
+                if not self._initialized:
+                    setup = sqlite3.connect(self.path)
+                    setup.execute("PRAGMA journal_mode=WAL")
+                    setup.executescript(SCHEMA)
+                    setup.close()
+                    self._initialized = True
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def append_turn(self, session: Session) -> None:
+        """
+        Persist what changed in a session since its last write.
+
+        Args:
+            session: The session, after a turn.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        try:
+            connection = self._connect()
+            with connection:
+                row = connection.execute(
+                    "SELECT persisted_count, stored_messages, stored_chars FROM sessions WHERE session_id = ?",
+                    (session.session_id,),
+                ).fetchone()
+                if row is None or row[0] > len(session.messages):
+                    # New, or reset in memory since the last write
+                    self._write_base(connection, session, session.messages, now)
+                else:
+                    persisted_count, stored_messages, stored_chars = row
+                    new_messages = session.messages[persisted_count:]
+                    payload = _dumps(new_messages)
+                    if new_messages:
+                        connection.execute(
+                            "INSERT INTO turns (session_id, seq, created_at, messages) VALUES (?, "
+                            "(SELECT COALESCE(MAX(seq), 0) + 1 FROM turns WHERE session_id = ?), ?, ?)",
+                            (session.session_id, session.session_id, now, payload),
+                        )
+                    stored_messages += len(new_messages)
+                    stored_chars += len(payload) if new_messages else 0
+                    connection.execute(
+                        "UPDATE sessions SET updated_at = ?, persisted_count = ?, stored_messages = ?, "
+                        "stored_chars = ?, context = ?, token_usage = ? WHERE session_id = ?",
+                        (now, len(session.messages), stored_messages, stored_chars, _dumps(session.context),
+                         _dumps(session.token_usage), session.session_id),
+                    )
+                    if stored_messages > self.max_messages or stored_chars > self.max_chars:
+                        self._compact(connection, session, now)
+            self.stats["appends"] += 1
+        except sqlite3.Error as e:
+            # Losing persistence must not fail the turn
+            logger.error(f"Failed to persist session {session.session_id}: {e}")
+
+    def _write_base(self, connection: sqlite3.Connection, session: Session, messages: List[Dict],
+                    now: float) -> None:
+        base = _dumps(messages)
+        connection.execute("DELETE FROM turns WHERE session_id = ?", (session.session_id,))
+        connection.execute(
+            "INSERT INTO sessions (session_id, created_at, updated_at, base_messages, persisted_count, "
+            "stored_messages, stored_chars, context, token_usage) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at, "
+            "base_messages = excluded.base_messages, persisted_count = excluded.persisted_count, "
+            "stored_messages = excluded.stored_messages, stored_chars = excluded.stored_chars, "
+            "context = excluded.context, token_usage = excluded.token_usage",
+            (session.session_id, now, now, base, len(session.messages), len(messages), len(base),
+             _dumps(session.context), _dumps(session.token_usage)),
+        )
+
+    def _compact(self, connection: sqlite3.Connection, session: Session, now: float) -> None:
+        messages = self._stored_messages(connection, session.session_id)
+        compacted = compact_messages(messages, int(self.max_messages * SESSION_LOG_KEEP_FRACTION),
+                                     int(self.max_chars * SESSION_LOG_KEEP_FRACTION))
+        self._write_base(connection, session, compacted, now)
+        self.stats["compactions"] += 1
+        logger.info(f"Compacted session {session.session_id} from {len(messages)} to {len(compacted)} messages")
+
+    @staticmethod
+    def _stored_messages(connection: sqlite3.Connection, session_id: str) -> List[Dict]:
+        row = connection.execute("SELECT base_messages FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        messages = json.loads(row[0]) if row else []
+        for (turn,) in connection.execute(
+                "SELECT messages FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)):
+            messages.extend(json.loads(turn))
+        return messages
+
+    def load(self, session_id: str) -> Optional[Session]:
+        """
+        Resume a session.
+
+        Args:
+            session_id: The session id.
+
+        Returns:
+            The session with its stored history, context and token usage, or
+            None if it was never persisted.
+        """
+        if not self.enabled:
+            return None
+        try:
+            connection = self._connect()
+            with connection:
+                row = connection.execute(
+                    "SELECT context, token_usage FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+                messages = self._stored_messages(connection, session_id)
+                # The resumed history is the one later turns append to
+                connection.execute("UPDATE sessions SET persisted_count = ? WHERE session_id = ?",
+                                   (len(messages), session_id))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to load session {session_id}: {e}")
+            return None
+        self.stats["resumes"] += 1
+        return Session(session_id, messages=messages, context=json.loads(row[0]), token_usage=json.loads(row[1]))
+
+    def reset(self, session: Session) -> None:
+        """
+        Replace a session's stored history after it was started over.
+        """
+        if not self.enabled:
+            return
+        try:
+            connection = self._connect()
+            with connection:
+                self._write_base(connection, session, session.messages, time.time())
+        except sqlite3.Error as e:
+            logger.error(f"Failed to persist reset of session {session.session_id}: {e}")
+
+    def delete(self, session_id: str) -> None:
+        if not self.enabled:
+            return
+        connection = self._connect()
+        with connection:
+            connection.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def prune(self, retention_days: int = SESSION_LOG_RETENTION_DAYS) -> int:
+        """
+        Delete sessions not used within the retention period.
+
+        Returns:
+            The number of sessions deleted.
+        """
+        cutoff = time.time() - retention_days * 86400
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                "DELETE FROM turns WHERE session_id IN (SELECT session_id FROM sessions WHERE updated_at < ?)",
+                (cutoff,),
+            )
+            deleted = connection.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(f"Pruned {deleted} sessions from {self.path}")
+        return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the persisted chat sessions.")
+    parser.add_argument("--path", default=SESSION_LOG_PATH, help="The session database")
+    parser.add_argument("--retention-days", type=int, default=SESSION_LOG_RETENTION_DAYS,
+                        help="Sessions unused for longer than this are deleted")
+    args = parser.parse_args()
+
+    from logging_utils import setup_logging
+
+    setup_logging()
+    SessionLog(args.path, enabled=True).prune(args.retention_days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Sessions idle for longer than this are dropped from the store
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+# The least recently used sessions are dropped beyond this many
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+
+
+def new_conversation_context() -> Dict:
+    """
+    Create an empty conversation context.
+    """
+    return {
+        "product_type": None,
+        "product_reference": None,
+        "quantity": None,
+        "paper_type": None,
+        "paper_weight": None,
+        "laminate": None,
+        "country": None,
+        "state": None,
+        "city": None,
+        "delivery_speed": None,
+        "quote_result": None,
+        "selected_options": []
+    }
+
+
+def new_token_usage() -> Dict:
+    """
+    Create zeroed token usage counters.
+    """
+    return {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "cached_tokens": 0,
+        "cost_usd": 0.0
+    }
+
+
+class Session:
+    """
+    Everything that belongs to one user's conversation: the message history,
+    what we've learned about their request, and their token usage.
+    """
+
+    def __init__(self, session_id: Optional[str] = None, messages: Optional[List[Dict]] = None,
+                 context: Optional[Dict] = None, token_usage: Optional[Dict] = None, llm: Any = None):
+        """
+        Initialize the session.
+
+        Args:
+            session_id: Identifies the session. A random id is generated if None.
+            messages: The message history.
+            context: The conversation context the tools read and update.
+            token_usage: Token counters for the session.
+            llm: An LLM backend to use for this session instead of the process-wide one.
+        """
+        self.session_id = session_id or uuid.uuid4().hex
+        self.messages = messages if messages is not None else []
+        self.context = context if context is not None else new_conversation_context()
+        self.token_usage = token_usage if token_usage is not None else new_token_usage()
+        self.llm = llm
+        self.last_active = time.time()
+
+    def reset(self) -> None:
+        """
+        Start the conversation over, keeping only the system messages.
+        """
+        self.messages[:] = [message for message in self.messages if message.get("role") == "system"]
+        self.context = new_conversation_context()
+        self.token_usage = new_token_usage()
+
+
+class SessionStore:
+    """
+    Thread-safe in-memory store of sessions by id, dropping idle and least
+    recently used sessions.
+    """
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, max_count: int = SESSION_MAX_COUNT):
+        """
+        Initialize the store.
+
+        Args:
+            idle_ttl: Seconds after which an unused session is dropped.
+            max_count: Maximum number of sessions kept.
+        """
+        self.idle_ttl = idle_ttl
+        self.max_count = max_count
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id: Optional[str] = None, messages: Optional[List[Dict]] = None) -> Session:
+        """
+        Create and store a new session.
+
+        Args:
+            session_id: The session id. A random id is generated if None.
+            messages: The initial message history, e.g. the system prompt.
+
+        Returns:
+            The session.
+        """
+        session = Session(session_id, messages=list(messages or []))
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._evict()
+        return session
+
+    def add(self, session: Session) -> Session:
+        """
+        Store an existing session, e.g. one resumed from disk.
+
+        Returns:
+            The session.
+        """
+        with self._lock:
+            session.last_active = time.time()
+            self._sessions[session.session_id] = session
+            self._evict()
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """
+        Get a session and mark it as used.
+
+        Returns:
+            The session, or None if it doesn't exist or has expired.
+        """
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.time()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _evict(self) -> None:
+        # Sessions are ordered by last use, so expired ones are at the front
+        cutoff = time.time() - self.idle_ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_active >= cutoff and len(self._sessions) <= self.max_count:
+                break
+            del self._sessions[session_id]
+
+
+# Session used when no other session is active, e.g. the CLI chat loop
+_default_session = Session("default")
+_current_session: ContextVar[Optional[Session]] = ContextVar("current_session", default=None)
+
+
+def current_session() -> Session:
+    """
+    Get the session the current turn is running for.
+    """
+    return _current_session.get() or _default_session
+
+
+@contextmanager
+def use_session(session: Session):
+    """
+    Make a session current for the duration of a block, so the chatbot tools
+    read and update its context.
+
+    Args:
+        session: The session to activate.
+    """
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
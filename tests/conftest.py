@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+# Keep every store the modules open on import out of the working tree; the
+# paths are read when the modules are first imported, so set them up front
+_workdir = tempfile.mkdtemp(prefix="cloudprinter-tests-")
+for name, filename in [
+    ("CATALOG_SNAPSHOT_PATH", "catalog_snapshot.json"),
+    ("OPTION_GRAPH_PATH", "option_graphs.json"),
+    ("SEARCH_INDEX_PATH", "search_index.npz"),
+    ("CATALOG_CHANGE_LOG_PATH", "catalog_changes.jsonl"),
+    ("QUOTE_HISTORY_PATH", "quote_history.sqlite3"),
+    ("SESSION_LOG_PATH", "sessions.sqlite3"),
+]:
+    os.environ[name] = os.path.join(_workdir, filename)
+os.environ.setdefault("CLOUDPRINTER_API_KEY", "test")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
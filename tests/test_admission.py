@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def acquire_in_thread(controller, session_id, timeout=5):
+    outcome = {}
+
+    def acquire():
+        try:
+            outcome["ticket"] = controller.acquire(session_id, timeout)
+        except AdmissionRejected as e:
+            outcome["rejection"] = e
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    return thread, outcome
+
+
+def wait_until_queued(controller, count):
+    for _ in range(500):
+        if controller.summary()["queued"] == count:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"{count} turns never queued")
+
+
+def test_release_admits_the_next_queued_turn():
+    controller = AdmissionController(max_concurrent=1)
+    first = controller.acquire("a")
+    thread, outcome = acquire_in_thread(controller, "b")
+    wait_until_queued(controller, 1)
+
+    controller.release(first)
+    thread.join(5)
+
+    assert outcome["ticket"].session_id == "b"
+    assert controller.summary()["running"] == 1
+
+
+def test_a_newer_message_supersedes_the_queued_turn_and_cancels_the_running_one():
+    controller = AdmissionController(max_concurrent=1)
+    running = controller.acquire("a")
+    thread, outcome = acquire_in_thread(controller, "a")
+    wait_until_queued(controller, 1)
+
+    newer_thread, newer = acquire_in_thread(controller, "a")
+    thread.join(5)
+
+    assert outcome["rejection"].reason == "superseded"
+    assert running.cancelled.is_set()
+    controller.release(running)
+    newer_thread.join(5)
+    assert newer["ticket"].session_id == "a"
+
+
+def test_a_full_queue_sheds_new_turns():
+    controller = AdmissionController(max_concurrent=1, max_queue=1)
+    controller.acquire("a")
+    thread, _ = acquire_in_thread(controller, "b", timeout=0.5)
+    wait_until_queued(controller, 1)
+
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire("c")
+    assert e.value.reason == "overloaded"
+    assert e.value.retry_after >= 1.0
+    thread.join(5)
+
+
+def test_a_turn_that_waits_too_long_times_out():
+    controller = AdmissionController(max_concurrent=1)
+    controller.acquire("a")
+
+    with pytest.raises(AdmissionRejected) as e:
+        controller.acquire("b", timeout=0.05)
+    assert e.value.reason == "timeout"
+    assert controller.summary()["queued"] == 0
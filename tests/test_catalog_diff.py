@@ -0,0 +1,132 @@
+import os
+import threading
+
+from catalog_diff import CatalogChangeFeed, ChangeKind, catalog_changes, diff_snapshots
+from catalog_warmup import CATALOG_PATH, CatalogSnapshot, current_snapshot, product_hash
+from models import Product, ProductInfo, ProductOption
+
+
+def make_snapshot(products, infos, created_at):
+    return CatalogSnapshot(
+        products,
+        {info.reference: info for info in infos},
+        {product.reference: product_hash(product) for product in products},
+        created_at=created_at,
+    )
+
+
+def product(reference, price="1.00", name=None):
+    return Product(name=name or reference, reference=reference, category="Cards", from_price=price, currency="EUR")
+
+
+def info(reference, options=("paper_300",)):
+    return ProductInfo(name=reference, reference=reference, options=[
+        ProductOption(reference=option, note=option, type="type_paper", default=0) for option in options
+    ])
+
+
+def test_first_crawl_adds_everything():
+    current = make_snapshot([product("p1"), product("p2")], [info("p1"), info("p2")], 1.0)
+
+    changes = diff_snapshots(None, current)
+
+    assert [(change.kind, change.reference) for change in changes] == [
+        (ChangeKind.ADDED, "p1"), (ChangeKind.ADDED, "p2")]
+
+
+def test_unchanged_catalog_has_no_changes():
+    previous = make_snapshot([product("p1")], [info("p1")], 1.0)
+    current = make_snapshot([product("p1")], [info("p1")], 2.0)
+
+    assert diff_snapshots(previous, current) == []
+
+
+def test_classifies_removed_price_and_option_changes():
+    previous = make_snapshot([product("p1"), product("p2"), product("p3")],
+                             [info("p1"), info("p2"), info("p3")], 1.0)
+    current = make_snapshot([product("p1", price="2.00"), product("p2")],
+                            [info("p1"), info("p2", options=("paper_350",))], 2.0)
+
+    changes = {change.reference: change for change in diff_snapshots(previous, current)}
+
+    assert changes["p1"].kind == ChangeKind.PRICE_CHANGED
+    assert (changes["p1"].previous_price, changes["p1"].price) == ("1.00", "2.00")
+    assert not changes["p1"].search_relevant and not changes["p1"].info_changed
+    assert changes["p2"].kind == ChangeKind.MODIFIED
+    assert changes["p2"].fields == ["options"] and changes["p2"].info_changed
+    assert changes["p3"].kind == ChangeKind.REMOVED
+
+
+def test_renamed_product_is_modified_and_search_relevant():
+    previous = make_snapshot([product("p1")], [info("p1")], 1.0)
+    current = make_snapshot([product("p1", name="Renamed")], [info("p1")], 2.0)
+
+    [change] = diff_snapshots(previous, current)
+
+    assert change.kind == ChangeKind.MODIFIED and change.fields == ["name"]
+    assert change.search_relevant
+
+
+def test_feed_delivers_on_its_own_thread():
+    feed = CatalogChangeFeed()
+    delivered = []
+    feed.subscribe(lambda changes, snapshot: delivered.append((threading.current_thread(), changes)))
+    current = make_snapshot([product("p1")], [info("p1")], 1.0)
+
+    feed.publish(diff_snapshots(None, current), current)
+    feed.publish([], current)
+    feed.flush()
+
+    assert len(delivered) == 1
+    assert delivered[0][0] is not threading.current_thread()
+
+
+def test_loading_a_newer_snapshot_does_not_deadlock_the_product_info_cache():
+    import chatbot
+
+    make_snapshot([product("p1")], [info("p1")], 1.0).save(CATALOG_PATH)
+    os.utime(CATALOG_PATH, (1_000_000, 1_000_000))
+    assert current_snapshot(CATALOG_PATH) is not None
+    make_snapshot([product("p1", price="2.00")], [info("p1", options=("paper_350",))], 2.0).save(CATALOG_PATH)
+    os.utime(CATALOG_PATH, (2_000_000, 2_000_000))
+
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(info=chatbot.product_info_cache.get("p1")), daemon=True)
+    worker.start()
+    worker.join(timeout=5)
+    catalog_changes.flush()
+
+    assert not worker.is_alive()
+    assert [option.reference for option in result["info"].options] == ["paper_350"]
+
+
+class FlakyClient:
+    def __init__(self, products, infos):
+        self.products = products
+        self.infos = {product_info.reference: product_info for product_info in infos}
+        self.failing = set()
+
+    def get_products(self):
+        return self.products
+
+    def get_product_info(self, reference):
+        if reference in self.failing:
+            raise ConnectionError("upstream unavailable")
+        return self.infos[reference]
+
+
+def test_failed_fetch_keeps_previous_product_info(tmp_path):
+    from catalog_warmup import CatalogWarmer
+
+    client = FlakyClient([product("p1"), product("p2")], [info("p1"), info("p2")])
+    warmer = CatalogWarmer(client, path=str(tmp_path / "snapshot.json"), max_workers=2,
+                           option_graph_path=str(tmp_path / "graphs.json"),
+                           search_index_path=str(tmp_path / "index.npz"), change_log_path="")
+    first = warmer.crawl()
+
+    client.failing = {"p1", "p2"}
+    second = warmer.crawl(full=True)
+
+    assert second.product_infos == first.product_infos
+    assert second.info_hashes == first.info_hashes
+    assert diff_snapshots(first, second) == []
@@ -0,0 +1,8 @@
+import pytest
+
+from conversation_phase import PHASE_TOOLS
+
+
+@pytest.mark.parametrize("phase", list(PHASE_TOOLS))
+def test_every_phase_can_step_back_to_another_product(phase):
+    assert {"search_catalog", "get_product_info", "update_conversation_context"} <= PHASE_TOOLS[phase]
@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import chatbot
+from deadlines import (Deadline, DeadlineExceeded, TurnCancelled, call_timeout, check_deadline, current_deadline,
+                       use_deadline)
+from llm_backend import LLMBackend, ScriptedLLMBackend
+from sessions import Session, use_session
+from tool_registry import ToolRegistry
+
+
+def test_call_timeout_is_capped_by_the_remaining_budget():
+    assert call_timeout(30) == 30
+    with use_deadline(Deadline(budget=5)):
+        assert 4 < call_timeout(30) <= 5
+        assert call_timeout(2) == 2
+
+
+def test_a_spent_or_cancelled_deadline_stops_the_next_call():
+    with use_deadline(Deadline(budget=0.1)):
+        with pytest.raises(DeadlineExceeded):
+            call_timeout(30)
+
+    deadline = Deadline()
+    deadline.cancel()
+    with use_deadline(deadline), pytest.raises(TurnCancelled):
+        check_deadline()
+
+
+def test_parallel_tools_see_the_turn_deadline():
+    registry = ToolRegistry()
+    seen = []
+
+    @registry.tool(description="Record the deadline", parallel_safe=True)
+    def record(n: int):
+        time.sleep(0.01)
+        seen.append(current_deadline())
+
+    deadline = Deadline()
+    with use_deadline(deadline):
+        registry.execute([("record", {"n": 1}), ("record", {"n": 2})])
+
+    assert seen == [deadline, deadline]
+
+
+class CancellingClient:
+    """Cancels the turn while a tool is waiting on the API, as a newer message would."""
+
+    def get_shipping_levels(self):
+        current_deadline().cancel()
+        call_timeout(10)
+
+
+def test_tools_let_a_cancelled_turn_stop(monkeypatch):
+    monkeypatch.setattr(chatbot, "get_cloudprinter_client", lambda: CancellingClient())
+
+    with use_deadline(Deadline()), pytest.raises(TurnCancelled):
+        chatbot.registry.call("get_shipping_levels", {})
+
+
+class CountingBackend(LLMBackend):
+    """Replays a script without checking the turn's deadline itself."""
+
+    def __init__(self, responses):
+        self.scripted = ScriptedLLMBackend(responses)
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return self.scripted.create(timeout=30, **kwargs)
+
+
+def test_a_cancelled_turn_stops_after_the_running_tool(monkeypatch):
+    monkeypatch.setattr(chatbot, "get_cloudprinter_client", lambda: CancellingClient())
+    backend = CountingBackend([
+        {"tool_calls": [{"name": "get_shipping_levels"}]},
+        {"content": "Here are the shipping levels"},
+    ])
+    session = Session(messages=[{"role": "system", "content": "prompt"}], llm=backend)
+    session.messages.append({"role": "user", "content": "How fast can you ship?"})
+    events = []
+
+    with use_session(session):
+        reply = chatbot.run_turn(session.messages, on_event=lambda event, data: events.append(event))
+
+    assert reply == "This request was cancelled."
+    assert backend.calls == 1
+    assert [message["role"] for message in session.messages[-3:]] == ["assistant", "tool", "assistant"]
+    assert "cancelled" in events
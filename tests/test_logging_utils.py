@@ -0,0 +1,22 @@
+import logging
+
+import logging_utils
+
+
+def test_switching_targets_closes_the_previous_file(tmp_path):
+    first, second = tmp_path / "first.log", tmp_path / "second.log"
+    try:
+        logging_utils.setup_logging(str(first), level="INFO")
+        [old_handler] = logging_utils._listener.handlers
+        logging.getLogger("test").info("to the first file")
+
+        logging_utils.setup_logging(str(second), level="INFO")
+        logging.getLogger("test").info("to the second file")
+        logging_utils._stop_listener()
+
+        assert old_handler.stream is None
+        assert "to the first file" in first.read_text()
+        assert "to the second file" in second.read_text()
+        assert "to the second file" not in first.read_text()
+    finally:
+        logging_utils.setup_logging(level="WARNING")
@@ -0,0 +1,114 @@
+import pytest
+
+import chatbot
+from cloudprinter_api import CloudprinterAPIError
+from models import QuoteResponse
+from option_graph import OptionGraph, OptionGraphStore
+from sessions import Session, use_session
+
+
+def make_graph(reference="card"):
+    return OptionGraph(reference, {"paper": ["matte", "gloss"], "finish": ["none", "foil"]},
+                       {"paper": "matte", "finish": "none"})
+
+
+def quote():
+    return QuoteResponse(price="10.00", vat="0", currency="EUR", expire_date="2099-01-01T00:00:00", subtotals={},
+                         shipments=[], invoice_currency="EUR", invoice_exchange_rate="1")
+
+
+class QuoteClient:
+    """Rejects quotes like the API does, for the options or for the request."""
+    api_key = "test"
+
+    def __init__(self, rejected_options=(), error=None):
+        self.rejected_options = set(rejected_options)
+        self.error = error
+        self.requests = []
+
+    def get_quote(self, request):
+        options = {option.type for option in request.items[0].options}
+        self.requests.append(options)
+        if self.error:
+            raise CloudprinterAPIError(400, self.error)
+        if options & self.rejected_options:
+            raise CloudprinterAPIError(400, '{"error": "Options are not available together"}')
+        return quote()
+
+
+@pytest.fixture
+def graphs(monkeypatch, tmp_path):
+    store = OptionGraphStore({}, path=str(tmp_path / "graphs.json"))
+    monkeypatch.setattr(chatbot, "get_option_graphs", lambda: store)
+    return store
+
+
+def request_quote(monkeypatch, graphs, reference, client, quantity="100", country="NL"):
+    graphs.graphs[reference] = make_graph(reference)
+    monkeypatch.setattr(chatbot, "get_cloudprinter_client", lambda: client)
+    with use_session(Session()):
+        result = chatbot.get_quote(reference, quantity, country, options=[{"reference": "foil"}])
+    assert "error" in result
+    return graphs.get(reference)
+
+
+def test_a_rejection_that_names_an_option_records_the_combination(monkeypatch, graphs):
+    client = QuoteClient(error='{"error": "Option foil is not available for card_named"}')
+
+    graph = request_quote(monkeypatch, graphs, "card_named", client)
+
+    assert graph.invalid_combinations == {frozenset({"matte", "foil"})}
+    assert len(client.requests) == 1
+
+
+def test_a_rejection_the_default_options_pass_records_the_combination(monkeypatch, graphs):
+    graph = request_quote(monkeypatch, graphs, "card_combination", QuoteClient(rejected_options={"foil"}))
+
+    assert graph.invalid_combinations == {frozenset({"matte", "foil"})}
+    assert graph.validate_choice("finish", "foil") is not None
+
+
+@pytest.mark.parametrize("error", ['{"error": "Invalid count abc"}', '{"error": "State is required for US"}'])
+def test_a_rejection_for_the_quantity_or_destination_records_nothing(monkeypatch, graphs, error):
+    client = QuoteClient(error=error)
+
+    graph = request_quote(monkeypatch, graphs, "card_request", client, quantity="abc")
+
+    assert graph.invalid_combinations == set()
+    assert graph.validate_choice("finish", "foil") is None
+    assert len(client.requests) == 2
+
+
+def test_resolve_fills_unselected_types_with_defaults():
+    graph = make_graph()
+
+    assert graph.resolve({}) == {"matte", "none"}
+    assert graph.resolve({"finish": "foil"}) == {"matte", "foil"}
+
+
+def test_validate_choice_rejects_unknown_and_known_invalid_options():
+    graph = make_graph()
+    graph.record_invalid(["gloss", "foil"])
+
+    assert "Unknown option type" in graph.validate_choice("size", "a4")
+    assert "not available" in graph.validate_choice("paper", "silk")
+    assert "previously rejected" in graph.validate_choice("finish", "foil", {"paper": "gloss"})
+    assert graph.validate_choice("finish", "foil") is None
+
+
+def test_save_merges_with_what_another_process_wrote(tmp_path):
+    path = str(tmp_path / "graphs.json")
+    chat = OptionGraphStore({"card": make_graph("card"), "gone": make_graph("gone")}, path)
+    chat.save()
+    warmup = OptionGraphStore.load(path)
+
+    chat.record_invalid("card", ["gloss", "foil"])
+    chat.save()
+    warmup.remove("gone")
+    warmup.graphs["flyer"] = make_graph("flyer")
+    warmup.save()
+
+    saved = OptionGraphStore.load(path)
+    assert set(saved.graphs) == {"card", "flyer"}
+    assert saved.get("card").invalid_combinations == {frozenset({"gloss", "foil"})}
+
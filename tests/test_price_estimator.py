@@ -0,0 +1,72 @@
+import pytest
+
+from models import Product, QuoteResponse, Shipment, ShipmentQuote
+from price_estimator import PriceEstimator
+
+
+def quote(quantity, unit_price, surcharge=0.0, shipping="5.00"):
+    items = quantity * (unit_price + surcharge)
+    return QuoteResponse(
+        price=f"{items + 2:.2f}", vat="0", currency="EUR", expire_date="2099-01-01T00:00:00",
+        subtotals={"items": f"{items:.2f}"}, invoice_currency="EUR", invoice_exchange_rate="1",
+        shipments=[Shipment(total_weight=str(quantity * 10), items=[], quotes=[ShipmentQuote(
+            quote="q", service="post", shipping_level="cp_postal", shipping_option="standard", price=shipping,
+            vat="0", currency="EUR")])],
+    )
+
+
+def observe_volume_discount(estimator, reference="card"):
+    # Unit price halves with every tenfold quantity; the gloss option adds 20%
+    for quantity, unit_price in [(10, 1.0), (100, 0.5), (1000, 0.25)]:
+        estimator.observe(reference, str(quantity), "NL", ["matte"], quote(quantity, unit_price))
+        estimator.observe(reference, str(quantity), "NL", ["gloss"], quote(quantity, unit_price * 1.2))
+
+
+def test_estimates_follow_the_fitted_curve_and_option_surcharges():
+    estimator = PriceEstimator()
+    observe_volume_discount(estimator)
+
+    matte = estimator.estimate("card", "100", "NL", ["matte"])
+    gloss = estimator.estimate("card", "100", "NL", ["gloss"])
+
+    assert matte["basis"] == "past_quotes"
+    assert matte["price"] == pytest.approx(52.0, rel=0.01)
+    assert gloss["price"] == pytest.approx(62.0, rel=0.01)
+    assert matte["low"] < matte["price"] < matte["high"]
+    assert matte["shipping"] == {"shipping_level": "cp_postal", "price": 5.0, "basis": "country"}
+
+
+def test_products_without_quotes_fall_back_to_the_catalog_price():
+    estimator = PriceEstimator()
+    product = Product(name="Flyer", reference="flyer", from_price="0.40", currency="EUR")
+
+    estimate = estimator.estimate("flyer", "50", "DE", product=product)
+
+    assert estimate["basis"] == "from_price"
+    assert estimate["price"] == 20.0
+    assert "error" in estimator.estimate("poster", "50")
+
+
+def test_observing_a_quote_defers_loading_and_fitting_to_the_next_estimate():
+    loads = []
+    estimator = PriceEstimator(load=lambda reference, limit: loads.append(reference) or [])
+    observe_volume_discount(estimator)
+
+    assert loads == [] and estimator.stats["fits"] == 0
+
+    estimator.estimate("card", "100", options=["matte"])
+    estimator.observe("card", "100", "NL", ["matte"], quote(100, 0.6))
+    assert estimator.stats["fits"] == 1 and estimator.summary()["scored_quotes"] == 0
+
+    estimator.estimate("card", "100", options=["matte"])
+    assert loads == ["card"]
+    assert estimator.stats["fits"] == 2
+    assert estimator.summary()["scored_quotes"] == 1
+
+
+def test_stored_quotes_already_observed_are_not_counted_twice():
+    stored = [(100, "NL", frozenset({"matte"}), quote(100, 0.5)), (10, "NL", frozenset({"matte"}), quote(10, 1.0))]
+    estimator = PriceEstimator(load=lambda reference, limit: stored)
+    estimator.observe("card", "100", "NL", ["matte"], quote(100, 0.5))
+
+    assert estimator.estimate("card", "100", options=["matte"])["quotes_used"] == 2
@@ -0,0 +1,15 @@
+import prompt_assembly
+from catalog_warmup import CatalogSnapshot
+from models import Product
+
+
+def test_digest_instructions_only_accompany_a_digest(monkeypatch):
+    monkeypatch.setattr(prompt_assembly, "current_snapshot", lambda: None)
+    assert prompt_assembly.stable_system_message()["content"] == prompt_assembly.SYSTEM_PROMPT
+    assert "digest" not in prompt_assembly.SYSTEM_PROMPT
+
+    snapshot = CatalogSnapshot([Product(name="Flyer A5", reference="flyer_a5", category="Flyers")], {}, {})
+    monkeypatch.setattr(prompt_assembly, "current_snapshot", lambda: snapshot)
+    content = prompt_assembly.stable_system_message()["content"]
+    assert prompt_assembly.CATALOG_DIGEST_PROMPT in content
+    assert "flyer_a5" in content
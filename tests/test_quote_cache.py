@@ -0,0 +1,53 @@
+import threading
+import time
+
+from deadlines import Deadline, use_deadline
+from option_graph import OptionGraph
+from quote_cache import QuoteCache, QuotePrefetcher, quote_cache_key
+
+
+def make_graph():
+    return OptionGraph("p1", {"paper": ["a", "b", "c", "d"]}, {"paper": "a"})
+
+
+def wait_for(prefetcher):
+    for future in list(prefetcher._in_flight.values()):
+        future.result(timeout=5)
+
+
+def test_prefetch_budget_is_restored_once_the_cache_ttl_passes():
+    prefetcher = QuotePrefetcher(QuoteCache(ttl=0.2), lambda *args: object(), budget=2)
+
+    assert prefetcher.prefetch(make_graph(), {}, "10", "NL") == 2
+    wait_for(prefetcher)
+    assert prefetcher.prefetch(make_graph(), {}, "10", "NL") == 0
+    assert prefetcher.stats["over_budget"] == 2
+
+    time.sleep(0.3)
+    assert prefetcher.prefetch(make_graph(), {}, "10", "NL") == 2
+    wait_for(prefetcher)
+    assert len(prefetcher._spent) == 1
+    assert len(prefetcher._prefetched) == 2
+
+
+def test_lookup_gives_up_on_a_prefetch_at_the_turn_deadline():
+    release = threading.Event()
+    prefetcher = QuotePrefetcher(QuoteCache(), lambda *args: release.wait(5) and object())
+    prefetcher.fetch_in_background("p1", "10", "NL", None, ["a"])
+
+    with use_deadline(Deadline(budget=0.1)):
+        assert prefetcher.lookup(quote_cache_key("p1", "10", "NL", None, ["a"])) is None
+    assert prefetcher.stats["misses"] == 1
+    release.set()
+
+
+def test_cache_lookups_run_outside_the_prefetcher_lock():
+    class CheckingCache(QuoteCache):
+        def get(self, key):
+            assert not prefetcher._lock.locked()
+            return super().get(key)
+
+    prefetcher = QuotePrefetcher(CheckingCache(), lambda *args: object())
+
+    assert prefetcher.prefetch(make_graph(), {}, "10", "NL") == 4
+    assert prefetcher.fetch_in_background("p1", "10", "NL", None, ["a"]) is False
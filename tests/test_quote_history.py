@@ -0,0 +1,69 @@
+import os
+import time
+
+from models import QuoteResponse
+from quote_cache import QuoteCache, quote_cache_key
+from quote_history import QuoteHistoryStore
+
+
+def quote(price, expire_date="2099-01-01T00:00:00"):
+    return QuoteResponse(price=price, vat="0", currency="EUR", expire_date=expire_date, subtotals={},
+                         shipments=[], invoice_currency="EUR", invoice_exchange_rate="1")
+
+
+def make_store(tmp_path):
+    return QuoteHistoryStore(path=os.path.join(tmp_path, "quotes.sqlite3"), enabled=True)
+
+
+def record(store, price, options=("a",), **kwargs):
+    assert store.record("p1", "10", "nl", None, options, {"items": []}, quote(price, **kwargs))
+
+
+def test_recorded_quotes_are_found_by_their_exact_request(tmp_path):
+    store = make_store(tmp_path)
+    record(store, "12.50", options=("b", "a"))
+    store.flush()
+
+    found = store.lookup("p1", "10", "NL", None, ["a", "b"], since=0)
+    assert found[1].price == "12.50"
+    assert store.lookup("p1", "10", "NL", None, ["a"], since=0) is None
+    assert store.lookup("p1", "20", "NL", None, ["a", "b"], since=0) is None
+    store.close()
+
+
+def test_lookup_skips_quotes_that_are_too_old_or_expired(tmp_path):
+    store = make_store(tmp_path)
+    record(store, "12.50", expire_date="2000-01-01T00:00:00")
+    store.flush()
+    assert store.lookup("p1", "10", "NL", None, ["a"], since=0) is None
+
+    record(store, "13.00")
+    store.flush()
+    assert store.lookup("p1", "10", "NL", None, ["a"], since=time.time() + 1) is None
+    assert store.lookup("p1", "10", "NL", None, ["a"], since=0)[1].price == "13.00"
+    store.close()
+
+
+def test_compact_keeps_the_newest_quotes_per_request(tmp_path):
+    store = make_store(tmp_path)
+    for price in ("1", "2", "3", "4"):
+        record(store, price)
+    store.flush()
+
+    assert store.compact(keep_per_key=2) == 2
+    assert [response.price for _, _, _, response in store.recent("p1", 10)] == ["3", "4"]
+    store.close()
+
+
+def test_the_quote_cache_serves_stored_quotes_after_a_restart(tmp_path):
+    store = make_store(tmp_path)
+    record(store, "12.50")
+    store.flush()
+
+    cache = QuoteCache(history=make_store(tmp_path))
+    key = quote_cache_key("p1", "10", "nl", None, ["a"])
+    assert cache.get(key).price == "12.50"
+
+    cache.invalidate_product("p1")
+    assert cache.get(key) is None
+    store.close()
@@ -0,0 +1,75 @@
+import os
+
+from session_log import SessionLog, compact_messages
+from sessions import Session
+
+
+def turn(n):
+    return [{"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}]
+
+
+def make_log(tmp_path, **kwargs):
+    return SessionLog(path=os.path.join(tmp_path, "sessions.sqlite3"), enabled=True, **kwargs)
+
+
+def test_appended_turns_are_resumed(tmp_path):
+    log = make_log(tmp_path)
+    session = Session(messages=[{"role": "system", "content": "prompt"}])
+    for n in range(3):
+        session.messages.extend(turn(n))
+        session.context["quantity"] = str(n)
+        log.append_turn(session)
+
+    resumed = make_log(tmp_path).load(session.session_id)
+
+    assert resumed.messages == session.messages
+    assert resumed.context["quantity"] == "2"
+    assert resumed.token_usage == session.token_usage
+
+
+def test_turns_after_a_resume_append_to_the_resumed_history(tmp_path):
+    log = make_log(tmp_path)
+    session = Session(messages=turn(0))
+    log.append_turn(session)
+
+    resumed = log.load(session.session_id)
+    resumed.messages.extend(turn(1))
+    log.append_turn(resumed)
+
+    assert log.load(session.session_id).messages == turn(0) + turn(1)
+
+
+def test_long_histories_are_compacted_to_their_latest_turns(tmp_path):
+    log = make_log(tmp_path, max_messages=10)
+    session = Session(messages=[{"role": "system", "content": "prompt"}])
+    for n in range(5):
+        session.messages.extend(turn(n))
+        log.append_turn(session)
+
+    resumed = log.load(session.session_id)
+
+    assert log.stats["compactions"] == 1
+    assert resumed.messages == [{"role": "system", "content": "prompt"}] + turn(3) + turn(4)
+
+
+def test_compaction_keeps_tool_results_with_their_call():
+    messages = [
+        {"role": "user", "content": "price?"},
+        {"role": "assistant", "content": None, "tool_calls": [{"id": "1"}]},
+        {"role": "tool", "tool_call_id": "1", "content": "{}"},
+        {"role": "assistant", "content": "10 EUR"},
+    ]
+
+    assert compact_messages(messages, 3, 10000) == []
+    assert compact_messages(messages, 4, 10000) == messages
+
+
+def test_reset_replaces_the_stored_history(tmp_path):
+    log = make_log(tmp_path)
+    session = Session(messages=turn(0) + turn(1))
+    log.append_turn(session)
+
+    session.reset()
+    log.reset(session)
+
+    assert log.load(session.session_id).messages == session.messages
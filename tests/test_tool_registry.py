@@ -0,0 +1,62 @@
+from typing import Annotated, Optional
+
+from pydantic import Field
+
+from tool_registry import ToolRegistry, tool_error
+
+
+def make_registry():
+    registry = ToolRegistry()
+
+    @registry.tool(description="Echo the arguments", idempotent=True)
+    def echo(
+        text: Annotated[str, Field(description="Some text")],
+        count: Annotated[Optional[str], Field(description="A count")] = None,
+    ):
+        return {"text": text, "count": count}
+
+    return registry
+
+
+def test_validate_coerces_numbers_and_ignores_unknown_arguments():
+    registry = make_registry()
+
+    assert registry.tools["echo"].validate({"text": "hi", "count": 5, "extra": 1}) == {"text": "hi", "count": "5"}
+
+
+def test_validate_omits_arguments_the_model_left_out():
+    registry = make_registry()
+
+    assert registry.tools["echo"].validate({"text": "hi"}) == {"text": "hi"}
+
+
+def test_call_reports_invalid_arguments_as_a_tool_error():
+    registry = make_registry()
+
+    result = registry.call("echo", {"count": "1"})
+
+    assert "text" in tool_error(result)
+
+
+def test_execute_runs_duplicate_idempotent_calls_once():
+    registry = make_registry()
+    calls = []
+
+    results = registry.execute([("echo", {"text": "a"}), ("echo", {"text": "a"})],
+                               call=lambda name, arguments: calls.append(arguments) or arguments)
+
+    assert calls == [{"text": "a"}]
+    assert results == [{"text": "a"}, {"text": "a"}]
+
+
+def test_option_arguments_keep_their_reference():
+    import chatbot
+
+    options = [{"type": "type_paper", "reference": "paper_300"}, {"reference": "finish_matt"}]
+
+    context_update = chatbot.registry.tools["update_conversation_context"].validate({"selected_options": options})
+    quote = chatbot.registry.tools["get_quote"].validate(
+        {"product_reference": "p1", "quantity": 100, "country": "NL", "options": options})
+
+    assert context_update["selected_options"] == options
+    assert quote["options"] == options
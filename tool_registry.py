@@ -0,0 +1,351 @@
+import contextvars
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+
+logger = logging.getLogger(__name__)
+
+TOOL_CACHE_TTL = int(os.getenv("TOOL_CACHE_TTL", "300"))
+TOOL_PARALLEL_WORKERS = int(os.getenv("TOOL_PARALLEL_WORKERS", "4"))
+
+# Models may send numbers for string fields (e.g. a quantity); accept them as
+# the tools always have, and ignore arguments a tool doesn't take
+ARGUMENT_CONFIG = ConfigDict(coerce_numbers_to_str=True, extra="ignore")
+
+
+def _inline_refs(schema: Any, definitions: Dict) -> Any:
+    # Inline $ref'd models and drop pydantic's titles and null alternatives,
+    # which only cost prompt tokens
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        # A model's docstring is written for developers, not for the model
+        definition = definitions[schema["$ref"].split("/")[-1]]
+        return _inline_refs({key: value for key, value in definition.items() if key != "description"}, definitions)
+    if "anyOf" in schema:
+        variants = [variant for variant in schema["anyOf"] if variant != {"type": "null"}]
+        if len(variants) == 1:
+            extra = {key: value for key, value in schema.items() if key not in ("anyOf", "default")}
+            if schema.get("default") is not None:
+                extra["default"] = schema["default"]
+            return _inline_refs({**variants[0], **extra}, definitions)
+    return {
+        key: _inline_refs(value, definitions)
+        for key, value in schema.items()
+        if key not in ("title", "$defs") and not (key == "default" and value is None)
+    }
+
+
+def parameters_schema(arguments_model: Type[BaseModel]) -> Dict:
+    """
+    Build an OpenAI function parameters schema from a pydantic model.
+
+    Args:
+        arguments_model: The model describing the tool's arguments.
+
+    Returns:
+        A JSON schema object with every property and a required list.
+    """
+    schema = arguments_model.model_json_schema()
+    parameters = _inline_refs(schema, schema.get("$defs", {}))
+    return {
+        "type": "object",
+        "properties": parameters.get("properties", {}),
+        "required": parameters.get("required", []),
+    }
+
+
+class Tool:
+    """
+    A function the model can call, with its schema and argument validator.
+    """
+
+    def __init__(self, func: Callable, name: str, description: str, arguments_model: Type[BaseModel],
+                 cacheable: bool = False, idempotent: bool = False, parallel_safe: bool = False):
+        """
+        Initialize the tool.
+
+        Args:
+            func: The implementation.
+            name: The name the model calls the tool by.
+            description: What the tool does, as shown to the model.
+            arguments_model: Validates and coerces the model's arguments.
+            cacheable: Results depend only on the arguments and may be reused
+                across turns and sessions for TOOL_CACHE_TTL seconds.
+            idempotent: Calling twice with the same arguments has the same effect
+                as calling once, so duplicate calls in one turn run once.
+            parallel_safe: The tool doesn't touch session state, apart from
+                adding its LLM calls to the session's usage counters (which
+                are updated under a lock), and may run concurrently with
+                other parallel-safe tools.
+        """
+        self.func = func
+        self.name = name
+        self.description = description
+        self.arguments_model = arguments_model
+        self.cacheable = cacheable
+        self.idempotent = idempotent or cacheable
+        self.parallel_safe = parallel_safe
+        self.schema = {
+            "type": "function",
+            "function": {
+                "name": name,
+                "description": description,
+                "parameters": parameters_schema(arguments_model),
+            },
+        }
+
+    def validate(self, arguments: Dict) -> Dict:
+        """
+        Validate the model's arguments.
+
+        Returns:
+            The keyword arguments to call the tool with; arguments the model
+            left out are omitted so the function's defaults apply.
+
+        Raises:
+            ValidationError: If the arguments don't match the schema.
+        """
+        validated = self.arguments_model.model_validate(arguments)
+        return validated.model_dump(exclude_unset=True)
+
+
+class ToolResultCache:
+    """
+    In-memory TTL cache of cacheable tool results keyed by name and arguments.
+    """
+
+    def __init__(self, ttl: int = TOOL_CACHE_TTL):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(name: str, arguments: Dict) -> Tuple[str, str]:
+        return name, json.dumps(arguments, sort_keys=True, default=str)
+
+    def get(self, key: Tuple[str, str]) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self.hits += 1
+                return True, entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return False, None
+
+    def put(self, key: Tuple[str, str], result: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), result)
+
+    def invalidate(self, name: Optional[str] = None) -> int:
+        """
+        Drop cached results, for one tool or all of them.
+
+        Returns:
+            The number of entries dropped.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if name is None or key[0] == name]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+
+class ToolRegistry:
+    """
+    The tools exposed to the model. Tools are registered with the @tool
+    decorator; their schemas are generated from type hints once and cached.
+    """
+
+    def __init__(self, cache: Optional[ToolResultCache] = None, max_workers: int = TOOL_PARALLEL_WORKERS):
+        self.tools: Dict[str, Tool] = {}
+        self.cache = cache or ToolResultCache()
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._schemas: Dict[Optional[Tuple[str, ...]], List[Dict]] = {}
+        self._schema_json: Dict[Optional[Tuple[str, ...]], str] = {}
+        self._lock = threading.Lock()
+
+    def tool(self, name: Optional[str] = None, description: Optional[str] = None,
+             arguments: Optional[Type[BaseModel]] = None, cacheable: bool = False,
+             idempotent: bool = False, parallel_safe: bool = False) -> Callable:
+        """
+        Register a function as a tool.
+
+        Parameters are described with Annotated[type, Field(description=...)]
+        hints; functions taking **kwargs pass a pydantic model as arguments.
+
+        Args:
+            name: The tool name. Defaults to the function name.
+            description: The tool description. Defaults to the docstring's first paragraph.
+            arguments: A pydantic model of the arguments, instead of the signature.
+            cacheable: See Tool.
+            idempotent: See Tool.
+            parallel_safe: See Tool.
+
+        Returns:
+            The decorator, which returns the function unchanged.
+        """
+        def register(func: Callable) -> Callable:
+            tool_name = name or func.__name__
+            tool_description = description or inspect.getdoc(func).split("\n\n")[0].replace("\n", " ")
+            arguments_model = arguments or self._arguments_model(func, tool_name)
+            with self._lock:
+                self.tools[tool_name] = Tool(func, tool_name, tool_description, arguments_model,
+                                             cacheable=cacheable, idempotent=idempotent,
+                                             parallel_safe=parallel_safe)
+                self._schemas.clear()
+                self._schema_json.clear()
+            return func
+        return register
+
+    @staticmethod
+    def _arguments_model(func: Callable, name: str) -> Type[BaseModel]:
+        fields = {}
+        for parameter in inspect.signature(func, eval_str=True).parameters.values():
+            annotation = Any if parameter.annotation is inspect.Parameter.empty else parameter.annotation
+            default = ... if parameter.default is inspect.Parameter.empty else parameter.default
+            fields[parameter.name] = (annotation, default)
+        model_name = "".join(part.capitalize() for part in name.split("_")) + "Arguments"
+        return create_model(model_name, __config__=ARGUMENT_CONFIG, **fields)
+
+    def schemas(self, names: Optional[Iterable[str]] = None) -> List[Dict]:
+        """
+        Get the OpenAI tool schemas, built once per set of tools.
+
+        Args:
+            names: The tools to include, in order. All tools if None.
+
+        Returns:
+            The schemas. The same list is returned on every call; don't modify it.
+        """
+        key = tuple(names) if names is not None else None
+        schemas = self._schemas.get(key)
+        if schemas is None:
+            selected = self.tools.values() if key is None else [self.tools[name] for name in key]
+            schemas = self._schemas[key] = [tool.schema for tool in selected]
+        return schemas
+
+    def schema_json(self, names: Optional[Iterable[str]] = None) -> str:
+        """
+        Get the tool schemas serialized as compact JSON, e.g. for token counts.
+        """
+        key = tuple(names) if names is not None else None
+        serialized = self._schema_json.get(key)
+        if serialized is None:
+            serialized = self._schema_json[key] = json.dumps(self.schemas(key), separators=(",", ":"))
+        return serialized
+
+    def call(self, name: str, arguments: Dict) -> Any:
+        """
+        Validate the arguments and call a tool, serving cacheable tools from the cache.
+
+        Args:
+            name: The tool name.
+            arguments: The arguments from the model.
+
+        Returns:
+            The tool's result, or {"error": ...} if the arguments are invalid.
+
+        Raises:
+            ValueError: If there is no such tool.
+        """
+        tool = self.tools.get(name)
+        if tool is None:
+            raise ValueError(f"Unknown function: {name}")
+        try:
+            kwargs = tool.validate(arguments)
+        except ValidationError as e:
+            logger.info(f"Invalid arguments for {name}: {e.error_count()} errors")
+            problems = "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+            return {"error": f"Invalid arguments for {name}: {problems}"}
+
+        if not tool.cacheable:
+            return tool.func(**kwargs)
+        key = self.cache.key(name, kwargs)
+        found, result = self.cache.get(key)
+        if found:
+            logger.info(f"Served {name} from the tool cache")
+            return result
+        result = tool.func(**kwargs)
+        if tool_error(result) is None:
+            self.cache.put(key, result)
+        return result
+
+    def execute(self, calls: Sequence[Tuple[str, Dict]], call: Optional[Callable[[str, Dict], Any]] = None) -> List[Any]:
+        """
+        Run a batch of tool calls from one model response.
+
+        Parallel-safe tools run concurrently with each other, before the rest
+        run one at a time in order. Identical calls to idempotent tools run once.
+
+        Args:
+            calls: (name, arguments) pairs.
+            call: Runs one call. Defaults to self.call.
+
+        Returns:
+            The results, in the same order as the calls.
+        """
+        call = call or self.call
+        results: List[Any] = [None] * len(calls)
+
+        # Collapse duplicate idempotent calls onto the first occurrence
+        first_index: Dict[Tuple[str, str], int] = {}
+        duplicates: Dict[int, int] = {}
+        for index, (name, arguments) in enumerate(calls):
+            tool = self.tools.get(name)
+            if tool is not None and tool.idempotent:
+                key = self.cache.key(name, arguments)
+                if key in first_index:
+                    duplicates[index] = first_index[key]
+                    continue
+                first_index[key] = index
+        pending = [index for index in range(len(calls)) if index not in duplicates]
+
+        parallel = [index for index in pending
+                    if calls[index][0] in self.tools and self.tools[calls[index][0]].parallel_safe]
+        if len(parallel) > 1:
+            executor = self._get_executor()
+            # Each call runs in a copy of this context, so it sees the current session
+            futures = {index: executor.submit(contextvars.copy_context().run, call, *calls[index])
+                       for index in parallel}
+            for index, future in futures.items():
+                results[index] = future.result()
+            pending = [index for index in pending if index not in futures]
+
+        for index in pending:
+            results[index] = call(*calls[index])
+        for index, original in duplicates.items():
+            results[index] = results[original]
+        return results
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+        return self._executor
+
+
+def tool_error(result: Any) -> Optional[str]:
+    """
+    Get the error message from a tool result, if the tool failed.
+    """
+    # List tools report failures as a single-element list
+    if isinstance(result, list) and len(result) == 1:
+        result = result[0]
+    if isinstance(result, dict) and "error" in result:
+        return str(result["error"])
+    return None